@@ -0,0 +1,50 @@
+"""
+Measure the time spent in a call to a theano function on a tiny graph, in
+microseconds, with and without the C fast path (config.vm.fast_call).
+
+Usage: python call_overhead.py [n_calls]
+
+"""
+from __future__ import print_function
+import sys
+import timeit
+
+import numpy
+
+import theano
+import theano.tensor as T
+
+
+def make_function(fast_call, trust_input=False):
+    theano.config.vm.fast_call = fast_call
+    x = T.dvector('x')
+    y = T.dvector('y')
+    w = theano.shared(numpy.ones(3), 'w')
+    f = theano.function([x, y], T.dot(x, w) + y,
+                        updates={w: w * 0.5})
+    f.trust_input = trust_input
+    return f
+
+
+def per_call_us(f, n_calls):
+    xv = numpy.ones(3)
+    yv = numpy.ones(3)
+    f(xv, yv)
+    t = min(timeit.repeat(lambda: f(xv, yv), number=n_calls, repeat=3))
+    return t / n_calls * 1e6
+
+
+def main(n_calls):
+    print('%i calls, best of 3 (us per call)' % n_calls)
+    for fast_call in (False, True):
+        for trust_input in (False, True):
+            f = make_function(fast_call, trust_input)
+            print('  fast_call=%-5s trust_input=%-5s %8.2f' % (
+                fast_call, trust_input, per_call_us(f, n_calls)))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        main(int(sys.argv[1]))
+    else:
+        main(100000)
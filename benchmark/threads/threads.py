@@ -0,0 +1,61 @@
+"""
+Measure how the throughput of a theano function scales with the number of
+Python threads calling it. The function is made reentrant and its Elemwise
+and Gemm nodes release the GIL around their computation, so the threads
+can compute at the same time.
+
+Usage: python threads.py [max_threads [n_calls]]
+
+"""
+from __future__ import print_function
+import sys
+import threading
+import time
+
+import numpy
+
+import theano
+import theano.tensor as T
+
+
+def make_function(size):
+    x = T.matrix('x')
+    w = theano.shared(numpy.random.rand(size, size).astype(
+        theano.config.floatX), 'w')
+    f = theano.function([x], T.tanh(T.dot(x, w)) * T.exp(-x))
+    f.set_reentrant()
+    return f
+
+
+def calls_per_second(f, xv, n_threads, n_calls):
+    def run():
+        for i in range(n_calls):
+            f(xv)
+    threads = [threading.Thread(target=run) for i in range(n_threads)]
+    t0 = time.time()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return n_threads * n_calls / (time.time() - t0)
+
+
+def main(max_threads, n_calls, size=256):
+    f = make_function(size)
+    xv = numpy.random.rand(size, size).astype(theano.config.floatX)
+    f(xv)
+    print('%ix%i matrices, %i calls per thread' % (size, size, n_calls))
+    print('  <threads> <calls/s> <speedup>')
+    base = None
+    n_threads = 1
+    while n_threads <= max_threads:
+        rate = calls_per_second(f, xv, n_threads, n_calls)
+        if base is None:
+            base = rate
+        print('  %9i %9.1f %9.2f' % (n_threads, rate, rate / base))
+        n_threads *= 2
+
+
+if __name__ == '__main__':
+    args = [int(a) for a in sys.argv[1:]]
+    main(*(args + [8, 200][len(args):]))
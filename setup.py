@@ -168,7 +168,8 @@ def do_setup():
                    '*.h', '*.cpp', 'ChangeLog'],
               'theano.misc': ['*.sh']
           },
-          scripts=['bin/theano-cache', 'bin/theano-nose', 'bin/theano-test'],
+          scripts=['bin/theano-cache', 'bin/theano-nose', 'bin/theano-test',
+                   'bin/theano-warm-cache'],
           keywords=' '.join([
               'theano', 'math', 'numerical', 'symbolic', 'blas',
               'numpy', 'gpu', 'autodiff', 'differentiation'
@@ -5,27 +5,41 @@ Driver of graph construction, optimization, and linking.
 from __future__ import print_function
 
 import copy
-from six import string_types, iteritems, iterkeys
-from six.moves import xrange
+import multiprocessing
+import os
+import sys
+import threading
+from collections import deque
+from six import string_types, iteritems, iterkeys, itervalues, reraise
+from six.moves import queue, xrange
 import six.moves.copyreg as copyreg
 import six.moves.cPickle as pickle
 from itertools import chain
 import time
+from timeit import default_timer
 import warnings
+import weakref
 import numpy
 
 import theano
 from theano import config, gof
+from contextlib import contextmanager
 from functools import partial
-from theano.compat import izip
+from theano.compat import izip, OrderedDict
 from theano.gof import graph
 import theano.compile.mode
 from theano.compile.io import (
     In, SymbolicInput, SymbolicInputKit, SymbolicOutput)
 from theano.compile.ops import deep_copy_op, view_op
-from theano.gof.graph import is_same_graph
+from theano.compile.profiling import collect_compile_profile
 from theano.gof.op import ops_with_inner_function
 
+try:
+    from concurrent.futures import ThreadPoolExecutor
+except ImportError:
+    # Python 2 without the futures backport.
+    ThreadPoolExecutor = None
+
 import logging
 _logger = logging.getLogger('theano.compile.function_module')
 
@@ -202,6 +216,171 @@ def std_fgraph(input_specs, output_specs, accept_inplace=False):
 std_fgraph.features = [gof.toolbox.PreserveNames]
 
 
+class OptimizedGraphCache(object):
+    """
+    Cache of optimized FunctionGraphs, used by FunctionMaker when
+    config.cache_optimizations is True.
+
+    A graph is identified by a canonical key that does not depend on the
+    names or identities of its variables: the types of its inputs, the
+    Ops of its nodes in topological order with the positions of their
+    inputs, the signatures of its constants, and the optimizer and config
+    it is optimized with. The last optimized graphs are kept in memory
+    and, if config.cache_optimizations_on_disk is True, pickled in the
+    compiledir to be reused by other processes.
+
+    """
+
+    def __init__(self):
+        self.graphs = OrderedDict()  # key -> (inputs, outputs)
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(fgraph, input_specs, mode):
+        """
+        Return the canonical key of the unoptimized `fgraph` or None if it
+        can't be cached.
+
+        """
+        optimizer = getattr(mode, '_optimizer', None)
+        if isinstance(optimizer, gof.Query):
+            optimizer = str(optimizer)
+        elif optimizer is None:
+            return None
+
+        index = dict((v, i) for i, v in enumerate(fgraph.inputs))
+
+        def ref(v):
+            if v in index:
+                return index[v]
+            if isinstance(v, gof.Constant):
+                return ('constant', v.signature())
+            raise KeyError(v)
+
+        nodes = []
+        try:
+            for node in fgraph.toposort():
+                nodes.append((node.op, tuple(ref(v) for v in node.inputs),
+                              tuple(v.type for v in node.outputs)))
+                for v in node.outputs:
+                    index[v] = len(index)
+            outputs = tuple(ref(v) for v in fgraph.outputs)
+        except KeyError:
+            # A variable that is neither an input nor a constant.
+            return None
+        # Many options that change the optimized graph, like
+        # tensor.local_elemwise_fusion, are not in the key of the C code.
+        key = (optimizer,
+               theano.configparser.get_config_md5(only_c_key=False),
+               tuple(v.type for v in fgraph.inputs),
+               tuple(bool(spec.mutable) for spec in input_specs),
+               tuple(sorted(iteritems(fgraph.update_mapping or {}))),
+               tuple(nodes),
+               outputs)
+        try:
+            hash(key)
+        except TypeError:
+            # e.g. a constant whose data is not hashable.
+            return None
+        return key
+
+    def _filename(self, key):
+        if not isinstance(key[0], string_types):
+            return None
+        try:
+            digest = gof.utils.hash_from_code(pickle.dumps(key, -1))
+        except Exception:
+            return None
+        return os.path.join(config.compiledir, 'optimized_graphs',
+                            digest + '.pkl')
+
+    def get(self, key):
+        """
+        Return the (inputs, outputs) of the optimized graph of `key`, or
+        None.
+
+        """
+        graph = self.graphs.pop(key, None)
+        if graph is None and config.cache_optimizations_on_disk:
+            filename = self._filename(key)
+            if filename is not None and os.path.exists(filename):
+                try:
+                    with open(filename, 'rb') as f:
+                        graph = pickle.load(f)
+                except Exception:
+                    _logger.debug('Could not load optimized graph %s',
+                                  filename, exc_info=True)
+        if graph is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.graphs[key] = graph
+        return graph
+
+    def add(self, key, fgraph):
+        """
+        Store a detached copy of the optimized `fgraph` under `key`.
+
+        The inputs are replaced by fresh variables of the same types, so
+        that the cache does not keep the storage of shared variables
+        alive.
+
+        """
+        memo = dict((v, v.type()) for v in fgraph.inputs)
+        equiv = gof.graph.clone_get_equiv(fgraph.inputs, fgraph.outputs,
+                                          memo=memo)
+        graph = ([equiv[v] for v in fgraph.inputs],
+                 [equiv[v] for v in fgraph.outputs])
+        self.graphs[key] = graph
+        while len(self.graphs) > max(config.cache_optimizations_size, 0):
+            self.graphs.popitem(last=False)
+
+        if config.cache_optimizations_on_disk:
+            filename = self._filename(key)
+            if filename is None:
+                return
+            try:
+                dirname = os.path.dirname(filename)
+                if not os.path.isdir(dirname):
+                    os.makedirs(dirname)
+                tmp = '%s.%d' % (filename, os.getpid())
+                with open(tmp, 'wb') as f:
+                    pickle.dump(graph, f, -1)
+                os.rename(tmp, filename)
+            except Exception:
+                _logger.debug('Could not save optimized graph %s',
+                              filename, exc_info=True)
+
+    @staticmethod
+    def rebind(fgraph, graph):
+        """
+        Replace the outputs of the unoptimized `fgraph` by a copy of the
+        optimized `graph`, computed from the inputs of `fgraph`.
+
+        The inputs of `fgraph` include its shared variables, so the copy
+        uses the shared variables of the new function.
+
+        """
+        cached_inputs, cached_outputs = graph
+        memo = dict(izip(cached_inputs, fgraph.inputs))
+        equiv = gof.graph.clone_get_equiv(cached_inputs, cached_outputs,
+                                          memo=memo)
+        outputs = [equiv[v] for v in cached_outputs]
+        if (not hasattr(fgraph, 'destroyers') and
+                any(getattr(node.op, 'destroy_map', None)
+                    for node in gof.graph.io_toposort(fgraph.inputs,
+                                                      outputs))):
+            fgraph.attach_feature(gof.DestroyHandler())
+        for i, v in enumerate(outputs):
+            fgraph.change_input('output', i, v,
+                                reason='optimized graph cache')
+        fgraph.execute_callbacks('validate')
+
+
+optimized_graph_cache = OptimizedGraphCache()
+
+
 class AliasedMemoryError(Exception):
     """
     Memory is aliased that should not be.
@@ -218,6 +397,242 @@ class AliasedMemoryError(Exception):
 DUPLICATE = ['DUPLICATE']
 
 
+def _byte_extent(value):
+    """
+    Return the lowest and highest (excluded) addresses of the memory used by
+    the ndarray `value`, or None if it is empty.
+
+    """
+    if value.size == 0:
+        return None
+    interface = value.__array_interface__
+    low = high = interface['data'][0]
+    strides = interface['strides']
+    if strides is None:
+        return low, high + value.nbytes
+    for stride, dim in izip(strides, value.shape):
+        if stride > 0:
+            high += stride * (dim - 1)
+        else:
+            low += stride * (dim - 1)
+    return low, high + value.itemsize
+
+
+def aliased_input_groups(values, types):
+    """
+    Return the groups of indices of `values` that may share memory.
+
+    Only the values whose type has a `may_share_memory` method are checked,
+    and only against the values of the same type instance. The ndarrays are
+    grouped by sorting their memory extents, in O(n log n). The other values
+    are compared with `may_share_memory` to the groups of their type.
+
+    Parameters
+    ----------
+    values
+        The values of the inputs, None for the inputs without a value.
+    types
+        The type of each input.
+
+    Returns
+    -------
+    list
+        Sorted lists of more than one index.
+
+    """
+    by_type = {}
+    for i, (value, type_) in enumerate(izip(values, types)):
+        if value is not None and hasattr(type_, 'may_share_memory'):
+            by_type.setdefault(id(type_), (type_, []))[1].append(i)
+
+    groups = []
+    for type_, indices in itervalues(by_type):
+        if len(indices) < 2:
+            continue
+        extents = []
+        others = []
+        for i in indices:
+            if type(values[i]) is numpy.ndarray:
+                extent = _byte_extent(values[i])
+                if extent is not None:
+                    extents.append(extent + (i,))
+            else:
+                others.append(i)
+        extents.sort()
+        type_groups = []
+        group_high = None
+        for low, high, i in extents:
+            if group_high is not None and low < group_high:
+                type_groups[-1].append(i)
+                group_high = max(group_high, high)
+            else:
+                type_groups.append([i])
+                group_high = high
+        for i in others:
+            for group in type_groups:
+                if any(type_.may_share_memory(values[j], values[i])
+                       for j in group):
+                    group.append(i)
+                    break
+            else:
+                type_groups.append([i])
+        groups.extend(sorted(group) for group in type_groups
+                      if len(group) > 1)
+    return groups
+
+
+def _none_ref():
+    # Stands for the weak reference to an input without value.
+    return None
+
+
+def _input_signature(t, arg, value):
+    """
+    Return what `_match_input_signature` needs to know that the filter of
+    type `t` returns unchanged the arrays like `arg`, or None.
+
+    `value` is what the filter returned for `arg`.
+
+    """
+    from theano.tensor.type import TensorType
+    if (value is arg and type(arg) is numpy.ndarray and
+            type(t) is TensorType and not t.filter_checks_isfinite):
+        return (arg.dtype, arg.ndim,
+                tuple(i for i, b in enumerate(t.broadcastable) if b))
+    return None
+
+
+def _match_input_signature(signature, arg):
+    # Replicates the checks that the filter of a TensorType does on an
+    # ndarray of the right dtype.
+    dtype, ndim, broadcastable = signature
+    if (type(arg) is not numpy.ndarray or arg.dtype is not dtype or
+            arg.ndim != ndim or not arg.flags.aligned):
+        return False
+    shape = arg.shape
+    for i in broadcastable:
+        if shape[i] != 1:
+            return False
+    return True
+
+
+class FunctionExecutor(object):
+    """
+    Run the calls of a reentrant `Function` in a pool of threads.
+
+    This is what `Function.call_async` uses, see `Function.set_async`.
+
+    Parameters
+    ----------
+    fn : Function
+        The function to call. It must be reentrant.
+    max_workers : int
+        The number of threads of the pool made when `executor` is None.
+    max_pending : int or None
+        The maximum number of calls submitted and not finished yet. None
+        means no limit.
+    block : bool
+        What `submit` does when there are `max_pending` calls: wait for one
+        of them to finish if True, else raise `six.moves.queue.Full`.
+    executor : concurrent.futures.Executor or None
+        The executor running the calls, instead of a thread pool.
+    n_latencies : int
+        The number of most recent calls whose times are kept for `stats`.
+
+    """
+
+    def __init__(self, fn, max_workers, max_pending=None, block=True,
+                 executor=None, n_latencies=1000):
+        self.own_executor = executor is None
+        if executor is None:
+            if ThreadPoolExecutor is None:
+                raise ImportError("Function.call_async needs the"
+                                  " concurrent.futures module (install the"
+                                  " 'futures' package on Python 2).")
+            executor = ThreadPoolExecutor(max_workers)
+        self.fn = fn
+        self.executor = executor
+        self.max_pending = max_pending
+        self.block = block
+        self.lock = threading.Lock()
+        self.slots = None
+        if max_pending is not None:
+            self.slots = threading.Semaphore(max_pending)
+        self.n_queued = 0
+        self.n_running = 0
+        self.n_done = 0
+        self.n_failed = 0
+        self.wait_times = deque(maxlen=n_latencies)
+        self.latencies = deque(maxlen=n_latencies)
+
+    def submit(self, args, kwargs):
+        """Submit a call to the function and return its future."""
+        if self.slots is not None and not self.slots.acquire(self.block):
+            raise queue.Full("%i calls of the function are already"
+                             " pending." % self.max_pending)
+        with self.lock:
+            self.n_queued += 1
+        try:
+            return self.executor.submit(self._run, default_timer(),
+                                        args, kwargs)
+        except Exception:
+            with self.lock:
+                self.n_queued -= 1
+            if self.slots is not None:
+                self.slots.release()
+            raise
+
+    def _run(self, t0, args, kwargs):
+        t1 = default_timer()
+        with self.lock:
+            self.n_queued -= 1
+            self.n_running += 1
+        failed = True
+        try:
+            rval = self.fn(*args, **kwargs)
+            failed = False
+            return rval
+        finally:
+            t2 = default_timer()
+            with self.lock:
+                self.n_running -= 1
+                self.n_done += 1
+                self.n_failed += failed
+                self.wait_times.append(t1 - t0)
+                self.latencies.append(t2 - t0)
+            if self.slots is not None:
+                self.slots.release()
+
+    def stats(self):
+        """
+        Return a dict describing the state of the queue and the latencies.
+
+        The keys are 'queued' (calls waiting for a thread), 'running',
+        'done', 'failed', and for the most recent calls 'wait_mean',
+        'latency_mean', 'latency_p50', 'latency_p99' and 'latency_max',
+        in seconds. The latency goes from `submit` to the end of the call,
+        the wait time from `submit` to the start of the call.
+
+        """
+        with self.lock:
+            rval = dict(queued=self.n_queued, running=self.n_running,
+                        done=self.n_done, failed=self.n_failed)
+            wait_times = list(self.wait_times)
+            latencies = list(self.latencies)
+        if latencies:
+            p50, p99 = numpy.percentile(latencies, [50, 99])
+            rval.update(wait_mean=float(numpy.mean(wait_times)),
+                        latency_mean=float(numpy.mean(latencies)),
+                        latency_p50=float(p50), latency_p99=float(p99),
+                        latency_max=max(latencies))
+        return rval
+
+    def shutdown(self, wait=True):
+        """Shut down the thread pool, unless the executor was given."""
+        if self.own_executor:
+            self.executor.shutdown(wait)
+
+
 class Function(object):
     """
     Type of the functions returned by theano.function or
@@ -251,6 +666,14 @@ class Function(object):
     numpy tensor.  C code should raise an error if you pass an object
     of the wrong type.
 
+    A call may be given an ``out`` keyword argument (unless an input is
+    named ``out``): one numpy.ndarray per returned output, or None, in a
+    list (or a dict for a function returning a dict). The outputs are
+    then written in these arrays, which are returned. They must have the
+    dtype and the shape of the outputs, and not overlap. The Ops that
+    reuse their output storage compute directly in the C-contiguous ones,
+    the others are copied in. See also `set_output_buffers`.
+
     Attributes
     ----------
     finder
@@ -359,6 +782,68 @@ class Function(object):
 
     """
 
+    _fast_call = None
+    """
+    The C implementation of `__call__` made by `_make_fast_call` at the
+    first call, or False if it is not used.
+
+    """
+
+    _map_fast_call = None
+    """
+    The C implementation of `__call__` used by `map`, or False if it can
+    not be used.
+
+    """
+
+    _aliased_inputs_cache = None
+    """
+    Weak references to the inputs of the last call whose aliasing was
+    checked, and the groups of aliased inputs found.
+
+    """
+
+    _contexts = ()
+    """
+    The execution contexts made for reentrant calls, see `set_reentrant`.
+
+    """
+
+    _free_contexts = ()
+    _n_contexts = 0
+    _max_contexts = None
+    _contexts_cond = None
+    _reentrant = False
+
+    _executor = None
+    """
+    The `FunctionExecutor` running the calls of `call_async`.
+
+    """
+
+    _input_signatures = None
+    """
+    For each input, the signature of the last array that its filter
+    returned unchanged, or None. The next arrays with the same signature
+    are bound without calling the filter, see `_input_signature`.
+
+    """
+
+    _output_buffers = None
+    """
+    The arrays in which the outputs are written, set by
+    `set_output_buffers`.
+
+    """
+
+    _output_cells = None
+    """
+    The storage cells of the returned outputs, in which `__call__` puts
+    the output buffers. An entry is None if the VM does not let us do
+    that.
+
+    """
+
     def __init__(self, fn, input_storage, output_storage, indices, outputs,
                  defaults, unpack_single, return_none, output_keys, maker):
         self.fn = fn
@@ -751,8 +1236,424 @@ class Function(object):
         f_cpy.maker.fgraph.name = name
         return f_cpy
 
+    def _make_fast_call(self):
+        """
+        Return the C implementation of `__call__` for this function, or
+        False if it can not be used.
+
+        It can be used when the function is not profiled, does not return
+        a dict, and the only inputs that are not required are implicit, so
+        all the arguments are given positionally.
+
+        """
+        FastCall = getattr(gof.vm, 'FastCall', None)
+        if (FastCall is None or
+                self.profile or self.output_keys is not None):
+            return False
+        if any(indices is not None for _, indices, _ in self.indices):
+            return False
+        from theano.tensor.type import TensorType
+
+        filters, exact_types, dtypes, ndims = [], [], [], []
+        broadcastable, alignments = [], []
+        n_required = 0
+        for i, (c, (required, refeed, value)) in enumerate(
+                zip(self.input_storage, self.defaults)):
+            if not required:
+                if not c.implicit or refeed:
+                    return False
+                continue
+            if i != n_required:
+                # The required inputs are not the first ones.
+                return False
+            n_required += 1
+            filters.append(partial(c.type.filter, strict=c.strict,
+                                   allow_downcast=c.allow_downcast))
+            if (type(c.type) is TensorType and
+                    not c.type.filter_checks_isfinite):
+                # The filter returns these arrays unchanged.
+                exact_types.append(numpy.ndarray)
+                dtypes.append(c.type.numpy_dtype)
+                ndims.append(c.type.ndim)
+                broadcastable.append([i for i, b in
+                                      enumerate(c.type.broadcastable) if b])
+                alignments.append(c.type.numpy_dtype.alignment)
+            else:
+                exact_types.append(None)
+                dtypes.append(None)
+                ndims.append(-1)
+                broadcastable.append([])
+                alignments.append(1)
+
+        # The inputs whose type has the same instance may share memory.
+        alias_groups = []
+        type_ids = {}
+        check_aliased = getattr(self, '_check_for_aliased_inputs', True)
+        for c in self.input_storage:
+            if check_aliased and hasattr(c.type, 'may_share_memory'):
+                alias_groups.append(type_ids.setdefault(id(c.type),
+                                                        len(type_ids)))
+            else:
+                alias_groups.append(-1)
+
+        if getattr(self.fn, 'allow_gc', False):
+            gc_cells = [c.storage for c, o in
+                        zip(self.output_storage, self.maker.fgraph.outputs)
+                        if o.owner is not None]
+        else:
+            gc_cells = []
+        return FastCall(
+            fn=self.fn,
+            mode=self.maker.mode,
+            input_cells=[c.storage for c in self.input_storage],
+            filters=filters,
+            exact_types=exact_types,
+            dtypes=dtypes,
+            ndims=ndims,
+            broadcastable=broadcastable,
+            alignments=alignments,
+            alias_groups=alias_groups,
+            may_share_memory=[getattr(c.type, 'may_share_memory', None)
+                              for c in self.input_storage],
+            output_containers=self.output_storage,
+            gc_cells=gc_cells,
+            update_containers=[
+                c for i, c in zip(self.maker.expanded_inputs,
+                                  self.input_storage)
+                if i.update is not None],
+            n_returned=self.n_returned_outputs,
+            need_update_inputs=int(getattr(self.fn, 'need_update_inputs',
+                                           True)),
+            unpack_single=int(bool(self.unpack_single)),
+            return_none=int(bool(self.return_none)))
+
+    def _copy_aliased_inputs(self):
+        """
+        Copy the inputs that may share memory with another input.
+
+        In each group of aliased inputs, all the values are copied except
+        one, the value of an implicit input if there is one. When the
+        inputs are the same objects as in the previous call, the groups
+        found then are used again.
+
+        """
+        values = [c.storage[0] for c in self.input_storage]
+        cache = self._aliased_inputs_cache
+        if (cache is not None and len(cache[0]) == len(values) and
+                all(ref() is value for ref, value in izip(cache[0], values))):
+            groups = cache[1]
+        else:
+            groups = aliased_input_groups(
+                values, [i.variable.type for i in self.maker.inputs])
+            try:
+                refs = [_none_ref if value is None else weakref.ref(value)
+                        for value in values]
+                self._aliased_inputs_cache = (refs, groups)
+            except TypeError:
+                # Some values do not support weak references.
+                self._aliased_inputs_cache = None
+        for group in groups:
+            keep = group[0]
+            for i in group:
+                if self.input_storage[i].implicit:
+                    keep = i
+                    break
+            for i in group:
+                if i != keep:
+                    storage = self.input_storage[i].storage
+                    storage[0] = copy.copy(storage[0])
+
+    def _raise_fn_error(self):
+        """Re-raise the exception raised while running `self.fn`."""
+        if getattr(self.fn, 'position_of_error', -1) != -1:
+            # this is a new vm-provided function or c linker
+            # they need this because the exception manipulation
+            # done by raise_with_op is not implemented in C.
+            thunk = None
+            if hasattr(self.fn, 'thunks'):
+                thunk = self.fn.thunks[self.fn.position_of_error]
+            gof.link.raise_with_op(
+                node=self.fn.nodes[self.fn.position_of_error],
+                thunk=thunk,
+                storage_map=getattr(self.fn, 'storage_map', None))
+        else:
+            # old-style linkers raise their own exceptions, and there is no
+            # node to blame when the error was not raised by a thunk.
+            raise
+
+    def set_reentrant(self, reentrant=True, max_contexts=None):
+        """
+        Allow several threads to call this function at the same time.
+
+        Each call then runs in an execution context: the storage of the
+        inputs, outputs and intermediate results, and the VM using it. When
+        all the contexts are in use, a new one is linked from the same
+        optimized graph, which reuses the compiled C modules and shares the
+        storage of the shared variables. The contexts are kept in a pool for
+        the next calls.
+
+        The function itself only holds the defaults of the calls: a call
+        takes its ``trust_input``, and the default values set with
+        ``f[name] = value`` since the previous call. A function with
+        updates is its own single context, so its calls are run one at a
+        time.
+
+        Parameters
+        ----------
+        reentrant : bool
+            If False, go back to calling the function directly. The contexts
+            already made are kept.
+        max_contexts : int or None
+            The callers wait for a free context when there are that many.
+            None means no limit. The calls to a function with updates are
+            always run one at a time, in a single context.
+
+        """
+        if self.n_returned_outputs != len(self.output_storage):
+            max_contexts = 1
+        if reentrant:
+            if self._output_buffers is not None:
+                raise ValueError("The concurrent calls of a reentrant"
+                                 " function can not write in the same"
+                                 " output buffers.")
+            self._init_contexts()
+        self._max_contexts = max_contexts
+        self._reentrant = reentrant
+
+    def _init_contexts(self):
+        if self._contexts_cond is not None:
+            return
+        if any(indices is not None for _, indices, _ in self.indices):
+            raise TypeError("A function with SymbolicInputKit inputs can not"
+                            " have several execution contexts.")
+        if self.n_returned_outputs != len(self.output_storage):
+            self._contexts = [self]
+            self._free_contexts = [self]
+        else:
+            self._contexts = []
+            self._free_contexts = []
+        self._n_contexts = len(self._contexts)
+        self._contexts_cond = threading.Condition()
+
+    def _new_context(self):
+        input_storage = []
+        for c, (required, refeed, value) in zip(self.input_storage,
+                                                self.defaults):
+            if required:
+                input_storage.append(None)
+            elif refeed:
+                # The value set in the function is passed at each call.
+                input_storage.append(value)
+            else:
+                # Shared variables and values given as a Container.
+                input_storage.append(c)
+        context = self.maker.create(input_storage)
+        context.name = self.name
+        return context
+
+    def _pass_defaults(self, context):
+        """
+        Give to `context` the defaults of its next call.
+
+        As the next call of the function itself would, it uses the
+        default values set since the previous call, which are then put
+        back in the function.
+
+        """
+        if context is self:
+            return
+        context.trust_input = self.trust_input
+        context._check_for_aliased_inputs = getattr(
+            self, '_check_for_aliased_inputs', True)
+        for i, (required, refeed, value) in enumerate(self.defaults):
+            c = self.input_storage[i]
+            if refeed and c.provided:
+                context.input_storage[i].storage[0] = c.storage[0]
+                self[i] = value
+                c.provided = 0
+
+    @contextmanager
+    def _execution_context(self):
+        """Take a free execution context, and put it back when done."""
+        cond = self._contexts_cond
+        with cond:
+            while (not self._free_contexts and
+                   self._max_contexts is not None and
+                   self._n_contexts >= self._max_contexts):
+                cond.wait()
+            if self._free_contexts:
+                context = self._free_contexts.pop()
+                self._pass_defaults(context)
+            else:
+                # Link the new context out of the lock, in this slot.
+                context = None
+                self._n_contexts += 1
+        if context is None:
+            try:
+                context = self._new_context()
+            except Exception:
+                with cond:
+                    self._n_contexts -= 1
+                    cond.notify()
+                raise
+            with cond:
+                self._contexts.append(context)
+                self._pass_defaults(context)
+        try:
+            yield context
+        finally:
+            with cond:
+                self._free_contexts.append(context)
+                cond.notify()
+
     def __call__(self, *args, **kwargs):
+        if not self._reentrant:
+            return self._call(*args, **kwargs)
+        with self._execution_context() as context:
+            return context._call(*args, **kwargs)
+
+    def set_output_buffers(self, buffers):
+        """
+        Write the outputs of the next calls in caller-owned arrays.
+
+        Parameters
+        ----------
+        buffers
+            None to go back to returning new arrays. Otherwise, like the
+            `out` argument of `__call__`, which replaces it for one call.
+            The buffers are then returned by each call, holding the new
+            outputs. A reentrant function (see `set_reentrant`) can not
+            have such buffers.
+
+        """
+        if buffers is not None:
+            if self._reentrant:
+                raise ValueError("The concurrent calls of a reentrant"
+                                 " function can not write in the same"
+                                 " output buffers.")
+            buffers = self._output_buffer_list(buffers)
+        self._output_buffers = buffers
+
+    def _output_buffer_list(self, out):
+        """Check the `out` argument of `__call__` and make it a list."""
+        if isinstance(out, dict):
+            if self.output_keys is None:
+                raise TypeError("out can only be a dict for a function"
+                                " returning a dict.")
+            out = [out.get(k) for k in self.output_keys]
+        elif not isinstance(out, (list, tuple)):
+            out = [out]
+        if len(out) != self.n_returned_outputs:
+            raise ValueError("Expected %i output buffers, got %i." %
+                             (self.n_returned_outputs, len(out)))
+        for buf, var in zip(out, self.maker.fgraph.outputs):
+            if buf is None:
+                continue
+            if (not isinstance(buf, numpy.ndarray) or
+                    getattr(var.type, 'dtype', None) != str(buf.dtype) or
+                    getattr(var.type, 'ndim', None) != buf.ndim):
+                raise TypeError("The output buffer for %s must be a"
+                                " numpy.ndarray with the same dtype and"
+                                " number of dimensions, got %r." %
+                                (var, buf))
+        bufs = [buf for buf in out if buf is not None]
+        for i, buf in enumerate(bufs):
+            if any(numpy.may_share_memory(buf, other)
+                   for other in bufs[i + 1:]):
+                raise ValueError("The output buffers must not overlap.")
+        return list(out)
+
+    def _bind_output_buffers(self, out):
+        """
+        Put the output buffers in the storage of the outputs.
+
+        The Ops that reuse their output storage, like `Elemwise`, then
+        compute the outputs directly in the buffers. Their storage is
+        removed from the cells the VM clears at each call. Return the views
+        of the buffers that were bound, or None, and the cells removed, for
+        `_unbind_output_buffers`.
+
+        """
+        cells = self._output_cells
+        if cells is None:
+            if getattr(self.fn, 'pre_call_clear', None) is None:
+                cells = [None] * self.n_returned_outputs
+            else:
+                cells = [c.storage for c in
+                         self.output_storage[:self.n_returned_outputs]]
+            self._output_cells = cells
+        bound = [None] * len(cells)
+        inputs = None
+        for i, cell in enumerate(cells):
+            buf = out[i]
+            if (cell is None or buf is None or
+                    not buf.flags.c_contiguous or not buf.flags.writeable):
+                continue
+            if inputs is None:
+                inputs = [c.storage[0] for c in self.input_storage
+                          if isinstance(c.storage[0], numpy.ndarray)]
+            if any(numpy.may_share_memory(buf, v) for v in inputs):
+                continue
+            # An Op may resize the array it reuses, which a view of the
+            # buffer can not do.
+            bound[i] = cell[0] = buf.view()
+        cleared = []
+        taken = set(id(cell) for cell, b in izip(cells, bound)
+                    if b is not None)
+        if taken:
+            pre_call_clear = self.fn.pre_call_clear
+            cleared = [cell for cell in pre_call_clear if id(cell) in taken]
+            pre_call_clear[:] = [cell for cell in pre_call_clear
+                                 if id(cell) not in taken]
+        return bound, cleared
+
+    def _unbind_output_buffers(self, bound, cleared):
+        """Undo `_bind_output_buffers` after the call."""
+        # The next calls must not reuse the buffers.
+        for cell, b in izip(self._output_cells, bound):
+            if b is not None:
+                cell[0] = None
+        if cleared:
+            self.fn.pre_call_clear.extend(cleared)
+
+    def _fill_output_buffers(self, out, bound, outputs):
+        for i, buf in enumerate(out):
+            if buf is None:
+                continue
+            value = outputs[i]
+            if getattr(value, 'shape', None) != buf.shape:
+                raise ValueError(
+                    "The output buffer %i has shape %s, but the output has"
+                    " shape %s." % (i, buf.shape,
+                                    getattr(value, 'shape', None)))
+            if value is not bound[i]:
+                buf[...] = value
+            outputs[i] = buf
+
+    def _call(self, *args, **kwargs):
+        out = None
+        if 'out' in kwargs and 'out' not in self.finder:
+            out = kwargs.pop('out')
+            if out is not None:
+                out = self._output_buffer_list(out)
+        if out is None:
+            out = self._output_buffers
         profile = self.profile
+        if not (kwargs or profile or out is not None):
+            if self._fast_call is None:
+                self._fast_call = (config.vm.fast_call and
+                                   self._make_fast_call())
+            if self._fast_call:
+                try:
+                    outputs = self._fast_call(args, self.trust_input)
+                except Exception:
+                    # Only the errors of the VM are raised with its node,
+                    # the others are raised as in the Python path.
+                    if self._fast_call.vm_failed:
+                        self._raise_fn_error()
+                    raise
+                if outputs is not NotImplemented:
+                    return outputs
         t0 = time.time()
 
         # Reinitialize each container's 'provided' counter
@@ -769,19 +1670,26 @@ class Function(object):
             if len(args) + len(kwargs) > len(self.input_storage):
                 raise TypeError("Too many parameter passed to theano function")
 
+            signatures = self._input_signatures
+            if signatures is None:
+                signatures = self._input_signatures = [None] * len(
+                    self.input_storage)
+
             # Set positional arguments
             i = 0
             for arg in args:
-                # TODO: provide a Param option for skipping the filter if we
-                #      really want speed.
                 s = self.input_storage[i]
                 # see this emails for a discuation about None as input
                 # https://groups.google.com/group/theano-dev/browse_thread/thread/920a5e904e8a8525/4f1b311a28fc27e5
                 if arg is None:
                     s.storage[0] = arg
+                elif (signatures[i] is not None and
+                      _match_input_signature(signatures[i], arg)):
+                    # The filter would return arg unchanged.
+                    s.storage[0] = arg
                 else:
                     try:
-                        s.storage[0] = s.type.filter(
+                        value = s.type.filter(
                             arg, strict=s.strict,
                             allow_downcast=s.allow_downcast)
 
@@ -792,6 +1700,8 @@ class Function(object):
                         e.args = ("Bad input argument to " + function_name +
                                   " at index %d(0-based)" % i,) + e.args
                         raise
+                    s.storage[0] = value
+                    signatures[i] = _input_signature(s.type, arg, value)
                 s.provided += 1
                 i += 1
 
@@ -802,38 +1712,7 @@ class Function(object):
 
         if (not self.trust_input and
                 getattr(self, '_check_for_aliased_inputs', True)):
-            # Collect aliased inputs among the storage space
-            args_share_memory = []
-            for i in xrange(len(self.input_storage)):
-                i_var = self.maker.inputs[i].variable
-                i_val = self.input_storage[i].storage[0]
-                if hasattr(i_var.type, 'may_share_memory'):
-                    is_aliased = False
-                    for j in xrange(len(args_share_memory)):
-
-                        group_j = izip(
-                            [self.maker.inputs[k].variable for k
-                             in args_share_memory[j]],
-                            [self.input_storage[k].storage[0] for k
-                             in args_share_memory[j]])
-                        if numpy.any([(var.type is i_var.type and
-                                       var.type.may_share_memory(val, i_val))
-                                      for (var, val) in group_j]):
-
-                            is_aliased = True
-                            args_share_memory[j].append(i)
-                            break
-
-                    if not is_aliased:
-                        args_share_memory.append([i])
-
-                # Check for groups of more than one argument that share memory
-                for group in args_share_memory:
-                    if len(group) > 1:
-                        # copy all but the first
-                        for idx in group[1:]:
-                            self.input_storage[i].storage[0] = copy.copy(
-                                self.input_storage[i].storage[0])
+            self._copy_aliased_inputs()
 
         # Check if inputs are missing, or if inputs were set more than once, or
         # if we tried to provide inputs that are supposed to be implicit.
@@ -853,25 +1732,19 @@ class Function(object):
                         % getattr(self.inv_finder[c], 'variable',
                                   self.inv_finder[c]))
 
+        if out is not None:
+            bound, cleared = self._bind_output_buffers(out)
+
         # Do the actual work
+        if profile:
+            self.fn.time_thunks = profile.time_thunks_of_call()
         t0_fn = time.time()
         try:
             outputs = self.fn()
         except Exception:
-            if hasattr(self.fn, 'position_of_error'):
-                # this is a new vm-provided function or c linker
-                # they need this because the exception manipulation
-                # done by raise_with_op is not implemented in C.
-                thunk = None
-                if hasattr(self.fn, 'thunks'):
-                    thunk = self.fn.thunks[self.fn.position_of_error]
-                gof.link.raise_with_op(
-                    node=self.fn.nodes[self.fn.position_of_error],
-                    thunk=thunk,
-                    storage_map=getattr(self.fn, 'storage_map', None))
-            else:
-                # old-style linkers raise their own exceptions
-                raise
+            if out is not None:
+                self._unbind_output_buffers(bound, cleared)
+            self._raise_fn_error()
 
         dt_fn = time.time() - t0_fn
         self.maker.mode.fn_time += dt_fn
@@ -883,6 +1756,10 @@ class Function(object):
             outputs = [x.data for x in self.output_storage]
         assert len(outputs) == len(self.output_storage)
 
+        if out is not None:
+            self._unbind_output_buffers(bound, cleared)
+            self._fill_output_buffers(out, bound, outputs)
+
         # Remove internal references to required inputs.
         # These cannot be re-used anyway.
         for c in self.input_storage:
@@ -927,7 +1804,8 @@ class Function(object):
             profile.fct_callcount += 1
             profile.fct_call_time += dt_call
             if hasattr(self.fn, 'update_profile'):
-                self.fn.update_profile(profile)
+                # Only the calls sampled by the profile are timed.
+                self.fn.update_profile(profile, profile.sample_every)
 
         if self.return_none:
             return None
@@ -943,6 +1821,204 @@ class Function(object):
 
             return outputs
 
+    def map(self, args_list, n_threads=1):
+        """
+        Call the function on each tuple of arguments of `args_list`.
+
+        When the C fast path of `__call__` can be used (see
+        config.vm.fast_call), the whole loop runs in C, reusing the input
+        and output storage of the function.
+
+        Parameters
+        ----------
+        args_list
+            A list of tuples of positional arguments.
+        n_threads : int
+            If more than 1, split `args_list` in that many chunks, each one
+            run in a thread by an execution context of the function (see
+            `set_reentrant`). This only speeds up graphs whose Ops release
+            the GIL, like BLAS calls. It is not allowed for functions with
+            updates, since the calls would not be done in order, nor with
+            output buffers, which all the threads would write.
+
+        Returns
+        -------
+        list
+            The outputs of each call, as returned by `__call__`.
+
+        """
+        args_list = list(args_list)
+        if n_threads > 1 and len(args_list) > 1:
+            return self._map_threads(args_list, n_threads)
+        if self._reentrant:
+            with self._execution_context() as context:
+                return context._map(args_list)
+        return self._map(args_list)
+
+    def _map(self, args_list):
+        # Same conditions as the fast path of `_call`.
+        fast_call = False
+        if (config.vm.fast_call and not self.profile and
+                self._output_buffers is None):
+            fast_call = self._map_fast_call
+            if fast_call is None:
+                fast_call = self._map_fast_call = self._make_fast_call()
+        if not fast_call:
+            return [self._call(*args) for args in args_list]
+        results = []
+        while len(results) < len(args_list):
+            try:
+                results.extend(fast_call.map(args_list, len(results),
+                                             self.trust_input))
+            except Exception:
+                if fast_call.vm_failed:
+                    self._raise_fn_error()
+                raise
+            if len(results) < len(args_list):
+                # Let __call__ report the error, or convert the arguments.
+                results.append(self._call(*args_list[len(results)]))
+        return results
+
+    def _map_threads(self, args_list, n_threads):
+        if self.n_returned_outputs != len(self.output_storage):
+            raise ValueError("Function.map can not use threads for a"
+                             " function with updates.")
+        if self._output_buffers is not None:
+            raise ValueError("Function.map can not use threads for a"
+                             " function with output buffers.")
+        self._init_contexts()
+        n_threads = min(n_threads, len(args_list))
+        chunk = (len(args_list) + n_threads - 1) // n_threads
+        results = [None] * n_threads
+        errors = []
+
+        def run(i):
+            try:
+                with self._execution_context() as context:
+                    results[i] = context._map(
+                        args_list[i * chunk:(i + 1) * chunk])
+            except Exception:
+                errors.append(sys.exc_info())
+
+        threads = [threading.Thread(target=run, args=(i,))
+                   for i in range(1, n_threads)]
+        for t in threads:
+            t.start()
+        run(0)
+        for t in threads:
+            t.join()
+        if errors:
+            reraise(*errors[0])
+        return list(chain(*results))
+
+    def call_many(self, stacked_inputs, n_threads=1):
+        """
+        Call the function on slices of stacked inputs.
+
+        Call ``i`` gets ``stacked_inputs[j][i]`` for the input ``j``. This
+        is `map` over the slices along the first axis of the inputs.
+
+        Parameters
+        ----------
+        stacked_inputs
+            A list with one array per positional input, all with the same
+            length along their first axis.
+        n_threads : int
+            See `map`.
+
+        Returns
+        -------
+        The outputs of each call stacked along a new first axis, as a list,
+        as a single array if the function returns a single output, or None
+        if it returns nothing.
+
+        """
+        stacked_inputs = list(stacked_inputs)
+        lengths = set(len(inp) for inp in stacked_inputs)
+        if len(lengths) > 1:
+            raise ValueError("The stacked inputs must have the same length,"
+                             " got %s." % sorted(lengths))
+        n_calls = lengths.pop() if lengths else 0
+        results = self.map([tuple(inp[i] for inp in stacked_inputs)
+                            for i in xrange(n_calls)], n_threads)
+        if self.return_none:
+            return None
+        if self.unpack_single and self.n_returned_outputs == 1:
+            return numpy.asarray(results)
+        return [numpy.asarray([r[i] for r in results])
+                for i in xrange(self.n_returned_outputs)]
+
+    def set_async(self, max_workers=None, max_pending=None, block=True,
+                  executor=None):
+        """
+        Configure the asynchronous calls made by `call_async`.
+
+        The function is made reentrant (see `set_reentrant`) with up to one
+        execution context per thread of the pool. The calls to a function
+        with updates are run one at a time, in the order they are made.
+
+        Parameters
+        ----------
+        max_workers : int or None
+            The number of threads calling the function. None means the
+            number of CPUs.
+        max_pending : int or None
+            The maximum number of calls made by `call_async` and not
+            finished yet. None means no limit.
+        block : bool
+            When there are `max_pending` calls, `call_async` waits for one
+            of them to finish if True, and raises `six.moves.queue.Full`
+            if False. An asyncio event loop should not block.
+        executor : concurrent.futures.Executor or None
+            Run the calls with this executor instead of a thread pool owned
+            by the function. It should not have more threads than
+            `max_workers`. It can not be given for a function with updates,
+            whose calls would not be run in order.
+
+        """
+        if max_workers is None:
+            max_workers = multiprocessing.cpu_count()
+        if self.n_returned_outputs != len(self.output_storage):
+            if executor is not None:
+                raise ValueError("The calls of a function with updates can"
+                                 " only be run by its own thread.")
+            max_workers = 1
+        self.set_reentrant(max_contexts=max_workers)
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+        self._executor = FunctionExecutor(self, max_workers, max_pending,
+                                          block, executor)
+
+    def call_async(self, *args, **kwargs):
+        """
+        Call the function in another thread.
+
+        The arguments are the ones of `__call__`. The threads are set with
+        `set_async`, which is called with the default parameters the first
+        time if needed.
+
+        Returns
+        -------
+        concurrent.futures.Future
+            The future of the outputs. In a coroutine, await it through
+            ``asyncio.wrap_future(f.call_async(x))``.
+
+        """
+        if self._executor is None:
+            self.set_async()
+        return self._executor.submit(args, kwargs)
+
+    def async_stats(self):
+        """
+        Return the queue depth and latencies of the calls of `call_async`.
+
+        See `FunctionExecutor.stats` for the keys of the returned dict.
+
+        """
+        if self._executor is None:
+            return {}
+        return self._executor.stats()
+
     value = property(
         lambda self: self._value,
         None,  # this property itself is not settable
@@ -967,6 +2043,10 @@ class Function(object):
             for node in self.nodes_with_inner_function:
                 ops_with_inner_function[node.op].free()
 
+        for context in self._contexts:
+            if context is not self:
+                context.free()
+
 
 # pickling/deepcopy support for Function
 
@@ -1193,176 +2273,32 @@ class FunctionMaker(object):
             raise TypeError("Unknown output type: %s (%s)", type(output),
                             output)
 
-    def optimize_graph_with_cache(self, optimizer, inputs, outputs):
-        # This function is not finished
-        from theano.gof.compilelock import get_lock, release_lock
-        import os.path
-
-        graph_db_file = os.path.join(theano.config.compiledir,
-                                     'optimized_graphs.pkl')
-
-        # the inputs, outputs, and size of the graph to be optimized
-        inputs_new = [inp.variable for inp in inputs]
-        outputs_new = [out.variable for out in outputs]
-        size_new = len(self.fgraph.apply_nodes)
-        get_lock()
-        # Beginning of cache optimizations.
-        # Could be refactored in different functions.
-
-        def load_graph_db():
-            if os.path.isfile(graph_db_file):
-                print('graph_db already exists')
-            else:
-                # create graph_db
-                f = open(graph_db_file, 'wb')
-                print('create new graph_db in %s' % graph_db_file)
-                # file needs to be open and closed for every pickle
-                f.close()
-            # load the graph_db dictionary
-            try:
-                f = open(graph_db_file, 'rb')
-                # Temporary hack to allow
-                # theano.scan_module.tests.test_scan.T_Scan to
-                # finish. Should be changed in definitive version.
-                tmp = theano.config.unpickle_function
-                theano.config.unpickle_function = False
-                graph_db = pickle.load(f)
-
-                # hack end
-                f.close()
-                print('graph_db loaded and it is not empty')
-            except EOFError as e:
-                # the file has nothing in it
-                print(e)
-                print('graph_db loaded and it is empty')
-                graph_db = {}
-            finally:
-                theano.config.unpickle_function = tmp
-
-            return graph_db
-
-        def find_same_graph_in_db(graph_db):
-            # If found_graph_in_db is None, then need to optimize.
-            # Otherwise, return the graph found.
-            found_graph_in_db = None
-            # The sole purpose of this loop is to set 'need_optimize' by
-            # going through graph_db, looking for graph that has the same
-            # computation performed.
-            for graph_old, graph_optimized in iteritems(graph_db):
-                inputs_old = graph_old.inputs
-                outputs_old = graph_old.outputs
-                size_old = len(graph_old.apply_nodes)
-                # Some heuristics to check is the same graphs have
-                # already been optimized before.
-                if len(inputs_new) != len(inputs_old):
-                    # If the inputs are of different size,
-                    # two graphs are for sure different
-                    print('need to optimize, because input size is different')
-                    continue
-                elif len(outputs_new) != len(outputs_old):
-                    # If the inputs are of different size,
-                    # two graphs are for sure different
-                    print('need to optimize, because output size is different')
-                    continue
-                elif not all(input_new.type == input_old.type
-                             for input_new, input_old in
-                             zip(inputs_new, inputs_old)):
-                    print('need to optimize, because inputs are of different '
-                          'types')
-                    continue
-                elif not all(output_new.type == output_old.type
-                             for output_new, output_old in
-                             zip(outputs_new, outputs_old)):
-                    print('need to optimize, because outputs are of different '
-                          'types')
-                    continue
-                elif not size_old == size_new:
-                    print('need to optimize, because numbers of nodes in graph'
-                          ' are different')
-                    continue
-                else:
-                    flags = []
-                    for i, (output_new, output_old) in enumerate(
-                            zip(outputs_new, outputs_old)):
-                        print('loop through outputs node for both graphs')
-                        graph_old.variables = set(gof.graph.variables(
-                            graph_old.inputs, graph_old.outputs))
-
-                        # using clone allowed to avoid a lot of errors
-                        # deep copy seemed to had.
-                        f2 = graph_old.clone(check_integrity=False)
-                        t1 = output_new
-                        t2 = f2.outputs[i]
-
-                        # Used to remove "already used by another graph error
-                        def removeAllFgraph(remove):
-                            if hasattr(remove, 'fgraph'):
-                                del remove.fgraph
-                            if hasattr(remove, 'owner'):
-                                if remove.owner is None:
-                                    pass
-                                else:
-                                    if hasattr(remove.owner, 'fgraph'):
-                                        del remove.owner.fgraph
-                                    if hasattr(remove.owner, 'inputs'):
-                                        remove.owner.inputs = [removeAllFgraph(
-                                            i) for i in remove.owner.inputs]
-                                        for o in remove.owner.outputs:
-                                            if hasattr(o, 'fgraph'):
-                                                del o.fgraph
-                            return remove
-
-                        t2 = removeAllFgraph(t2)
-
-                        givens = dict(izip(gof.graph.inputs([t1]),
-                                           gof.graph.inputs([t2])))
-
-                        temp = dict(izip(gof.graph.inputs([t1]),
-                                         gof.graph.inputs([t2])))
-
-                        # hack to remove inconstent entry in givens
-                        # seems to work that but source of inconsistency
-                        # could be worth investigating.
-                        for key, value in iteritems(temp):
-                            if key.type != value.type:
-                                del givens[key]
-
-                        flag = is_same_graph(t1, t2, givens=givens)
-
-                        flags.append(flag)
-
-                    is_same = all(flags)
-                    if is_same:
-                        # found the match
-                        print('found a match, no need to optimize')
-                        found_graph_in_db = graph_optimized
-                        break
-            return found_graph_in_db
-
-        graph_db = load_graph_db()
-        print('loaded graph_db from %s, size=%d' % (graph_db_file,
-                                                    len(graph_db)))
-        found_graph = find_same_graph_in_db(graph_db)
-        if found_graph:
-            self.fgraph = found_graph
-            optimizer_profile = None
-        else:
-            # this is a brand new graph, optimize it, save it to graph_db
-            print('graph not found in graph_db, optimizing the graph')
-            self.fgraph.variables = set(gof.graph.variables(
-                self.fgraph.inputs, self.fgraph.outputs))
-            # check_integrity parameters was added to ignore
-            # "excess cached variables" errors. Works that way
-            # but once again the error couldbe worth
-            # investigating.
-            before_opt = self.fgraph.clone(check_integrity=False)
-            optimizer_profile = optimizer(self.fgraph)
-            graph_db.update({before_opt: self.fgraph})
-            f = open(graph_db_file, 'wb')
-            pickle.dump(graph_db, f, -1)
-            f.close()
-            print('new graph saved into graph_db')
-        release_lock()
+    def optimize_graph_with_cache(self, optimizer, inputs, mode):
+        """
+        Optimize self.fgraph, reusing the result of a previous optimization
+        of the same graph from `optimized_graph_cache` when possible.
+
+        Return the optimizer profile, or None if the graph came from the
+        cache.
+
+        """
+        fgraph = self.fgraph
+        key = optimized_graph_cache.key(fgraph, inputs, mode)
+        if key is not None:
+            cached = optimized_graph_cache.get(key)
+            if cached is not None:
+                _logger.debug('Optimized graph found in the cache')
+                optimized_graph_cache.rebind(fgraph, cached)
+                return None
+
+        optimizer_profile = optimizer(fgraph)
+        # A graph whose optimization was cut short by the time budget
+        # depends on the timing and must not be reused by a compilation
+        # without a budget.
+        if (key is not None and
+                not gof.opt.SeqOptimizer.cut_by_time_budget(
+                    optimizer_profile)):
+            optimized_graph_cache.add(key, fgraph)
         return optimizer_profile
 
     def __init__(self, inputs, outputs,
@@ -1450,17 +2386,20 @@ class FunctionMaker(object):
                 start_optimizer = time.time()
 
                 # now optimize the graph
-                if theano.config.cache_optimizations:
-                    optimizer_profile = self.optimize_graph_with_cache(
-                        optimizer, inputs, outputs)
-                else:
-                    optimizer_profile = optimizer(fgraph)
+                # (constant folding may compile C modules)
+                with collect_compile_profile(profile):
+                    if theano.config.cache_optimizations:
+                        optimizer_profile = self.optimize_graph_with_cache(
+                            optimizer, inputs, mode)
+                    else:
+                        optimizer_profile = optimizer(fgraph)
 
                 end_optimizer = time.time()
                 opt_time = end_optimizer - start_optimizer
                 if profile:
                     profile.optimizer_time += opt_time
-                    if theano.config.profile_optimizer:
+                    if (theano.config.profile_optimizer and
+                            optimizer_profile is not None):
                         profile.optimizer_profile = (optimizer,
                                                      optimizer_profile)
                 elif theano.config.profile_optimizer:
@@ -1638,8 +2577,10 @@ class FunctionMaker(object):
         limit_orig = theano.config.traceback.limit
         try:
             theano.config.traceback.limit = 0
-            _fn, _i, _o = self.linker.make_thunk(
-                input_storage=input_storage_lists, storage_map=storage_map)
+            with collect_compile_profile(self.profile):
+                _fn, _i, _o = self.linker.make_thunk(
+                    input_storage=input_storage_lists,
+                    storage_map=storage_map)
         finally:
             theano.config.traceback.limit = limit_orig
 
@@ -19,10 +19,13 @@ __contact__ = "theano-dev <theano-dev@googlegroups.com>"
 __docformat__ = "restructuredtext en"
 import atexit
 import copy
+import json
+import math
 import os
 import sys
 import time
 from collections import defaultdict
+from contextlib import contextmanager
 
 import numpy
 
@@ -43,6 +46,14 @@ AddConfigVar('profiling.time_thunks',
              BoolParam(True),
              in_c_key=False)
 
+AddConfigVar('profiling.sample_every',
+             "When profiling, time the thunks of only 1 call out of this"
+             " many. The times and numbers of calls of the Apply nodes are"
+             " then estimated from the sampled calls, which makes profiling"
+             " cheap enough to keep enabled.",
+             IntParam(1, lambda i: i > 0),
+             in_c_key=False)
+
 AddConfigVar('profiling.n_apply',
              "Number of Apply instances to print by default",
              IntParam(20, lambda i: i > 0),
@@ -83,6 +94,14 @@ AddConfigVar('profiling.debugprint',
              BoolParam(False),
              in_c_key=False)
 
+AddConfigVar('profiling.compile_profile_file',
+             """
+             If not empty, file where the compilation profile of all the
+             profiled functions is written as JSON at exit
+             """,
+             StrParam(''),
+             in_c_key=False)
+
 
 def _atexit_print_fn():
     """
@@ -117,17 +136,23 @@ def _atexit_print_fn():
         for ps in to_sum[1:]:
             for attr in ["compile_time", "fct_call_time", "fct_callcount",
                          "vm_call_time", "optimizer_time", "linker_time",
-                         "validate_time", "import_time"]:
+                         "validate_time", "import_time", "n_sampled_calls"]:
                 setattr(cum, attr, getattr(cum, attr) + getattr(ps, attr))
 
             # merge dictonary
             for attr in ["apply_time", "apply_callcount",
-                         "apply_cimpl", "variable_shape", "variable_strides"]:
+                         "apply_cimpl", "apply_time_histogram",
+                         "variable_shape", "variable_strides"]:
                 cum_attr = getattr(cum, attr)
                 for key, val in iteritems(getattr(ps, attr)):
                     assert key not in cum_attr
                     cum_attr[key] = val
 
+            cum.compile_profile = cum.compile_profile.merge(
+                ps.compile_profile)
+            # A memory plan is specific to one function.
+            cum.memory_plan = None
+
             if cum.optimizer_profile and ps.optimizer_profile:
                 merge = cum.optimizer_profile[0].merge_profile(
                     cum.optimizer_profile[1],
@@ -140,6 +165,198 @@ def _atexit_print_fn():
                     n_ops_to_print=config.profiling.n_ops,
                     n_apply_to_print=config.profiling.n_apply)
 
+    if config.profiling.compile_profile_file and to_sum:
+        compile_profile = CompileProfile()
+        for ps in to_sum:
+            compile_profile = compile_profile.merge(ps.compile_profile)
+        with open(config.profiling.compile_profile_file, 'w') as f:
+            compile_profile.to_json(f)
+
+
+class CompileProfile(object):
+    """
+    Breakdown of the time spent getting the C modules of functions.
+
+    The modules looked up by the ModuleCache while the profile is collecting
+    (see `collect_compile_profile`) are recorded per Op class: compilation
+    time, size of the compiled source code, and number of cache hits and
+    misses. The time spent hashing the source code, refreshing the cache
+    and waiting for the compilation locks is also recorded.
+
+    """
+
+    def __init__(self):
+        self.op_compile_time = {}
+        self.op_src_size = {}
+        self.op_hits = {}
+        self.op_misses = {}
+        self.hash_time = 0.0
+        self.refresh_time = 0.0
+        self.lock_wait_time = 0.0
+
+    def record_module(self, op_name, hit, src_size, compile_time):
+        """
+        Record the lookup of a module of `op_name` by the ModuleCache.
+
+        """
+        if hit:
+            self.op_hits[op_name] = self.op_hits.get(op_name, 0) + 1
+        else:
+            self.op_misses[op_name] = self.op_misses.get(op_name, 0) + 1
+            self.op_compile_time[op_name] = (
+                self.op_compile_time.get(op_name, 0) + compile_time)
+            self.op_src_size[op_name] = (
+                self.op_src_size.get(op_name, 0) + src_size)
+
+    def op_names(self):
+        return set(self.op_hits) | set(self.op_misses)
+
+    def merge(self, other):
+        """
+        Return a new CompileProfile summing `self` and `other`.
+
+        """
+        rval = CompileProfile()
+        for attr in ['op_compile_time', 'op_src_size', 'op_hits',
+                     'op_misses']:
+            merged = dict(getattr(self, attr))
+            for op_name, val in iteritems(getattr(other, attr)):
+                merged[op_name] = merged.get(op_name, 0) + val
+            setattr(rval, attr, merged)
+        for attr in ['hash_time', 'refresh_time', 'lock_wait_time']:
+            setattr(rval, attr, getattr(self, attr) + getattr(other, attr))
+        return rval
+
+    def as_dict(self):
+        """
+        Return the profile as a dict of builtin types.
+
+        """
+        ops = dict((op_name, {
+            'compile_time': self.op_compile_time.get(op_name, 0.0),
+            'src_size': self.op_src_size.get(op_name, 0),
+            'hits': self.op_hits.get(op_name, 0),
+            'misses': self.op_misses.get(op_name, 0)})
+            for op_name in self.op_names())
+        return {'ops': ops,
+                'compile_time': sum(self.op_compile_time.values()),
+                'hash_time': self.hash_time,
+                'refresh_time': self.refresh_time,
+                'lock_wait_time': self.lock_wait_time}
+
+    def to_json(self, file):
+        """
+        Write the profile in JSON to the file object `file`.
+
+        """
+        json.dump(self.as_dict(), file, indent=1, sort_keys=True)
+
+    def summary(self, file=sys.stderr, N=None):
+        d = self.as_dict()
+        print('C module compilation profile', file=file)
+        print('----------------------------', file=file)
+        print('  Time compiling: %es' % d['compile_time'], file=file)
+        print('  Time hashing source code: %es' % self.hash_time, file=file)
+        print('  Time refreshing the cache: %es' % self.refresh_time,
+              file=file)
+        print('  Time waiting for compilation locks: %es' %
+              self.lock_wait_time, file=file)
+        ops = sorted(iteritems(d['ops']),
+                     key=lambda item: (item[1]['compile_time'],
+                                       item[1]['misses']),
+                     reverse=True)
+        if N is None:
+            N = len(ops)
+        print('', file=file)
+        print('  <compile time> <misses> <hits> <source bytes> <Op class>',
+              file=file)
+        for op_name, op in ops[:N]:
+            print('  %13.3es %8d %6d %14d %s' % (
+                op['compile_time'], op['misses'], op['hits'],
+                op['src_size'], op_name), file=file)
+        print('   ... (remaining %i Op classes)' % max(0, len(ops) - N),
+              file=file)
+        print('', file=file)
+
+
+class TimeHistogram(object):
+    """
+    Streaming histogram of durations, to estimate their quantiles.
+
+    The buckets grow geometrically by `growth` from `min_time` seconds, so
+    the memory is bounded and a quantile is known within about 9%.
+
+    """
+
+    growth = 2 ** (1. / 8)
+    min_time = 1e-7
+
+    def __init__(self):
+        self.counts = {}  # bucket index -> number of durations
+        self.n = 0
+        self.max = 0.
+
+    def add(self, t):
+        if t <= self.min_time:
+            b = 0
+        else:
+            b = int(math.log(t / self.min_time, self.growth)) + 1
+        self.counts[b] = self.counts.get(b, 0) + 1
+        self.n += 1
+        if t > self.max:
+            self.max = t
+
+    def merge(self, other):
+        rval = TimeHistogram()
+        for h in (self, other):
+            for b, c in iteritems(h.counts):
+                rval.counts[b] = rval.counts.get(b, 0) + c
+        rval.n = self.n + other.n
+        rval.max = max(self.max, other.max)
+        return rval
+
+    def quantile(self, q):
+        """
+        Return an upper bound of the `q` quantile (0 < q <= 1), or None if
+        there is no duration.
+
+        """
+        if not self.n:
+            return None
+        rank = q * self.n
+        seen = 0
+        for b in sorted(self.counts):
+            seen += self.counts[b]
+            if seen >= rank:
+                break
+        return min(self.min_time * self.growth ** b, self.max)
+
+
+@contextmanager
+def collect_compile_profile(profile):
+    """
+    Record in ``profile.compile_profile`` the C modules looked up in the
+    block. Nothing is recorded if `profile` is None or False.
+
+    """
+    if not profile:
+        yield
+        return
+    from theano.gof import cmodule, compilelock
+    compile_profile = profile.compile_profile
+    hash_time = cmodule.hash_time
+    refresh_time = cmodule.refresh_time
+    lock_wait_time = sum(compilelock.wait_time.values())
+    cmodule.compile_profilers.append(compile_profile)
+    try:
+        yield
+    finally:
+        cmodule.compile_profilers.remove(compile_profile)
+        compile_profile.hash_time += cmodule.hash_time - hash_time
+        compile_profile.refresh_time += cmodule.refresh_time - refresh_time
+        compile_profile.lock_wait_time += (
+            sum(compilelock.wait_time.values()) - lock_wait_time)
+
 
 class ProfileStats(object):
 
@@ -194,6 +411,18 @@ class ProfileStats(object):
     # dict from node -> bool (1 if c, 0 if py)
     #
 
+    apply_time_histogram = None
+    # dict from node -> TimeHistogram of its runtime in the timed calls
+    #
+
+    sample_every = 1
+    # The thunks are timed in 1 call out of sample_every
+    #
+
+    n_sampled_calls = 0
+    # Number of calls whose thunks were timed
+    #
+
     message = None
     # pretty string to print in summary, to identify this output
     #
@@ -230,6 +459,12 @@ class ProfileStats(object):
     optimizer_profile = None
     # None or tuple (the optimizer, the profile it returned)
 
+    compile_profile = None
+    # CompileProfile of the C modules used by the function
+
+    memory_plan = None
+    # theano.gof.vm.MemoryPlan of the function, if config.vm.memory_planner
+
     # param is called flag_time_thunks because most other attributes with time
     # in the name are times *of* something, rather than configuration flags.
     def __init__(self, atexit_print=True, flag_time_thunks=None, **kwargs):
@@ -249,8 +484,12 @@ class ProfileStats(object):
         self.output_size = {}
         self.apply_time = {}
         self.apply_cimpl = {}
+        self.apply_time_histogram = {}
+        self.sample_every = config.profiling.sample_every
+        self._n_calls = 0
         self.variable_shape = {}
         self.variable_strides = {}
+        self.compile_profile = CompileProfile()
         if flag_time_thunks is None:
             self.flag_time_thunks = config.profiling.time_thunks
         else:
@@ -264,6 +503,40 @@ class ProfileStats(object):
                 atexit.register(_atexit_print_fn)
                 _atexit_registered = True
 
+    def time_thunks_of_call(self):
+        """
+        Return True if the thunks of the call about to be done must be
+        timed, which happens for 1 call out of `sample_every`.
+
+        """
+        if not self.flag_time_thunks:
+            return False
+        self._n_calls += 1
+        if (self._n_calls - 1) % self.sample_every:
+            return False
+        self.n_sampled_calls += 1
+        return True
+
+    def add_thunk_times(self, nodes, times, counts, scale=1):
+        """
+        Add the times and numbers of runs of the thunks of a timed call.
+
+        They are multiplied by `scale`, the number of calls the timed one
+        stands for: `sample_every` for a call sampled by
+        `time_thunks_of_call`, 1 when every call is timed. The time of each
+        node in the call also goes in its histogram.
+
+        """
+        histograms = self.apply_time_histogram
+        for node, t, c in zip(nodes, times, counts):
+            self.apply_time[node] = self.apply_time.get(node, 0.0) + t * scale
+            self.apply_callcount[node] = (self.apply_callcount.get(node, 0) +
+                                          c * scale)
+            if c:
+                if node not in histograms:
+                    histograms[node] = TimeHistogram()
+                histograms[node].add(t)
+
     def class_time(self):
         """
         dict op -> total time on thunks
@@ -670,6 +943,34 @@ class ProfileStats(object):
                sum(t for f, t, a, nd_id, nb_call in atimes[N:])), file=file)
         print('', file=file)
 
+    def summary_quantiles(self, file=sys.stderr, N=None):
+        histograms = self.apply_time_histogram
+        if not histograms:
+            return
+        if N is None:
+            N = len(histograms)
+        print('Apply time quantiles (%i timed calls, 1 out of %i)' %
+              (self.n_sampled_calls, self.sample_every), file=file)
+        print('---------------------', file=file)
+        print('  <p50> <p99> <max> <#timed runs> <id> <Apply name>',
+              file=file)
+        topos = {}  # Only do the topo once per fct.
+        stats = sorted(((h.quantile(.99), h.quantile(.5), h, node)
+                        for node, h in iteritems(histograms)),
+                       key=lambda x: x[0], reverse=True)
+        for p99, p50, h, node in stats[:N]:
+            if node.fgraph not in topos:
+                topo = node.fgraph.toposort()
+                topos[node.fgraph] = topo
+            else:
+                topo = topos[node.fgraph]
+            line = '  %8.2es %8.2es %8.2es %7d %3d %s' % (
+                p50, p99, h.max, h.n, topo.index(node), node)
+            print(line[:self.line_width], file=file)
+        print('   ... (remaining %i Apply instances)' %
+              max(0, len(stats) - N), file=file)
+        print('', file=file)
+
     def summary_function(self, file):
         print('Function profiling', file=file)
         print('==================', file=file)
@@ -1289,6 +1590,8 @@ class ProfileStats(object):
             self.summary_class(file, n_ops_to_print)
             self.summary_ops(file, n_ops_to_print)
             self.summary_nodes(file, n_apply_to_print)
+            if self.sample_every > 1:
+                self.summary_quantiles(file, n_apply_to_print)
         elif self.fct_callcount > 0:
             print("  No execution time accumulated "
                   "(hint: try config profiling.time_thunks=1)", file=file)
@@ -1297,11 +1600,15 @@ class ProfileStats(object):
             theano.printing.debugprint(fcts, print_type=True)
         if self.variable_shape or self.variable_strides:
             self.summary_memory(file, n_apply_to_print)
+        if self.memory_plan is not None:
+            self.memory_plan.summary(file)
         if self.optimizer_profile:
             print("Optimizer Profile", file=file)
             print("-----------------", file=file)
             self.optimizer_profile[0].print_profile(file,
                                                     self.optimizer_profile[1])
+        if self.compile_profile.op_names():
+            self.compile_profile.summary(file, n_ops_to_print)
 
 
 if False:  # old code still to be ported from ProfileMode
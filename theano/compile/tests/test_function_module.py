@@ -862,6 +862,348 @@ def test_empty_givens_updates():
     function([theano.In(x)], y, updates={})
 
 
+@theano.configparser.change_flags(**{'vm.fast_call': True})
+def test_fast_call():
+    if not theano.config.cxx:
+        raise SkipTest("G++ not available, so we need to skip this test.")
+    x = T.dvector('x')
+    y = T.dvector('y')
+    s = theano.shared(numpy.zeros(3), 's')
+    f = function([x, y], x + y * 2, updates={s: s + x})
+    assert f._fast_call is None
+    xv = numpy.arange(3.)
+    assert numpy.allclose(f(xv, xv), xv * 3)
+    assert f._fast_call
+    assert numpy.allclose(s.get_value(), xv)
+    # Arguments converted by the filter.
+    assert numpy.allclose(f([1, 2, 3], xv), [1, 4, 7])
+    assert numpy.allclose(s.get_value(), xv + [1, 2, 3])
+    # Aliased inputs give the same result.
+    v = numpy.arange(4.)
+    assert numpy.allclose(f(v[:3], v[1:]), v[:3] + v[1:] * 2)
+    # Errors are reported as without the fast path.
+    try:
+        f(xv)
+        assert False
+    except TypeError:
+        pass
+    try:
+        f(numpy.zeros((2, 2)), xv)
+        assert False
+    except TypeError as e:
+        assert 'Bad input argument' in str(e)
+    # The errors of the VM are reported with the node that raised them.
+    try:
+        f(xv, numpy.zeros(4))
+        assert False
+    except ValueError as e:
+        assert f._fast_call.vm_failed
+        assert 'Apply node that caused the error' in str(e)
+    assert numpy.allclose(f(xv, xv), xv * 3)
+    assert not f._fast_call.vm_failed
+    # Only the required inputs are given positionally.
+    g = function([x, In(y, value=numpy.ones(3))], x + y)
+    assert numpy.allclose(g(xv), xv + 1)
+    assert g._fast_call is False
+
+
+def test_aliased_input_groups():
+    from theano.compile.function_module import aliased_input_groups
+    t = T.dvector().type
+    t2 = T.dvector().type
+    v = numpy.arange(10.)
+    values = [v[:5], v[4:], numpy.zeros(3), v[::-2], v[9:], None,
+              numpy.zeros(0)]
+    assert aliased_input_groups(values, [t] * 7) == [[0, 1, 3, 4]]
+    groups = aliased_input_groups(values, [t, t2, t, t, t2, t, t])
+    assert sorted(groups) == [[0, 3], [1, 4]]
+
+
+def test_aliased_inputs_copied():
+    x = T.dvector('x')
+    y = T.dvector('y')
+    # y is destroyed in place when the graph allows it.
+    f = function([x, In(y, mutable=True)], x + y)
+    v = numpy.arange(5.)
+    for i in range(2):
+        assert numpy.allclose(f(v[:4], v[1:]), v[:4] + v[1:])
+        assert numpy.allclose(v, numpy.arange(5.))
+    assert f._aliased_inputs_cache[1] == [[0, 1]]
+
+
+def test_reentrant():
+    import threading
+    x = T.dmatrix('x')
+    w = theano.shared(numpy.ones((20, 20)), 'w')
+    f = function([x], T.tanh(T.dot(x, w)).sum())
+    f.set_reentrant()
+    inputs = [numpy.random.rand(20, 20) for i in range(8)]
+    expected = [numpy.tanh(numpy.dot(xv, w.get_value())).sum()
+                for xv in inputs]
+    results = {}
+
+    def run(i):
+        for j in range(20):
+            results[i, j] = f(inputs[i])
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    for (i, j), r in iteritems(results):
+        assert numpy.allclose(r, expected[i])
+    assert f not in f._contexts
+    assert len(f._free_contexts) == len(f._contexts) <= 8
+    # The shared variables are shared by the contexts.
+    w.set_value(numpy.zeros((20, 20)))
+    assert all(numpy.allclose(c(inputs[0]), 0) for c in f._contexts)
+
+    # The calls of a function with updates are serialized.
+    s = theano.shared(0, 's')
+    g = function([], [], updates={s: s + 1})
+    g.set_reentrant()
+    threads = [threading.Thread(target=g) for i in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert s.get_value() == 8
+    assert g._contexts == [g]
+
+
+def test_reentrant_defaults():
+    # The contexts take the defaults set in the function, whichever context
+    # the call is given.
+    x = T.dvector('x')
+    y = T.dscalar('y')
+    f = function([x, In(y, value=1., name='y')], x * y)
+    f.set_reentrant()
+    xv = numpy.arange(3.)
+    assert numpy.allclose(f(xv), xv)
+    f['y'] = 3.
+    ctx = f._execution_context()
+    context = ctx.__enter__()
+    # As without contexts, the value is used by the next call only.
+    assert numpy.allclose(context._call(xv), xv * 3)
+    assert numpy.allclose(f(xv), xv)
+    ctx.__exit__(None, None, None)
+    assert len(f._contexts) == 2
+    assert numpy.allclose(f(xv), xv)
+    assert numpy.allclose(f(xv, 2.), xv * 2)
+    assert numpy.allclose(f(xv), xv)
+    f.trust_input = True
+    assert numpy.allclose(f(xv, numpy.asarray(2.)), xv * 2)
+    assert f._free_contexts[-1].trust_input
+
+
+def test_output_buffers():
+    x = T.dvector('x')
+    f = function([x], [x * 2, x.sum()])
+    xv = numpy.arange(4.)
+    buf = numpy.empty(4)
+    sbuf = numpy.empty(())
+    r = f(xv, out=[buf, sbuf])
+    assert r[0] is buf and r[1] is sbuf
+    assert numpy.allclose(buf, xv * 2) and sbuf == 6
+    # The buffers are not overwritten by the next calls.
+    r2 = f(xv + 1)
+    assert r2[0] is not buf
+    assert numpy.allclose(buf, xv * 2)
+    # Only some outputs, persistent buffers.
+    f.set_output_buffers([buf, None])
+    for i in range(3):
+        r = f(xv + i)
+        assert r[0] is buf
+        assert numpy.allclose(buf, (xv + i) * 2)
+    f.set_output_buffers(None)
+    assert f(xv)[0] is not buf
+    # Buffers that don't fit.
+    for out in ([numpy.empty(3), None], [numpy.empty(4, 'float32'), None],
+                [buf]):
+        try:
+            f(xv, out=out)
+            assert False
+        except (TypeError, ValueError):
+            pass
+    # A buffer that is also an input.
+    g = function([x], x + 1)
+    xv2 = xv.copy()
+    assert g(xv2, out=xv2) is xv2
+    assert numpy.allclose(xv2, xv + 1)
+    # The same buffer for two outputs.
+    k = function([x], [x * 2, x + 1])
+    for out in ([buf, buf], [buf[:3], buf[1:]]):
+        try:
+            k(xv, out=out)
+            assert False
+        except ValueError:
+            pass
+    # An input named out.
+    out = T.dvector('out')
+    h = function([out], out * 2)
+    assert numpy.allclose(h(out=xv), xv * 2)
+    # A reentrant function can not have persistent buffers.
+    h.set_reentrant()
+    try:
+        h.set_output_buffers([buf])
+        assert False
+    except ValueError:
+        pass
+
+
+@theano.configparser.change_flags(**{'vm.fast_call': True})
+def test_output_buffers_fast_call():
+    if not theano.config.cxx:
+        raise SkipTest("G++ not available, so we need to skip this test.")
+    # A call with output buffers does not disable the fast path of the
+    # next calls.
+    x = T.dvector('x')
+    f = function([x], x * 2)
+    xv = numpy.arange(4.)
+    buf = numpy.empty(4)
+    assert f(xv, out=buf) is buf
+    r = f(xv + 1)
+    assert f._fast_call
+    assert r is not buf
+    assert numpy.allclose(buf, xv * 2)
+    assert numpy.allclose(r, (xv + 1) * 2)
+
+
+@theano.configparser.change_flags(**{'vm.fast_call': False})
+def test_input_signatures():
+    x = T.drow('x')
+    y = T.dvector('y')
+    f = function([x, y], x + y)
+    xv = numpy.ones((1, 3))
+    yv = numpy.arange(3.)
+    assert numpy.allclose(f(xv, yv), yv + 1)
+    assert f._input_signatures[0] == (xv.dtype, 2, (0,))
+    assert f._input_signatures[1] == (yv.dtype, 1, ())
+    # The arrays like the last ones skip the filter, but the mismatches
+    # are still caught.
+    assert numpy.allclose(f(xv * 2, yv[::-1]), yv[::-1] + 2)
+    for args in [(numpy.ones((2, 3)), yv), (xv, numpy.ones((3, 1))),
+                 (xv, yv + 1j)]:
+        try:
+            f(*args)
+            assert False
+        except TypeError:
+            pass
+    # Arguments that the filter converts have no signature.
+    assert numpy.allclose(f(xv, [1, 2, 3]), [2, 3, 4])
+    assert f._input_signatures[1] is None
+    assert numpy.allclose(f(xv, yv.astype('int32')), yv + 1)
+    assert f._input_signatures[1] is None
+    assert numpy.allclose(f(xv, yv), yv + 1)
+    assert f._input_signatures[1] is not None
+
+
+def test_call_async():
+    try:
+        import concurrent.futures
+    except ImportError:
+        raise SkipTest("concurrent.futures is not available.")
+    x = T.dvector('x')
+    f = function([x], x * 2)
+    futures = [f.call_async(numpy.arange(i)) for i in range(10)]
+    for i, fut in enumerate(futures):
+        assert numpy.allclose(fut.result(), numpy.arange(i) * 2)
+    stats = f.async_stats()
+    assert stats['done'] == 10
+    assert stats['queued'] == stats['running'] == stats['failed'] == 0
+    assert 0 <= stats['latency_p50'] <= stats['latency_max']
+    # Errors are raised by the future.
+    fut = f.call_async(numpy.zeros((2, 2)))
+    try:
+        fut.result()
+        assert False
+    except TypeError:
+        pass
+    assert f.async_stats()['failed'] == 1
+
+    # Backpressure
+    from six.moves import queue
+    import threading
+    event = threading.Event()
+    f.set_async(max_workers=1, max_pending=2, block=False)
+    blocker = f._executor.executor.submit(event.wait)
+    futures = [f.call_async([1.]), f.call_async([2.])]
+    try:
+        f.call_async([3.])
+        assert False
+    except queue.Full:
+        pass
+    event.set()
+    blocker.result()
+    assert [fut.result()[0] for fut in futures] == [2., 4.]
+
+    # The calls of a function with updates are done in order.
+    s = theano.shared(0, 's')
+    g = function([x], s, updates={s: s * 2 + x.shape[0]})
+    futures = [g.call_async(numpy.zeros(i % 2)) for i in range(6)]
+    assert [fut.result() for fut in futures] == [0, 0, 1, 2, 5, 10]
+    # Which an executor with several threads would not do.
+    executor = concurrent.futures.ThreadPoolExecutor(2)
+    try:
+        g.set_async(executor=executor)
+        assert False
+    except ValueError:
+        pass
+    executor.shutdown()
+
+
+def test_map():
+    x = T.dvector('x')
+    y = T.dscalar('y')
+    s = theano.shared(0., 's')
+    f = function([x, y], x * y, updates={s: s + y})
+    args = [(numpy.arange(3.), i) for i in range(5)]
+    outs = f.map(args)
+    assert len(outs) == 5
+    for (xv, yv), out in zip(args, outs):
+        assert numpy.allclose(out, xv * yv)
+    assert numpy.allclose(s.get_value(), 10)
+    # Arguments that need to be converted.
+    outs = f.map([([1, 2], 2), ([3], 1.)])
+    assert numpy.allclose(outs[0], [2, 4])
+    assert numpy.allclose(outs[1], [3])
+    try:
+        f.map(args, n_threads=2)
+        assert False
+    except ValueError:
+        pass
+
+    g = function([x, y], [x + y, x.sum()])
+    stacked = [numpy.arange(12.).reshape(4, 3), numpy.arange(4.)]
+    outs = g.call_many(stacked, n_threads=3)
+    assert numpy.allclose(outs[0], stacked[0] + stacked[1][:, None])
+    assert numpy.allclose(outs[1], stacked[0].sum(axis=1))
+    # The threads use the execution contexts of the function.
+    assert 1 <= len(g._contexts) <= 3
+    assert len(g._free_contexts) == len(g._contexts)
+    g.set_output_buffers([numpy.empty(3), None])
+    try:
+        g.call_many(stacked, n_threads=3)
+        assert False
+    except ValueError:
+        pass
+    h = function([x], x * 2)
+    assert numpy.allclose(h.call_many([stacked[0]]), stacked[0] * 2)
+
+
+@theano.configparser.change_flags(**{'vm.fast_call': True})
+def test_map_output_buffers():
+    # map() writes in the output buffers set before any call.
+    x = T.dvector('x')
+    f = function([x], x * 2)
+    buf = numpy.empty(3)
+    f.set_output_buffers([buf])
+    outs = f.map([(numpy.arange(3.),), (numpy.ones(3),)])
+    assert all(out is buf for out in outs)
+    assert numpy.allclose(buf, 2)
+
+
 if __name__ == '__main__':
 
     if 1:
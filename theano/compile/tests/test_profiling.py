@@ -2,6 +2,7 @@
 Test of memory profiling
 
 """
+import json
 import unittest
 
 import numpy
@@ -9,6 +10,7 @@ import numpy
 import theano
 from six.moves import StringIO
 import theano.tensor as T
+from theano.compile.profiling import CompileProfile, TimeHistogram
 from theano.ifelse import ifelse
 
 
@@ -105,5 +107,86 @@ class Test_profiling(unittest.TestCase):
             theano.config.profile_memory = config2
 
 
+def test_compile_profile():
+    p1 = CompileProfile()
+    p1.record_module('Elemwise', False, 100, 2.)
+    p1.record_module('Elemwise', True, 100, 0.)
+    p1.lock_wait_time = 1.
+    p2 = CompileProfile()
+    p2.record_module('Elemwise', False, 50, 1.)
+    p2.record_module('Dot22', True, 0, 0.)
+
+    d = p1.merge(p2).as_dict()
+    assert d['ops']['Elemwise'] == {'compile_time': 3., 'src_size': 150,
+                                    'hits': 1, 'misses': 2}
+    assert d['ops']['Dot22']['hits'] == 1
+    assert d['compile_time'] == 3.
+    assert d['lock_wait_time'] == 1.
+
+    buf = StringIO()
+    p1.to_json(buf)
+    assert json.loads(buf.getvalue()) == p1.as_dict()
+    p1.summary(buf)
+
+
+
+def test_time_histogram():
+    h = TimeHistogram()
+    assert h.quantile(.5) is None
+    for t in [1e-6] * 98 + [1e-3, 2e-3]:
+        h.add(t)
+    assert 1e-6 <= h.quantile(.5) < 1.1e-6
+    assert 1e-6 <= h.quantile(.98) < 1.1e-6
+    assert 1e-3 <= h.quantile(.99) < 1.1e-3
+    assert h.quantile(1.) == 2e-3
+
+    h2 = h.merge(h)
+    assert h2.n == 200
+    assert h2.quantile(.5) == h.quantile(.5)
+
+
+def test_profiling_sample_every():
+    if theano.config.mode in ["DebugMode", "DEBUG_MODE", "FAST_COMPILE"]:
+        m = "FAST_RUN"
+    else:
+        m = None
+    x = T.dvector('x')
+    p = theano.ProfileStats(False, sample_every=3)
+    f = theano.function([x], T.exp(x).sum(), profile=p, mode=m)
+    for i in range(7):
+        f(numpy.ones(10))
+
+    assert p.fct_callcount == 7
+    # Calls 0, 3 and 6 were timed.
+    assert p.n_sampled_calls == 3
+    assert p.apply_time_histogram
+    for node, h in p.apply_time_histogram.items():
+        assert h.n == 3
+        assert p.apply_callcount[node] == 9
+        assert h.quantile(.5) <= h.quantile(.99) <= h.max
+
+    buf = StringIO()
+    p.summary(buf)
+    assert "Apply time quantiles" in buf.getvalue()
+
+
+def test_profiling_sample_every_scan():
+    # Scan times all the steps of its inner function, which are not scaled.
+    if theano.config.mode in ["DebugMode", "DEBUG_MODE", "FAST_COMPILE"]:
+        m = "FAST_RUN"
+    else:
+        m = None
+    x = T.dvector('x')
+    p = theano.compile.profiling.ScanProfileStats(False, sample_every=3)
+    y, _ = theano.scan(T.exp, sequences=x, profile=p)
+    f = theano.function([x], y, mode=m)
+    f(numpy.ones(5))
+
+    assert p.nbsteps == 5
+    counts = [c for c in p.apply_callcount.values() if c]
+    assert counts
+    assert all(c == 5 for c in counts)
+
+
 if __name__ == '__main__':
     unittest.main()
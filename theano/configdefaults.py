@@ -723,6 +723,14 @@ AddConfigVar('openmp_elemwise_minsize',
              in_c_key=False,
              )
 
+AddConfigVar('elemwise_release_gil_minsize',
+             "Minimum number of output elements for which elemwise ops "
+             "with GIL-free scalar code release the GIL around their loop, "
+             "so that other Python threads can run meanwhile.",
+             IntParam(16384),
+             in_c_key=False,
+             )
+
 AddConfigVar(
     'check_input',
     "Specify if types should check their input in their C code. "
@@ -731,11 +739,32 @@ AddConfigVar(
     "files.",
     BoolParam(True))
 
+AddConfigVar(
+    'intern_apply_nodes',
+    "If True, calling an Op on inputs it was already applied to returns "
+    "the outputs of the existing Apply node instead of building a new "
+    "one, so that repeated subexpressions are shared while the graph is "
+    "built.",
+    BoolParam(False),
+    in_c_key=False)
+
 AddConfigVar(
     'cache_optimizations',
-    "WARNING: work in progress, does not work yet. "
-    "Specify if the optimization cache should be used. This cache will "
-    "any optimized graph and its optimization. Actually slow downs a lot "
-    "the first optimization, and could possibly still contains some bugs. "
-    "Use at your own risks.",
+    "Specify if the optimization cache should be used. When compiling a "
+    "graph identical to one already compiled, up to the names of its "
+    "variables, the optimized graph is reused instead of optimizing the "
+    "graph again.",
     BoolParam(False))
+
+AddConfigVar(
+    'cache_optimizations_size',
+    "Number of optimized graphs kept in memory by the optimization cache.",
+    IntParam(32, lambda i: i >= 0),
+    in_c_key=False)
+
+AddConfigVar(
+    'cache_optimizations_on_disk',
+    "If True, the optimization cache also pickles the optimized graphs in "
+    "the compiledir, to reuse them in other processes.",
+    BoolParam(False),
+    in_c_key=False)
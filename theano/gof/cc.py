@@ -16,14 +16,14 @@ import numpy
 import theano
 from theano import config
 from theano.compat import PY3
-from theano.compat import izip
+from theano.compat import izip, OrderedDict
 from six import string_types, reraise
 from six.moves import StringIO, xrange
 
 # Note that we need to do this before importing cutils, since when there is
 # no theano cache dir initialized yet, importing cutils may require compilation
 # of cutils_ext.
-from theano.configparser import AddConfigVar, StrParam
+from theano.configparser import AddConfigVar, BoolParam, StrParam
 
 # gof imports
 from theano.gof import graph
@@ -37,12 +37,26 @@ AddConfigVar('gcc.cxxflags',
              "Extra compiler flags for gcc",
              StrParam(""))
 
+AddConfigVar('cmodule.batch_modules',
+             "If True, the VM linkers compile the C code of all the nodes of "
+             "a function that are not in the cache in a single module, "
+             "instead of one module per node.",
+             BoolParam(False),
+             in_c_key=False)
+
 
 _logger = logging.getLogger("theano.gof.cc")
 
 
 run_cthunk = None  # Will be imported only when needed.
 
+# Maps the keys of modules compiled by a BatchCLinker to the instantiate
+# function of their struct in the batch module. Only the
+# `_max_batched_instantiate` most recently used are kept: the keys that were
+# dropped are compiled in their own module if they are needed again.
+_batched_instantiate = OrderedDict()
+_max_batched_instantiate = 1024
+
 
 def get_module_cache(init_args=None):
     """
@@ -1509,6 +1523,35 @@ class CLinker(link.Linker):
             release_lock()
         return module
 
+    def build_cmodule(self, location):
+        """
+        Compile the source code for this linker into a dynamic library in
+        `location`, without importing it, and return the library path.
+
+        Unlike `compile_cmodule`, this does not take the compilation lock,
+        the caller is expected to hold it. This is what allows
+        `ModuleCache.module_from_keys` to run several compilations at once.
+
+        """
+        mod = self.get_dynamic_module()
+        src_code = mod.code()
+        _logger.debug("LOCATION %s", str(location))
+        try:
+            self.c_compiler().compile_str(
+                module_name=mod.code_hash,
+                src_code=src_code,
+                location=location,
+                include_dirs=self.header_dirs(),
+                lib_dirs=self.lib_dirs(),
+                libs=self.libraries(),
+                preargs=self.compile_args(),
+                py_module=False)
+        except Exception as e:
+            e.args += (str(self.fgraph),)
+            raise
+        return os.path.join(location, '%s.%s' % (
+            mod.code_hash, cmodule.get_lib_extension()))
+
     def get_dynamic_module(self):
         """
         Return a cmodule.DynamicModule instance full of the code for our fgraph.
@@ -1585,12 +1628,16 @@ class CLinker(link.Linker):
             key = self.cmodule_key()
         except KeyError:
             key = None
-        if key is None:
+        if key is not None and key in _batched_instantiate:
+            # Mark it as the most recently used.
+            instantiate = _batched_instantiate.pop(key)
+            _batched_instantiate[key] = instantiate
+        elif key is None:
             # If we can't get a key, then forget the cache mechanism.
-            module = self.compile_cmodule()
+            instantiate = self.compile_cmodule().instantiate
         else:
-            module = get_module_cache().module_from_key(
-                key=key, lnk=self, keep_lock=keep_lock)
+            instantiate = get_module_cache().module_from_key(
+                key=key, lnk=self, keep_lock=keep_lock).instantiate
 
         vars = self.inputs + self.outputs + self.orphans
         # List of indices that should be ignored when passing the arguments
@@ -1606,15 +1653,15 @@ class CLinker(link.Linker):
         else:
             orphd = [storage_map[orphan] for orphan in self.orphans]
 
-        ret = module.instantiate(error_storage,
-                                 *(in_storage + out_storage + orphd))
+        ret = instantiate(error_storage,
+                          *(in_storage + out_storage + orphd))
 
         return ret
 
-    def instantiate_code(self, n_args):
+    def instantiate_code(self, n_args, name='instantiate'):
         code = StringIO()
         struct_name = self.struct_name
-        print("static PyObject * instantiate(PyObject * self, PyObject *argtuple) {", file=code)
+        print("static PyObject * %s(PyObject * self, PyObject *argtuple) {" % name, file=code)
         print('  assert(PyTuple_Check(argtuple));', file=code)
         print('  if (%(n_args)i != PyTuple_Size(argtuple)){ ' % locals(), file=code)
         print('     PyErr_Format(PyExc_TypeError, "Wrong number of arguments, expected %(n_args)i, got %%i", (int)PyTuple_Size(argtuple));' % locals(), file=code)
@@ -1640,6 +1687,173 @@ class CLinker(link.Linker):
         return code.getvalue()
 
 
+class BatchCLinker(CLinker):
+    """
+    Compile the structs of several CLinkers in a single dynamic module.
+
+    The module defines one ``instantiate_<hash>`` function per member,
+    where ``<hash>`` is the code hash of the member's own module. All the
+    members must have been accepted, and must have the same compilation
+    options: see `batch_compile`.
+
+    Parameters
+    ----------
+    linkers
+        The CLinker of each member.
+    keys
+        The cmodule key of each member.
+
+    """
+
+    def __init__(self, linkers, keys):
+        super(BatchCLinker, self).__init__()
+        self.linkers = linkers
+        self.keys = keys
+
+    def accept(self, fgraph, no_recycling=None):
+        raise TypeError("A BatchCLinker does not compile a graph: it is "
+                        "built from CLinkers that already accepted theirs.")
+
+    def cmodule_key(self):
+        """
+        Return the combination of the keys of the members.
+
+        The header of the key (compilation options and config md5) is the
+        one shared by all the members.
+
+        """
+        header = self.keys[0][1][:_key_header_len(self.keys[0])]
+        version = (1,) + tuple(key[0] for key in self.keys)
+        sig = header + tuple(key[1][len(header):] for key in self.keys)
+        return version, sig
+
+    def c_compiler(self):
+        return self.linkers[0].c_compiler()
+
+    def compile_args(self):
+        return self.linkers[0].compile_args()
+
+    def header_dirs(self):
+        return self.linkers[0].header_dirs()
+
+    def libraries(self):
+        return self.linkers[0].libraries()
+
+    def lib_dirs(self):
+        return self.linkers[0].lib_dirs()
+
+    def instantiate_names(self):
+        """
+        Return the name of the instantiate function of each member.
+
+        """
+        self.get_dynamic_module()
+        return ['instantiate_%s' % h for h in self.member_hashes]
+
+    def get_dynamic_module(self):
+        if not hasattr(self, '_mod'):
+            mod = cmodule.DynamicModule()
+            placeholder = mod.hash_placeholder
+            self.member_hashes = []
+            for lnk in self.linkers:
+                member = lnk.get_dynamic_module()
+                # Finalize the member to get its hash, which replaces the
+                # placeholder in its names, so that they stay unique.
+                member.code()
+                h = member.code_hash
+                self.member_hashes.append(h)
+                for header in member.includes:
+                    if header not in mod.includes:
+                        mod.add_include(header)
+                for support_code in member.support_code:
+                    mod.add_support_code(support_code.replace(placeholder, h))
+                for block in member.init_blocks:
+                    block = block.replace(placeholder, h)
+                    if block not in mod.init_blocks:
+                        mod.add_init_code(block)
+                name = 'instantiate_%s' % h
+                if name not in [f.name for f in mod.functions]:
+                    code = lnk.instantiate_code(1 + len(lnk.args), name=name)
+                    mod.add_function(cmodule.ExtFunction(
+                        name, code.replace(placeholder, h),
+                        method=cmodule.METH_VARARGS))
+            self._mod = mod
+        return self._mod
+
+
+def _key_header_len(key):
+    """
+    Return the length of the part of a CLinker key before the node
+    signatures, or 0 if it has no config md5.
+
+    """
+    for i, key_element in enumerate(key[1]):
+        if (isinstance(key_element, string_types) and
+                key_element.startswith('md5:')):
+            return i + 1
+    return 0
+
+
+def batch_compile(keys_and_linkers):
+    """
+    Compile the modules of several CLinkers in as few modules as possible.
+
+    The versioned keys that are not in the cache yet are grouped by
+    compilation options, and each group of more than one module is compiled
+    by a `BatchCLinker`. The thunks later built by `CLinker.cthunk_factory`
+    for those keys use the batch module. If a batch fails to compile, its
+    members are left to be compiled separately.
+
+    Parameters
+    ----------
+    keys_and_linkers
+        List of (key, lnk) pairs, where lnk is an accepted CLinker and key
+        its cmodule key.
+
+    """
+    cache = get_module_cache()
+    groups = {}
+    group_keys = {}
+    group_order = []
+    for key, lnk in keys_and_linkers:
+        header_len = _key_header_len(key)
+        if (not key[0] or not header_len or key in _batched_instantiate or
+                cache.entry_from_key.get(key) is not None):
+            continue
+        group = (key[1][:header_len], tuple(lnk.lib_dirs()))
+        if group not in groups:
+            groups[group] = {}
+            group_keys[group] = []
+            group_order.append(group)
+        if key not in groups[group]:
+            groups[group][key] = lnk
+            group_keys[group].append(key)
+    batches = []
+    for group in group_order:
+        members = groups[group]
+        if len(members) < 2:
+            continue
+        # Keep the order of the nodes, so that the same function gets the
+        # same batch key.
+        keys = group_keys[group]
+        batch = BatchCLinker([members[k] for k in keys], keys)
+        batches.append((batch.cmodule_key(), batch))
+    if len(batches) > 1 and config.cmodule.compile_jobs > 1:
+        cache.module_from_keys(batches)
+    for batch_key, batch in batches:
+        try:
+            module = cache.module_from_key(key=batch_key, lnk=batch)
+        except Exception as e:
+            _logger.warning("Failed to compile %i C modules together, they "
+                            "will be compiled separately: %s",
+                            len(batch.keys), e)
+            continue
+        for key, name in zip(batch.keys, batch.instantiate_names()):
+            _batched_instantiate[key] = getattr(module, name)
+    while len(_batched_instantiate) > _max_batched_instantiate:
+        _batched_instantiate.popitem(last=False)
+
+
 class _CThunk(object):
     """
     A thunk with a C implementation.
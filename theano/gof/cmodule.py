@@ -14,10 +14,12 @@ import stat
 import subprocess
 import sys
 import tempfile
+import threading
 import time
 import platform
 import distutils.sysconfig
 import warnings
+from multiprocessing.pool import ThreadPool
 
 import numpy.distutils  # TODO: TensorType should handle this
 
@@ -34,7 +36,7 @@ from theano.misc.windows import (subprocess_Popen,
 from theano.gof import compilelock
 from theano.gof.compiledir import gcc_version_str, local_bitwidth
 
-from theano.configparser import AddConfigVar, BoolParam
+from theano.configparser import AddConfigVar, BoolParam, IntParam, StrParam
 
 importlib = None
 try:
@@ -66,18 +68,85 @@ AddConfigVar('cmodule.compilation_warning',
              "If True, will print compilation warnings.",
              BoolParam(False))
 
+AddConfigVar('cmodule.precompiled_header',
+             "If True, g++ compiles once the Python and NumPy headers "
+             "included by most modules in a precompiled header, and uses it "
+             "for all the modules that include them.",
+             BoolParam(True),
+             in_c_key=False)
+
 
 AddConfigVar('cmodule.preload_cache',
              "If set to True, will preload the C module cache at import time",
              BoolParam(False, allow_override=False),
              in_c_key=False)
 
+AddConfigVar('cmodule.use_index',
+             "If True, keep an index of the versioned modules in the "
+             "compilation directory, and use it to find modules instead of "
+             "loading every entry of the cache at startup.",
+             BoolParam(False, allow_override=False),
+             in_c_key=False)
+
+AddConfigVar('cmodule.lazy_load',
+             "If True, do not read the compilation directory when the module "
+             "cache is created: each module is looked up in the module index "
+             "and imported only when a function needs it. This implies "
+             "cmodule.use_index.",
+             BoolParam(False, allow_override=False),
+             in_c_key=False)
+
+AddConfigVar('cmodule.base_compiledirs',
+             "List of read-only compilation directories, separated by "
+             "os.pathsep, where compiled modules are looked up before the "
+             "compiledir. New modules are still compiled in the compiledir.",
+             StrParam('', allow_override=False),
+             in_c_key=False)
+
+AddConfigVar('cmodule.compile_jobs',
+             "Maximum number of C modules compiled at the same time when "
+             "linking a function. With 1, the modules are compiled one after "
+             "the other, as each thunk is built.",
+             IntParam(1, lambda i: i > 0),
+             in_c_key=False)
+
 _logger = logging.getLogger("theano.gof.cmodule")
 
 METH_VARARGS = "METH_VARARGS"
 METH_NOARGS = "METH_NOARGS"
 # global variable that represent the total time spent in importing module.
 import_time = 0
+# Time spent computing module hashes and refreshing the cache.
+hash_time = 0
+refresh_time = 0
+# Objects whose record_module(op_name, hit, src_size, compile_time) method is
+# called for each module looked up by the ModuleCache, like
+# theano.compile.profiling.CompileProfile.
+compile_profilers = []
+
+
+def _module_op_name(lnk):
+    """
+    Return the name of the Op class(es) compiled by `lnk`, for profiling.
+
+    """
+    linkers = getattr(lnk, 'linkers', [lnk])
+    fgraphs = [getattr(l, 'fgraph', None) for l in linkers]
+    if None in fgraphs:
+        return str(type(lnk))
+    return ','.join(sorted(set(
+        '%s.%s' % (type(node.op).__module__, type(node.op).__name__)
+        for fgraph in fgraphs for node in fgraph.apply_nodes)))
+
+
+def _record_module(lnk, hit, src_code=None, compile_time=0):
+    if compile_profilers and lnk is not None:
+        op_name = _module_op_name(lnk)
+        src_size = 0
+        if src_code is not None:
+            src_size = len(src_code)
+        for profiler in compile_profilers:
+            profiler.record_module(op_name, hit, src_size, compile_time)
 
 
 class MissingGXX(Exception):
@@ -531,15 +600,26 @@ class KeyData(object):
         pickle time (in which case a warning is also displayed).
 
         """
+        # The file is written under another name and renamed, so that a
+        # process reading it without holding the lock of its module bucket,
+        # like refresh() does, never sees it partially written.
+        tmp_pkl = '%s.%s.tmp' % (self.key_pkl, os.getpid())
         # Note that writing in binary mode is important under Windows.
         try:
-            with open(self.key_pkl, 'wb') as f:
+            with open(tmp_pkl, 'wb') as f:
                 pickle.dump(self, f, protocol=pickle.HIGHEST_PROTOCOL)
         except pickle.PicklingError:
             _logger.warning("Cache leak due to unpickle-able key data %s",
                             self.keys)
-            os.remove(self.key_pkl)
+            # The previous content of the file, if any, is kept.
+            os.remove(tmp_pkl)
             raise
+        try:
+            os.rename(tmp_pkl, self.key_pkl)
+        except OSError:
+            # Windows does not allow renaming over an existing file.
+            os.remove(self.key_pkl)
+            os.rename(tmp_pkl, self.key_pkl)
 
     def get_entry(self):
         """
@@ -574,6 +654,198 @@ class KeyData(object):
                 del entry_from_key[key]
 
 
+class ModuleIndex(object):
+    """
+    Append-only index mapping module hashes to their cache directory.
+
+    Each line of the index file is either ``+ <module_hash> <dirname>``,
+    written when a versioned module is added to the cache, or
+    ``- <module_hash>``, written when a module is found to be gone. The file
+    is read incrementally, so that keeping up with the modules added by
+    other processes only costs reading the new lines.
+
+    Entries are only hints: `ModuleCache` validates an entry when it looks
+    it up, and removes it if it does not point to a valid module anymore.
+
+    All the writes to the index file take its own lock (see
+    `compilelock.index_lock_ctx`), whether the caller holds the global
+    compilation lock or only the lock of a module bucket, so that a rewrite
+    of the index cannot lose a line appended at the same time.
+
+    Parameters
+    ----------
+    filename
+        Path of the index file. Directory names are stored relative to the
+        directory containing it.
+
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.lock_dir = os.path.join(os.path.dirname(filename),
+                                     'lock_dir_index')
+        self.dirs = {}
+        self.n_lines = 0
+        self._offset = 0
+        self._ino = None
+
+    def update(self):
+        """
+        Read the lines appended to the index file since the last update.
+
+        """
+        try:
+            with open(self.filename, 'rb') as f:
+                st = os.fstat(f.fileno())
+                if st.st_ino != self._ino or st.st_size < self._offset:
+                    # The index was rewritten since we last read it.
+                    self.dirs = {}
+                    self.n_lines = 0
+                    self._offset = 0
+                    self._ino = st.st_ino
+                f.seek(self._offset)
+                data = f.read()
+        except IOError:
+            return
+        # The last line may still be being written by another process.
+        end = data.rfind(b('\n')) + 1
+        self._offset += end
+        for line in decode(data[:end]).splitlines():
+            self._apply(line.split())
+
+    def _apply(self, fields):
+        if len(fields) == 3 and fields[0] == '+':
+            self.dirs[fields[1]] = fields[2]
+        elif len(fields) == 2 and fields[0] == '-':
+            self.dirs.pop(fields[1], None)
+        self.n_lines += 1
+
+    def _append(self, fields):
+        line = b(' '.join(fields) + '\n')
+        with compilelock.index_lock_ctx(self.lock_dir):
+            # Read the lines of the other processes first: the line is then
+            # appended where we stopped reading, and does not need to be
+            # read again by the next update.
+            self.update()
+            with open(self.filename, 'ab') as f:
+                st = os.fstat(f.fileno())
+                at_end = (st.st_ino == self._ino and
+                          st.st_size == self._offset)
+                f.write(line)
+        if at_end:
+            self._offset += len(line)
+            self._apply(fields)
+
+    def get(self, module_hash):
+        return self.dirs.get(module_hash)
+
+    def add(self, module_hash, dirname):
+        self._append(['+', module_hash, dirname])
+
+    def remove(self, module_hash):
+        if module_hash in self.dirs:
+            self._append(['-', module_hash])
+
+    def rewrite(self, dirs):
+        """
+        Replace the content of the index by the `dirs` dictionary.
+
+        This expects the compile lock to be held. The index lock is also
+        taken, so that no line appended meanwhile is lost.
+
+        """
+        with compilelock.index_lock_ctx(self.lock_dir):
+            tmp_filename = self.filename + '.tmp'
+            with open(tmp_filename, 'w') as f:
+                for module_hash, dirname in sorted(iteritems(dirs)):
+                    f.write('+ %s %s\n' % (module_hash, dirname))
+            try:
+                os.rename(tmp_filename, self.filename)
+            except OSError:
+                # Windows does not allow renaming over an existing file.
+                os.remove(self.filename)
+                os.rename(tmp_filename, self.filename)
+            self.update()
+
+    def compact(self):
+        """
+        Rewrite the index, keeping only the entries whose directory exists.
+
+        This expects the compile lock to be held.
+
+        """
+        with compilelock.index_lock_ctx(self.lock_dir):
+            self.update()
+            base = os.path.dirname(self.filename)
+            self.rewrite(dict(
+                (module_hash, dirname)
+                for module_hash, dirname in iteritems(self.dirs)
+                if os.path.isdir(os.path.join(base, dirname))))
+
+
+class BaseCacheDir(object):
+    """
+    Read-only compilation directory holding modules a `ModuleCache` can use.
+
+    Modules are found through the `ModuleIndex` of the directory if it has
+    one. Otherwise, its key.pkl files are read at the first lookup. Those
+    that cannot be unpickled yet (usually because they refer to classes that
+    are not imported yet) are read again at the next lookup that misses.
+
+    Nothing is ever written to the directory, and no lock is taken.
+
+    Parameters
+    ----------
+    dirname
+        Path of the directory, typically a compiledir populated in advance.
+
+    """
+
+    def __init__(self, dirname):
+        self.dirname = os.path.realpath(os.path.expanduser(dirname))
+        self.dirs = None
+        self._pending = []
+
+    def _scan(self):
+        self.dirs = {}
+        index_filename = os.path.join(self.dirname, 'module_index')
+        if os.path.exists(index_filename):
+            index = ModuleIndex(index_filename)
+            index.update()
+            self.dirs.update(index.dirs)
+            return
+        try:
+            subdirs = sorted(os.listdir(self.dirname))
+        except OSError:
+            _logger.warning("Cannot read base compiledir %s", self.dirname)
+            return
+        self._pending = [
+            subdir for subdir in subdirs
+            if os.path.exists(os.path.join(self.dirname, subdir, 'key.pkl'))]
+
+    def get(self, module_hash):
+        """
+        Return the name of the directory holding `module_hash`, or None.
+
+        """
+        if self.dirs is None:
+            self._scan()
+        if module_hash not in self.dirs and self._pending:
+            pending, self._pending = self._pending, []
+            for subdir in pending:
+                key_pkl = os.path.join(self.dirname, subdir, 'key.pkl')
+                try:
+                    with open(key_pkl, 'rb') as f:
+                        key_data = pickle.load(f)
+                except Exception:
+                    self._pending.append(subdir)
+                    continue
+                if isinstance(key_data, KeyData):
+                    # As in refresh(), the first directory wins.
+                    self.dirs.setdefault(key_data.module_hash, subdir)
+        return self.dirs.get(module_hash)
+
+
 class ModuleCache(object):
     """
     Interface to the cache of dynamically compiled modules on disk.
@@ -581,6 +853,10 @@ class ModuleCache(object):
     Note that this interface does not assume exclusive use of the cache
     directory. It is built to handle the case where multiple programs are also
     using instances of this class to manage the same directory.
+    Refreshing and cleaning up the cache take the global compilation lock.
+    Compiling a module takes either that lock too, or only the lock of the
+    bucket of modules it belongs to when ``config.compile.lock_per_module``
+    is True.
 
     The cache works on the basis of keys. Each key is mapped to only one
     dynamic module, but multiple keys may be mapped to the same module (see
@@ -624,6 +900,19 @@ class ModuleCache(object):
     These three elements uniquely identify a module, and are summarized
     in a single "module hash".
 
+    When ``config.cmodule.use_index`` is True, a `ModuleIndex` of the
+    versioned modules is kept in the cache directory. The cache is then not
+    walked at startup nor before compiling: the KeyData of a module is only
+    loaded when a key with the same module hash is looked up. With
+    ``config.cmodule.lazy_load``, even the index is only read at the first
+    lookup, so creating the cache does not touch the compilation directory.
+
+    The read-only compilation directories listed in
+    ``config.cmodule.base_compiledirs`` (see `BaseCacheDir`) are checked,
+    without locking, before the cache directory for each module that is not
+    loaded yet. Only the modules missing from all of them are compiled, into
+    the cache directory.
+
     Parameters
     ----------
     check_for_broken_eq
@@ -683,10 +972,23 @@ class ModuleCache(object):
         self.stats = [0, 0, 0]
         self.check_for_broken_eq = check_for_broken_eq
         self.loaded_key_pkl = set()
+        # Keys compiled by module_from_keys, whose module was recorded as a
+        # miss for the compile profile and is not looked up yet.
+        self._precompiled_keys = set()
         self.time_spent_in_check_key = 0
-
-        if do_refresh:
-            self.refresh()
+        self.base_caches = [BaseCacheDir(d) for d in
+                            config.cmodule.base_compiledirs.split(os.pathsep)
+                            if d]
+        self.index = None
+        self.index_ready = False
+        if config.cmodule.use_index or config.cmodule.lazy_load:
+            self.index = ModuleIndex(os.path.join(dirname, 'module_index'))
+
+        if do_refresh and not config.cmodule.lazy_load:
+            if self.index is not None:
+                self._init_index()
+            else:
+                self.refresh()
 
     age_thresh_use = 60 * 60 * 24 * 24    # 24 days
     """
@@ -710,6 +1012,163 @@ class ModuleCache(object):
             self.stats[0] += 1
         return self.module_from_name[name]
 
+    def _init_index(self):
+        """
+        Read the module index, building it from the cache content if it
+        does not exist yet.
+
+        """
+        if not os.path.exists(self.index.filename):
+            with compilelock.lock_ctx():
+                if not os.path.exists(self.index.filename):
+                    self.refresh()
+                    self.index.rewrite(dict(
+                        (module_hash,
+                         os.path.basename(os.path.dirname(
+                             key_data.get_entry())))
+                        for module_hash, key_data in
+                        iteritems(self.module_hash_to_key_data)
+                        if key_data.keys and list(key_data.keys)[0][0]))
+        self.index.update()
+        self.index_ready = True
+
+    def _load_from_index(self, module_hash):
+        """
+        Load the KeyData of `module_hash` if the index points to it.
+
+        Return True if it was loaded. The index entries that do not point to
+        a valid module anymore are removed from the index. The time spent
+        loading is counted in the module ``import_time``.
+
+        """
+        if not self.index_ready:
+            self._init_index()
+        dirname = self.index.get(module_hash)
+        if dirname is None:
+            self.index.update()
+            dirname = self.index.get(module_hash)
+            if dirname is None:
+                return False
+        loaded = self._load_key_data(module_hash,
+                                     os.path.join(self.dirname, dirname))
+        if loaded is False:
+            _logger.info("Removing index entry %s", module_hash)
+            self.index.remove(module_hash)
+        return bool(loaded)
+
+    def _load_from_base(self, module_hash):
+        """
+        Load the KeyData of `module_hash` from the first base cache that
+        has it.
+
+        Return True if it was loaded.
+
+        """
+        for base in self.base_caches:
+            dirname = base.get(module_hash)
+            if (dirname is not None and
+                    self._load_key_data(module_hash,
+                                        os.path.join(base.dirname, dirname))):
+                return True
+        return False
+
+    def _load_key_data(self, module_hash, root):
+        """
+        Load and register the KeyData of the module in directory `root`.
+
+        Return True if it was loaded, False if `root` does not hold a valid
+        versioned module with hash `module_hash`, and None if its key.pkl
+        file cannot be unpickled yet. The time spent is counted in the
+        module ``import_time``.
+
+        """
+        global import_time
+        t0 = time.time()
+        key_pkl = os.path.join(root, 'key.pkl')
+        try:
+            entry = module_name_from_dir(root)
+            with open(key_pkl, 'rb') as f:
+                key_data = pickle.load(f)
+        except (OSError, IOError, ValueError):
+            _logger.info("No module found in %s", root)
+            return False
+        except Exception:
+            # As in refresh(), this is usually a key referring to classes
+            # that are not imported yet, the module may still be valid.
+            _logger.info("ModuleCache failed to unpickle cache file %s",
+                         key_pkl)
+            return None
+        finally:
+            import_time += time.time() - t0
+        if (not isinstance(key_data, KeyData) or
+                key_data.module_hash != module_hash or
+                not is_same_entry(entry, key_data.get_entry()) or
+                not all(key[0] for key in key_data.keys)):
+            _logger.info("Invalid cache entry %s", key_pkl)
+            return False
+        key_data.entry = entry
+        key_data.key_pkl = key_pkl
+        self._register_key_data(key_data, entry, key_pkl)
+        _logger.debug("Loaded cache entry %s in %es", key_pkl,
+                      time.time() - t0)
+        return True
+
+    def _in_base_cache(self, key_data):
+        """
+        Return True if the module of `key_data` is in a read-only base cache.
+
+        """
+        return not key_data.key_pkl.startswith(
+            os.path.join(self.dirname, ''))
+
+    def _register_key_data(self, key_data, entry, key_pkl):
+        """
+        Add the keys of a KeyData loaded from `key_pkl` to the mappings.
+
+        """
+        # Remember the map from a module's hash to the KeyData
+        # object associated with it.
+        self.module_hash_to_key_data[key_data.module_hash] = key_data
+
+        for key in key_data.keys:
+            if key not in self.entry_from_key:
+                self.entry_from_key[key] = entry
+                # Assert that we have not already got this
+                # entry somehow.
+                assert entry not in self.module_from_name
+                # Store safe part of versioned keys.
+                if key[0]:
+                    self.similar_keys.setdefault(
+                        get_safe_part(key),
+                        []).append(key)
+            else:
+                dir1 = os.path.dirname(self.entry_from_key[key])
+                dir2 = os.path.dirname(entry)
+                _logger.warning(
+                    "The same cache key is associated to "
+                    "different modules (%s and %s). This "
+                    "is not supposed to happen! You may "
+                    "need to manually delete your cache "
+                    "directory to fix this.",
+                    dir1, dir2)
+        self.loaded_key_pkl.add(key_pkl)
+
+    def _refresh_before_compile(self):
+        """
+        Catch up with the modules other processes added to the cache.
+
+        """
+        if self.index is not None:
+            global refresh_time
+            t0 = time.time()
+            if self.index_ready:
+                self.index.update()
+            else:
+                self._init_index()
+            refresh_time += time.time() - t0
+        else:
+            self.refresh(cleanup=False)
+
     def refresh(self, age_thresh_use=None, delete_if_problem=False,
                 cleanup=True):
         """
@@ -761,8 +1220,8 @@ class ModuleCache(object):
         subdirs = sorted(os.listdir(self.dirname))
         files, root = None, None  # To make sure the "del" below works
         for subdirs_elem in subdirs:
-            # Never clean/remove lock_dir
-            if subdirs_elem == 'lock_dir':
+            # Never clean/remove lock_dir and lock_dir_modules
+            if subdirs_elem.startswith('lock_dir'):
                 continue
             root = os.path.join(self.dirname, subdirs_elem)
             key_pkl = os.path.join(root, 'key.pkl')
@@ -772,8 +1231,15 @@ class ModuleCache(object):
                 continue
             files = os.listdir(root)
             if not files:
-                rmtree_empty(root, ignore_nocleanup=True,
-                             msg="empty dir")
+                # A recent empty directory may have just been created by
+                # a compilation that only holds a module lock.
+                try:
+                    age = time_now - os.stat(root)[stat.ST_MTIME]
+                except OSError:
+                    continue
+                if age > config.compile.timeout:
+                    rmtree_empty(root, ignore_nocleanup=True,
+                                 msg="empty dir")
                 continue
             if 'delete.me' in files:
                 rmtree(root, ignore_nocleanup=True,
@@ -910,35 +1376,7 @@ class ModuleCache(object):
                                               age, entry)
                         continue
 
-                    # Remember the map from a module's hash to the KeyData
-                    # object associated with it.
-                    self.module_hash_to_key_data[mod_hash] = key_data
-
-                    for key in key_data.keys:
-                        if key not in self.entry_from_key:
-                            self.entry_from_key[key] = entry
-                            # Assert that we have not already got this
-                            # entry somehow.
-                            assert entry not in self.module_from_name
-                            # Store safe part of versioned keys.
-                            if key[0]:
-                                self.similar_keys.setdefault(
-                                    get_safe_part(key),
-                                    []).append(key)
-                        else:
-                            dir1 = os.path.dirname(self.entry_from_key[key])
-                            dir2 = os.path.dirname(entry)
-                            _logger.warning(
-                                "The same cache key is associated to "
-                                "different modules (%s and %s). This "
-                                "is not supposed to happen! You may "
-                                "need to manually delete your cache "
-                                "directory to fix this.",
-                                dir1, dir2)
-                    # Clean up the name space to prevent bug.
-                    if key_data.keys:
-                        del key
-                    self.loaded_key_pkl.add(key_pkl)
+                    self._register_key_data(key_data, entry, key_pkl)
                 else:
                     too_old_to_use.append(entry)
 
@@ -976,6 +1414,8 @@ class ModuleCache(object):
                 _logger.info("deleting ModuleCache entry %s", entry)
                 key_data.delete_keys_from(self.entry_from_key)
                 del self.module_hash_to_key_data[module_hash]
+                if self.index is not None:
+                    self.index.remove(module_hash)
                 if key_data.keys and list(key_data.keys)[0][0]:
                     # this is a versioned entry, so should have been on
                     # disk. Something weird happened to cause this, so we
@@ -1001,6 +1441,8 @@ class ModuleCache(object):
                     if not files:
                         _rmtree(*a, **kw)
 
+        global refresh_time
+        refresh_time += time.time() - start_time
         _logger.debug('Time needed to refresh cache: %s',
                       (time.time() - start_time))
 
@@ -1031,23 +1473,49 @@ class ModuleCache(object):
             return None
         return self._get_module(name)
 
+    def _lock_ctx(self, module_hash, keep_lock=False):
+        """
+        Return the lock context to take before working on a module.
+
+        This is the lock of the module bucket when
+        ``config.compile.lock_per_module`` is True (unless the caller needs
+        to keep the lock), and the global compilation lock otherwise.
+
+        """
+        if config.compile.lock_per_module and not keep_lock:
+            return compilelock.module_lock_ctx(module_hash)
+        return compilelock.lock_ctx(keep_lock=keep_lock)
+
     def _get_from_hash(self, module_hash, key, keep_lock=False):
+        if (module_hash not in self.module_hash_to_key_data and
+                (self._load_from_base(module_hash) or
+                 (self.index is not None and
+                  self._load_from_index(module_hash))) and
+                key in self.entry_from_key):
+            # The key was already saved with the module.
+            return self._get_from_key(key)
         if module_hash in self.module_hash_to_key_data:
             key_data = self.module_hash_to_key_data[module_hash]
             module = self._get_from_key(None, key_data)
-            with compilelock.lock_ctx(keep_lock=keep_lock):
-                try:
-                    key_data.add_key(key, save_pkl=bool(key[0]))
-                    key_broken = False
-                except pickle.PicklingError:
-                    key_data.remove_key(key)
-                    key_broken = True
-                # We need the lock while we check in case of parallel
-                # process that could be changing the file at the same
-                # time.
-                if (key[0] and not key_broken and
-                        self.check_for_broken_eq):
-                    self.check_key(key, key_data.key_pkl)
+            if self._in_base_cache(key_data):
+                # Base caches are read-only: the new key is only kept in
+                # memory, and no lock is needed.
+                key_data.add_key(key, save_pkl=False)
+                key_broken = False
+            else:
+                with self._lock_ctx(module_hash, keep_lock=keep_lock):
+                    try:
+                        key_data.add_key(key, save_pkl=bool(key[0]))
+                        key_broken = False
+                    except pickle.PicklingError:
+                        key_data.remove_key(key)
+                        key_broken = True
+                    # We need the lock while we check in case of parallel
+                    # process that could be changing the file at the same
+                    # time.
+                    if (key[0] and not key_broken and
+                            self.check_for_broken_eq):
+                        self.check_key(key, key_data.key_pkl)
             self._update_mappings(key, key_data, module.__file__, check_in_keys=not key_broken)
             return module
         else:
@@ -1070,7 +1538,8 @@ class ModuleCache(object):
 
     def _add_to_cache(self, module, key, module_hash):
         """
-        This function expects the compile lock to be held.
+        This function expects the compile lock, or the lock of the module
+        bucket, to be held.
 
         """
         name = module.__file__
@@ -1101,6 +1570,8 @@ class ModuleCache(object):
             if not key_broken and self.check_for_broken_eq:
                 self.check_key(key, key_pkl)
             self.loaded_key_pkl.add(key_pkl)
+            if self.index is not None:
+                self.index.add(module_hash, os.path.basename(location))
         elif config.cmodule.warn_no_version:
             key_flat = flatten(key)
             ops = [k for k in key_flat if isinstance(k, theano.Op)]
@@ -1132,16 +1603,25 @@ class ModuleCache(object):
         # Is the module in the cache?
         module = self._get_from_key(key)
         if module is not None:
+            if key in self._precompiled_keys:
+                # Compiled by module_from_keys, which recorded the miss.
+                self._precompiled_keys.discard(key)
+            else:
+                _record_module(lnk, hit=True)
             return module
 
         src_code = lnk.get_src_code()
         # Is the source code already in the cache?
+        global hash_time
+        t0 = time.time()
         module_hash = get_module_hash(src_code, key)
+        hash_time += time.time() - t0
         module = self._get_from_hash(module_hash, key, keep_lock=keep_lock)
         if module is not None:
+            _record_module(lnk, hit=True, src_code=src_code)
             return module
 
-        with compilelock.lock_ctx(keep_lock=keep_lock):
+        with self._lock_ctx(module_hash, keep_lock=keep_lock):
             # 1) Maybe somebody else compiled it for us while we
             #    where waiting for the lock. Try to load it again.
             # 2) If other repo that import Theano have Theano ops defined,
@@ -1156,19 +1636,24 @@ class ModuleCache(object):
             #    compilation to skip them, but not for future
             #    compilations. So reloading the cache here
             #    compilation fixes this problem. (we could do that only once)
-            self.refresh(cleanup=False)
+            #    With the module index, _get_from_hash loads the KeyData
+            #    of the module it looks up, when its Ops are imported.
+            self._refresh_before_compile()
 
             module = self._get_from_key(key)
             if module is not None:
+                _record_module(lnk, hit=True, src_code=src_code)
                 return module
 
             module = self._get_from_hash(module_hash, key)
             if module is not None:
+                _record_module(lnk, hit=True, src_code=src_code)
                 return module
 
             hash_key = hash(key)
 
             nocleanup = False
+            t0 = time.time()
             try:
                 location = dlimport_workdir(self.dirname)
                 module = lnk.compile_cmodule(location)
@@ -1195,10 +1680,123 @@ class ModuleCache(object):
 
             key_data = self._add_to_cache(module, key, module_hash)
             self.module_hash_to_key_data[module_hash] = key_data
+            _record_module(lnk, hit=False, src_code=src_code,
+                           compile_time=time.time() - t0)
 
         self.stats[2] += 1
         return module
 
+    def module_from_keys(self, keys_and_linkers, n_jobs=None):
+        """
+        Make sure the modules of several keys are in the cache, compiling
+        the missing ones concurrently.
+
+        Parameters
+        ----------
+        keys_and_linkers
+            List of (key, lnk) pairs, like the `key` and `lnk` arguments of
+            `module_from_key`. Besides `get_src_code()`, `lnk` must define
+            `build_cmodule(location)`, which writes the dynamic library in
+            `location` without importing it and returns its path.
+        n_jobs
+            Maximum number of concurrent compilations. Defaults to
+            ``config.cmodule.compile_jobs``.
+
+        Returns
+        -------
+        dict
+            Maps the key of each module compiled here to its compilation
+            time, in seconds.
+
+        Notes
+        -----
+        The compilations run in compiler subprocesses, so a pool of threads
+        is enough to keep `n_jobs` of them busy. The modules are imported and
+        added to the cache by the calling thread, as they are built, while
+        holding the compilation lock.
+
+        Compilation errors are not raised here. The modules that failed are
+        left out of the cache, so that `module_from_key` reports the error
+        when the corresponding thunk is built.
+
+        """
+        if n_jobs is None:
+            n_jobs = config.cmodule.compile_jobs
+
+        def missing(pairs):
+            # Keep only one (key, lnk) pair per module hash not in the cache.
+            rval = []
+            seen = set()
+            for key, lnk in pairs:
+                if self._get_from_key(key) is not None:
+                    continue
+                module_hash = get_module_hash(lnk.get_src_code(), key)
+                if module_hash in seen:
+                    continue
+                if self._get_from_hash(module_hash, key) is not None:
+                    continue
+                seen.add(module_hash)
+                rval.append((key, lnk, module_hash))
+            return rval
+
+        compile_time = {}
+        if not missing(keys_and_linkers):
+            return compile_time
+
+        def build(job):
+            key, lnk, module_hash, location = job
+            t0 = time.time()
+            try:
+                return job, lnk.build_cmodule(location), time.time() - t0
+            except Exception as e:
+                _logger.debug('Parallel compilation of %s failed: %s',
+                              location, e)
+                return job, None, time.time() - t0
+
+        with compilelock.lock_ctx():
+            # Somebody else may have compiled some of those modules while we
+            # were waiting for the lock.
+            self._refresh_before_compile()
+            jobs = [(key, lnk, module_hash, dlimport_workdir(self.dirname))
+                    for key, lnk, module_hash in missing(keys_and_linkers)]
+            if not jobs:
+                return compile_time
+            n_jobs = max(1, min(n_jobs, len(jobs)))
+            _logger.debug('Compiling %i modules with %i jobs',
+                          len(jobs), n_jobs)
+            pool = ThreadPool(n_jobs)
+            try:
+                for (key, lnk, module_hash, location), lib_filename, t in \
+                        pool.imap_unordered(build, jobs):
+                    if lib_filename is None:
+                        _rmtree(location, ignore_if_missing=True,
+                                msg='exception during compilation')
+                        continue
+                    try:
+                        open(os.path.join(location, "__init__.py"),
+                             'w').close()
+                        module = dlimport(lib_filename)
+                    except Exception:
+                        _rmtree(location, ignore_if_missing=True,
+                                msg='exception during import')
+                        raise
+                    name = module.__file__
+                    assert name.startswith(location)
+                    assert name not in self.module_from_name
+                    self.module_from_name[name] = module
+                    key_data = self._add_to_cache(module, key, module_hash)
+                    self.module_hash_to_key_data[module_hash] = key_data
+                    self.stats[2] += 1
+                    compile_time[key] = t
+                    self._precompiled_keys.add(key)
+                    _record_module(lnk, hit=False,
+                                   src_code=lnk.get_src_code(),
+                                   compile_time=t)
+            finally:
+                pool.close()
+                pool.join()
+        return compile_time
+
     def check_key(self, key, key_pkl):
         """
         Perform checks to detect broken __eq__ / __hash__ implementations.
@@ -1318,6 +1916,12 @@ class ModuleCache(object):
                 _rmtree(parent, msg='old cache directory', level=logging.INFO,
                         ignore_nocleanup=True)
 
+            # Drop the entries of deleted modules once they make up most of
+            # the index.
+            if (self.index is not None and
+                    self.index.n_lines > 2 * len(self.index.dirs) + 100):
+                self.index.compact()
+
     def clear(self, unversioned_min_age=None, clear_base_files=False,
               delete_if_problem=False):
         """
@@ -1375,6 +1979,52 @@ class ModuleCache(object):
                         _logger.warning('Could not move %s to %s',
                                         to_rename, to_delete)
 
+    def _clear_own_unversioned(self):
+        """
+        Delete the unversioned modules loaded by this process.
+
+        Unlike `clear_unversioned`, this does not list the compilation
+        directory. The directories of these modules are only used by this
+        process, so this does not need the compile lock either.
+
+        """
+        all_key_datas = list(self.module_hash_to_key_data.values())
+        for key_data in all_key_datas:
+            if not key_data.keys:
+                # May happen for broken versioned keys.
+                continue
+            for key_idx, key in enumerate(key_data.keys):
+                version, rest = key
+                if version:
+                    # Since the version is included in the module hash,
+                    # it should not be possible to mix versioned and
+                    # unversioned keys in the same KeyData object.
+                    assert key_idx == 0
+                    break
+            if not version:
+                # Note that unversioned keys cannot be broken, so we can
+                # set do_manual_check to False to speed things up.
+                key_data.delete_keys_from(self.entry_from_key,
+                                          do_manual_check=False)
+                entry = key_data.get_entry()
+                # Entry is guaranteed to be in this dictionary, because
+                # an unversioned entry should never have been loaded via
+                # refresh.
+                assert entry in self.module_from_name
+
+                del self.module_from_name[entry]
+                del self.module_hash_to_key_data[key_data.module_hash]
+
+                parent = os.path.dirname(entry)
+                assert parent.startswith(os.path.join(self.dirname, 'tmp'))
+                _rmtree(parent, msg='unversioned', level=logging.INFO,
+                        ignore_nocleanup=True)
+
+        # Sanity check: all unversioned keys should have been removed at
+        # this point.
+        for key in self.entry_from_key:
+            assert key[0]
+
     def clear_unversioned(self, min_age=None):
         """
         Delete unversioned dynamic modules.
@@ -1393,42 +2043,7 @@ class ModuleCache(object):
             min_age = self.age_thresh_del_unversioned
 
         with compilelock.lock_ctx():
-            all_key_datas = list(self.module_hash_to_key_data.values())
-            for key_data in all_key_datas:
-                if not key_data.keys:
-                    # May happen for broken versioned keys.
-                    continue
-                for key_idx, key in enumerate(key_data.keys):
-                    version, rest = key
-                    if version:
-                        # Since the version is included in the module hash,
-                        # it should not be possible to mix versioned and
-                        # unversioned keys in the same KeyData object.
-                        assert key_idx == 0
-                        break
-                if not version:
-                    # Note that unversioned keys cannot be broken, so we can
-                    # set do_manual_check to False to speed things up.
-                    key_data.delete_keys_from(self.entry_from_key,
-                                              do_manual_check=False)
-                    entry = key_data.get_entry()
-                    # Entry is guaranteed to be in this dictionary, because
-                    # an unversioned entry should never have been loaded via
-                    # refresh.
-                    assert entry in self.module_from_name
-
-                    del self.module_from_name[entry]
-                    del self.module_hash_to_key_data[key_data.module_hash]
-
-                    parent = os.path.dirname(entry)
-                    assert parent.startswith(os.path.join(self.dirname, 'tmp'))
-                    _rmtree(parent, msg='unversioned', level=logging.INFO,
-                            ignore_nocleanup=True)
-
-            # Sanity check: all unversioned keys should have been removed at
-            # this point.
-            for key in self.entry_from_key:
-                assert key[0]
+            self._clear_own_unversioned()
 
             time_now = time.time()
             for filename in os.listdir(self.dirname):
@@ -1469,11 +2084,20 @@ class ModuleCache(object):
 
     def _on_atexit(self):
         # Note: no need to call refresh() since it is called by clear_old().
-        with compilelock.lock_ctx():
-            self.clear_old()
-            self.clear_unversioned()
+        # In lazy mode, old modules and the unversioned modules left by
+        # other processes are left to `theano-cache cleanup`, so that
+        # exiting neither reads the whole cache nor takes the compile lock.
+        if config.cmodule.lazy_load:
+            self._clear_own_unversioned()
+        else:
+            with compilelock.lock_ctx():
+                self.clear_old()
+                self.clear_unversioned()
         _logger.debug('Time spent checking keys: %s',
                       self.time_spent_in_check_key)
+        _logger.debug('Time spent waiting for compilation locks: %s '
+                      '(number of waits: %s)',
+                      compilelock.wait_time, compilelock.wait_count)
 
 
 def _rmtree(parent, ignore_nocleanup=False, msg='', level=logging.DEBUG,
@@ -2134,9 +2758,8 @@ class GCC_compiler(Compiler):
         cmd = [theano.config.cxx, get_gcc_shared_library_arg(), '-g']
 
         if config.cmodule.remove_gxx_opt:
-            cmd.extend(p for p in preargs if not p.startswith('-O'))
-        else:
-            cmd.extend(preargs)
+            preargs = [p for p in preargs if not p.startswith('-O')]
+        cmd.extend(preargs)
         cmd.extend('-I%s' % idir for idir in include_dirs)
         if hide_symbols and sys.platform != 'win32':
             # This has been available since gcc 4.0 so we suppose it
@@ -2146,6 +2769,18 @@ class GCC_compiler(Compiler):
             # improved loading times on most platforms (win32 is
             # different, as usual).
             cmd.append('-fvisibility=hidden')
+        if (config.cmodule.precompiled_header and
+                'g++' in theano.config.cxx and
+                '#include <numpy/arrayobject.h>' in src_code):
+            # Only the flags that change how the headers are read are
+            # passed, so that most modules share the same header.
+            pch_flags = ['-g'] + preargs + [
+                '-I%s' % idir for idir in std_include_dirs()]
+            if hide_symbols and sys.platform != 'win32':
+                pch_flags.append('-fvisibility=hidden')
+            header = get_precompiled_header(pch_flags)
+            if header is not None:
+                cmd.extend(['-include', header])
         cmd.extend(['-o', lib_filename])
         cmd.append(cppfilename)
         cmd.extend(['-L%s' % ldir for ldir in lib_dirs])
@@ -2194,5 +2829,73 @@ class GCC_compiler(Compiler):
             return dlimport(lib_filename)
 
 
+# Headers put in the precompiled header. The modules that include NumPy
+# include all of them (see Scalar.c_headers), so including them first does
+# not change their meaning.
+PRELUDE_HEADERS = ['<Python.h>', '<iostream>', '"theano_mod_helper.h"',
+                   '<math.h>', '<numpy/arrayobject.h>',
+                   '<numpy/arrayscalars.h>']
+
+# Maps the hash of the flags of a precompiled header to its path, or to None
+# if it could not be built.
+_precompiled_headers = {}
+_precompiled_headers_lock = threading.Lock()
+
+
+def get_precompiled_header(flags):
+    """
+    Return the path of a header including PRELUDE_HEADERS, precompiled with
+    `flags`, or None if it cannot be built.
+
+    The header is built once in the ``pch`` subdirectory of the compiledir,
+    in a directory named after the hash of the compiler version, `flags` and
+    the versions of Python and NumPy. Since g++ only uses a precompiled
+    header compiled with compatible flags, and otherwise reads the header
+    itself, passing ``-include <path>`` to g++ is always safe.
+
+    """
+    prelude = ''.join('#include %s\n' % h for h in PRELUDE_HEADERS)
+    pch_hash = hash_from_code('\n'.join(
+        [theano.config.cxx, gcc_version_str, sys.version, numpy.__version__,
+         prelude] + list(flags)))
+    with _precompiled_headers_lock:
+        if pch_hash in _precompiled_headers:
+            return _precompiled_headers[pch_hash]
+        pch_dir = os.path.join(config.compiledir, 'pch', pch_hash)
+        header = os.path.join(pch_dir, 'theano_prelude.h')
+        if not os.path.exists(header + '.gch'):
+            # Build it in a temporary directory, renamed when complete, so
+            # that no process uses a partial header.
+            if not os.path.isdir(os.path.dirname(pch_dir)):
+                try:
+                    os.makedirs(os.path.dirname(pch_dir))
+                except OSError:
+                    pass
+            tmp_dir = tempfile.mkdtemp(dir=os.path.dirname(pch_dir))
+            tmp_header = os.path.join(tmp_dir, 'theano_prelude.h')
+            with open(tmp_header, 'w') as f:
+                f.write(prelude)
+            cmd = ([theano.config.cxx, '-x', 'c++-header'] + list(flags) +
+                   ['-o', tmp_header + '.gch', tmp_header])
+            _logger.debug('Building precompiled header: %s', ' '.join(cmd))
+            t0 = time.time()
+            p_out = output_subprocess_Popen(cmd)
+            if p_out[2]:
+                _logger.warning('Could not build the precompiled header, '
+                                'compiling without it: %s', decode(p_out[1]))
+                _rmtree(tmp_dir, ignore_nocleanup=True)
+                _precompiled_headers[pch_hash] = None
+                return None
+            _logger.debug('Precompiled header built in %es',
+                          time.time() - t0)
+            try:
+                os.rename(tmp_dir, pch_dir)
+            except OSError:
+                # Another process built it at the same time.
+                _rmtree(tmp_dir, ignore_nocleanup=True)
+        _precompiled_headers[pch_hash] = header
+        return header
+
+
 def icc_module_compile_str(*args):
     raise NotImplementedError()
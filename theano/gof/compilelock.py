@@ -12,7 +12,7 @@ from contextlib import contextmanager
 import numpy as np
 
 from theano import config
-from theano.configparser import AddConfigVar, IntParam
+from theano.configparser import AddConfigVar, BoolParam, IntParam
 
 random = np.random.RandomState([2015, 8, 2])
 
@@ -41,8 +41,29 @@ period for running processes.""",
                       allow_override=False),
              in_c_key=False)
 
+AddConfigVar('compile.lock_per_module',
+             """If True, compiling a C module only locks the bucket of
+modules it belongs to (selected from its hash) instead of the whole
+compilation directory, so that processes compiling unrelated modules do
+not wait for each other. The global lock is still used to refresh and
+clean up the cache.""",
+             BoolParam(False),
+             in_c_key=False)
+
 hostname = socket.gethostname()
 
+# Time spent (in seconds) waiting for locks held by other processes, and
+# number of times we had to wait, for the global lock, the module locks and
+# the lock of the module index.
+wait_time = {'global': 0.0, 'module': 0.0, 'index': 0.0}
+wait_count = {'global': 0, 'module': 0, 'index': 0}
+
+
+def _record_wait(kind, n_wait, t0):
+    if n_wait:
+        wait_time[kind] += time.time() - t0
+        wait_count[kind] += 1
+
 
 def force_unlock():
     """
@@ -101,7 +122,8 @@ def _get_lock(lock_dir=None, **kw):
     if get_lock.lock_is_enabled:
         # Only really try to acquire the lock if we do not have it already.
         if get_lock.n_lock == 0:
-            lock(get_lock.lock_dir, **kw)
+            t0 = time.time()
+            _record_wait('global', lock(get_lock.lock_dir, **kw), t0)
             atexit.register(Unlocker.unlock, get_lock.unlocker)
             # Store time at which the lock was set.
             get_lock.start_time = time.time()
@@ -156,6 +178,84 @@ def set_lock_status(use_lock):
     """
     get_lock.lock_is_enabled = use_lock
 
+
+def module_lock_dir(module_hash):
+    """
+    Return the lock directory of the bucket `module_hash` belongs to.
+
+    """
+    return os.path.join(config.compiledir, 'lock_dir_modules',
+                        module_hash[-2:])
+
+# Lock directory -> [number of times it is held by this process, time at
+# which it was acquired or refreshed].
+_module_locks = {}
+
+
+@contextmanager
+def _dir_lock_ctx(tmp_dir, kind, **kw):
+    """
+    Lock `tmp_dir`, reentrant within a process.
+
+    """
+    if not getattr(get_lock, 'lock_is_enabled', True):
+        yield
+        return
+    if tmp_dir not in _module_locks:
+        t0 = time.time()
+        _record_wait(kind, lock(tmp_dir, **kw), t0)
+        _module_locks[tmp_dir] = [0, time.time()]
+    else:
+        # Refresh the lock like get_lock does, so that nobody overrides it
+        # during a long compilation.
+        now = time.time()
+        if now - _module_locks[tmp_dir][1] > config.compile.timeout / 2:
+            refresh_lock(os.path.join(tmp_dir, 'lock'))
+            _module_locks[tmp_dir][1] = now
+    _module_locks[tmp_dir][0] += 1
+    try:
+        yield
+    finally:
+        _module_locks[tmp_dir][0] -= 1
+        if _module_locks[tmp_dir][0] == 0:
+            del _module_locks[tmp_dir]
+            Unlocker(tmp_dir).unlock(force=False)
+
+
+def module_lock_ctx(module_hash, **kw):
+    """
+    Lock only the bucket of compiled modules `module_hash` belongs to.
+
+    Only the processes working on modules of the same bucket wait for each
+    other. Like `lock_ctx`, this is reentrant within a process.
+
+    Parameters
+    ----------
+    kw
+        Additional arguments to be forwarded to the `lock` function when
+        acquiring the lock.
+
+    """
+    return _dir_lock_ctx(module_lock_dir(module_hash), 'module', **kw)
+
+
+def index_lock_ctx(lock_dir, **kw):
+    """
+    Lock the module index whose lock directory is `lock_dir`.
+
+    Every write to the index takes this lock, whichever of the global
+    lock or a module lock is held, and it is only held for the duration of
+    the write. It must not be held while taking another lock.
+
+    Parameters
+    ----------
+    kw
+        Additional arguments to be forwarded to the `lock` function when
+        acquiring the lock.
+
+    """
+    return _dir_lock_ctx(lock_dir, 'index', **kw)
+
 # This is because None is a valid input for timeout
 notset = object()
 
@@ -196,6 +296,11 @@ def lock(tmp_dir, timeout=notset, min_wait=None, max_wait=None, verbosity=1):
     verbosity : int
         Amount of feedback displayed to screen (default 1).
 
+    Returns
+    -------
+    int
+        The number of times we had to wait for the lock.
+
     """
     if min_wait is None:
         min_wait = config.compile.wait
@@ -257,7 +362,7 @@ def lock(tmp_dir, timeout=notset, min_wait=None, max_wait=None, verbosity=1):
                         msg = "process '%s'" % read_owner.split('_')[0]
                         _logger.warning("Overriding existing lock by dead %s "
                                         "(I am process '%s')", msg, my_pid)
-                    get_lock.unlocker.unlock(force=True)
+                    Unlocker(tmp_dir).unlock(force=True)
                     continue
                 if last_owner == read_owner:
                     if (timeout is not None and
@@ -270,7 +375,7 @@ def lock(tmp_dir, timeout=notset, min_wait=None, max_wait=None, verbosity=1):
                                 msg = "process '%s'" % read_owner.split('_')[0]
                             _logger.warning("Overriding existing lock by %s "
                                             "(I am process '%s')", msg, my_pid)
-                        get_lock.unlocker.unlock(force=True)
+                        Unlocker(tmp_dir).unlock(force=True)
                         continue
                 else:
                     last_owner = read_owner
@@ -316,7 +421,7 @@ def lock(tmp_dir, timeout=notset, min_wait=None, max_wait=None, verbosity=1):
                 continue
             else:
                 # We got the lock, hoorray!
-                return
+                return nb_wait
 
         except Exception as e:
             # If something wrong happened, we try again.
@@ -179,6 +179,108 @@ def _contains_cycle(fgraph, orderings):
     return visited != len(parent_counts)
 
 
+def _contains_cycle_incremental(fgraph, orderings, new_edges, clients):
+    """
+    Check for cycles a graph that had none before some dependencies were
+    added to it.
+
+    A new cycle must go through one of the new dependencies, so only the
+    nodes that come after them are examined, instead of the whole graph
+    as in `_contains_cycle`.
+
+    Parameters
+    ----------
+    fgraph
+        The FunctionGraph to check for cycles.
+    orderings
+        Dictionary specifying extra dependencies besides those encoded in
+        Variable.owner / Apply.inputs, as for `_contains_cycle`.
+    new_edges
+        List of (parent, child) pairs, the dependencies added since the
+        graph was known to have no cycle. A parent or child can be a
+        Variable or an Apply instance, and may no longer be in the graph.
+    clients
+        Dictionary mapping a Variable to a dictionary from the Apply
+        instances that use it to the number of times they use it.
+
+    Returns
+    -------
+    bool
+        True if the graph contains a cycle, False otherwise.
+
+    """
+    ord_children = {}
+    for app, deps in iteritems(orderings):
+        for dep in deps:
+            ord_children.setdefault(dep, []).append(app)
+
+    def children(node):
+        if isinstance(node, graph.Apply):
+            return node.outputs + ord_children.get(node, [])
+        return [app for app, count in iteritems(clients.get(node, {}))
+                if count]
+
+    apply_nodes = fgraph.apply_nodes
+    variables = fgraph.variables
+
+    def in_graph(node):
+        if isinstance(node, graph.Apply):
+            return node in apply_nodes
+        return node in variables
+
+    # The region reachable from the children of the new dependencies.
+    sources = set()
+    region = set()
+    stack = []
+    for parent, child in new_edges:
+        if not (in_graph(parent) and in_graph(child)):
+            continue
+        sources.add(parent)
+        if child not in region:
+            region.add(child)
+            stack.append(child)
+    while stack:
+        for child in children(stack.pop()):
+            if child not in region:
+                region.add(child)
+                stack.append(child)
+
+    # A cycle through the new dependency (parent, child) goes back to
+    # parent from child.
+    if sources.isdisjoint(region):
+        return False
+
+    # Look for a cycle in the region as _contains_cycle does.
+    parent_counts = {}
+    visitable = deque()
+    for node in region:
+        if isinstance(node, graph.Apply):
+            parents = set(node.inputs)
+            parents.update(orderings.get(node, ()))
+        elif node.owner is not None:
+            parents = (node.owner,)
+        else:
+            parents = ()
+        count = 0
+        for parent in parents:
+            if parent in region:
+                count += 1
+        parent_counts[node] = count
+        if not count:
+            visitable.append(node)
+
+    visited = 0
+    while visitable:
+        node = visitable.popleft()
+        visited += 1
+        for child in children(node):
+            parent_counts[child] -= 1
+            if not parent_counts[child]:
+                visitable.append(child)
+
+    return visited != len(region)
+
+
 def _build_droot_impact(destroy_handler):
     droot = {}   # destroyed view + nonview variables -> foundation
     impact = {}  # destroyed nonview variable -> it + all views of it
@@ -651,7 +753,8 @@ class DestroyHandler(toolbox.Bookkeeper):  # noqa
 
     It is a work in progress. The following data structures have been
     converted to use the incremental strategy:
-        <none>
+        the cycle check of validate, which only examines the nodes after
+        the dependencies added since the last successful validation.
 
     The following data structures remain to be converted:
         <unknown>
@@ -736,6 +839,11 @@ class DestroyHandler(toolbox.Bookkeeper):  # noqa
         # clients: how many times does an apply use a given variable
         self.clients = OrderedDict()  # variable -> apply -> ninputs
         self.stale_droot = True
+        # The orderings of the last successful validate, or None if the
+        # next one must check the whole graph for cycles.
+        self.validated_orderings = None
+        # (parent, child) dependencies added since then.
+        self.new_edges = []
 
         self.debug_all_apps = OrderedSet()
         if self.do_imports_on_attach:
@@ -770,6 +878,8 @@ class DestroyHandler(toolbox.Bookkeeper):  # noqa
         del self.view_o
         del self.clients
         del self.stale_droot
+        del self.validated_orderings
+        del self.new_edges
         assert self.fgraph.destroyer_handler is self
         delattr(self.fgraph, 'destroyers')
         delattr(self.fgraph, 'destroy_handler')
@@ -805,6 +915,8 @@ class DestroyHandler(toolbox.Bookkeeper):  # noqa
         for i, input in enumerate(app.inputs):
             self.clients.setdefault(input, OrderedDict()).setdefault(app, 0)
             self.clients[input][app] += 1
+            if self.validated_orderings is not None:
+                self.new_edges.append((input, app))
 
         for i, output in enumerate(app.outputs):
             self.clients.setdefault(output, OrderedDict())
@@ -868,6 +980,8 @@ class DestroyHandler(toolbox.Bookkeeper):  # noqa
 
             self.clients.setdefault(new_r, OrderedDict()).setdefault(app, 0)
             self.clients[new_r][app] += 1
+            if self.validated_orderings is not None:
+                self.new_edges.append((new_r, app))
 
             # UPDATE self.view_i, self.view_o
             for o_idx, i_idx_list in iteritems(getattr(app.op, 'view_map',
@@ -899,13 +1013,38 @@ class DestroyHandler(toolbox.Bookkeeper):  # noqa
         a) orderings() raises an error
         b) orderings cannot be topologically sorted.
 
+        Once the graph was validated, only the cycle search is incremental:
+        it starts from the dependencies added since the last validate. The
+        orderings are still computed for the whole graph, and compared to
+        the last ones to find those new dependencies.
+
         """
         if self.destroyers:
             ords = self.orderings(fgraph)
 
-            if _contains_cycle(fgraph, ords):
+            if self.validated_orderings is None:
+                cycle = _contains_cycle(fgraph, ords)
+            else:
+                # The graph had no cycle at the last validate, so only
+                # look from the dependencies added since.
+                new_edges = self.new_edges
+                old_ords = self.validated_orderings
+                for app, deps in iteritems(ords):
+                    old_deps = old_ords.get(app, ())
+                    new_edges.extend((dep, app) for dep in deps
+                                     if dep not in old_deps)
+                cycle = _contains_cycle_incremental(fgraph, ords, new_edges,
+                                                    self.clients)
+            if cycle:
                 raise InconsistencyError("Dependency graph contains cycles")
+            self.validated_orderings = ords
+            self.new_edges = []
         else:
+            # Cycles are not checked, so the next validate with
+            # destructive ops checks the whole graph.
+            self.validated_orderings = None
+            self.new_edges = []
+
             # James's Conjecture:
             # If there are no destructive ops, then there can be no cycles.
 
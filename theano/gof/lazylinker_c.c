@@ -2,6 +2,7 @@
 #include "theano_mod_helper.h"
 #include "structmember.h"
 #include <sys/time.h>
+#include <time.h>
 
 #if PY_VERSION_HEX >= 0x03000000
 #include "numpy/npy_3kcompat.h"
@@ -14,6 +15,11 @@
 #define Py_TYPE(obj) obj->ob_type
 #endif
 
+#ifndef Py_RETURN_NOTIMPLEMENTED
+#define Py_RETURN_NOTIMPLEMENTED \
+  return Py_INCREF(Py_NotImplemented), Py_NotImplemented
+#endif
+
 /**
 
 TODO: 
@@ -36,6 +42,20 @@ static double pytime(const struct timeval * tv)
   return (double) tv->tv_sec + (double) tv->tv_usec / 1000000.0;
 }
 
+/**
+  Monotonic clock used to time the thunks, with a better resolution than
+  pytime where it is available.
+  */
+static double thunk_time(void)
+{
+#ifdef CLOCK_MONOTONIC
+  struct timespec ts;
+  if (clock_gettime(CLOCK_MONOTONIC, &ts) == 0)
+    return (double) ts.tv_sec + (double) ts.tv_nsec / 1000000000.0;
+#endif
+  return pytime(NULL);
+}
+
 /**
   Helper routine to convert a PyList of integers to a c array of integers.
   */
@@ -485,12 +505,12 @@ static PyObject * pycall(CLazyLinker * self, Py_ssize_t node_idx, int verbose)
   PyObject * rval = NULL;
   if (self->do_timing)
     {
-      double t0 = pytime(NULL);
+      double t0 = thunk_time();
       if (verbose) fprintf(stderr, "calling via Python (node %i)\n", (int)node_idx);
       rval = PyObject_CallObject(thunk, NULL);
       if (rval)
         {
-          double t1 = pytime(NULL);
+          double t1 = thunk_time();
           double ti = PyFloat_AsDouble(
                          PyList_GetItem(self->call_times, node_idx));
           PyList_SetItem(self->call_times, node_idx,
@@ -519,9 +539,9 @@ static int c_call(CLazyLinker * self, Py_ssize_t node_idx, int verbose)
   int err = 0;
   if (self->do_timing)
     {
-      double t0 = pytime(NULL);
+      double t0 = thunk_time();
       err = fn(self->thunk_cptr_data[node_idx]);
-      double t1 = pytime(NULL);
+      double t1 = thunk_time();
       double ti = PyFloat_AsDouble(PyList_GetItem(self->call_times, node_idx));
       PyList_SetItem(self->call_times, node_idx, PyFloat_FromDouble(t1 - t0 + ti));
       PyObject * count = PyList_GetItem(self->call_counts, node_idx);
@@ -1012,9 +1032,663 @@ static PyTypeObject lazylinker_ext_CLazyLinkerType = {
     CLazyLinker_new,           /* tp_new */
 };
 
+/**
+
+  FastCall
+
+  The work of theano.compile.function_module.Function.__call__ for the
+  common case where all the inputs are given positionally: filter the
+  arguments, bind them to the input storage, check that they do not share
+  memory, run the VM and collect the outputs, in one native call.
+
+  Calling it returns NotImplemented when the arguments can not be handled
+  here (wrong number of arguments, argument rejected by its filter), so
+  that Function.__call__ falls back to the Python implementation, which
+  reports the error. The errors raised by the VM are propagated, and
+  vm_failed tells them apart from the other errors of the call.
+
+  */
+typedef struct {
+    PyObject_HEAD
+    PyObject * fn; // the VM
+    PyObject * mode; // fn_time and call_time are updated on the mode
+    Py_ssize_t n_inputs; // number of positional inputs
+    Py_ssize_t n_cells; // number of input containers, positional first
+    PyObject * input_cells; // storage of each input container
+    PyObject * filters; // callable filtering each positional argument
+    PyObject * exact_types; // type accepted without the filter, or None
+    PyObject * dtypes; // dtype accepted without the filter
+    PyObject * broadcastable; // dims that must be of length 1
+    Py_ssize_t * ndims;
+    Py_ssize_t * alignments;
+    Py_ssize_t * alias_groups; // -1, or inputs that may share memory
+    PyObject * may_share_memory; // callable for each input container
+    PyObject * output_containers;
+    PyObject * gc_cells; // output storage cleared after the call
+    PyObject * update_containers; // inputs updated by the last outputs
+    Py_ssize_t n_returned;
+    int need_update_inputs;
+    int unpack_single;
+    int return_none;
+    int vm_failed; // 1 if the last error was raised by the VM
+    // memory extents of the input values, filled at each call
+    char ** extent_lo;
+    char ** extent_hi;
+} FastCall;
+
+static void
+FastCall_dealloc(PyObject* _self)
+{
+  FastCall* self = (FastCall *) _self;
+  free(self->ndims);
+  free(self->alignments);
+  free(self->alias_groups);
+  free(self->extent_lo);
+  free(self->extent_hi);
+  Py_XDECREF(self->fn);
+  Py_XDECREF(self->mode);
+  Py_XDECREF(self->input_cells);
+  Py_XDECREF(self->filters);
+  Py_XDECREF(self->exact_types);
+  Py_XDECREF(self->dtypes);
+  Py_XDECREF(self->broadcastable);
+  Py_XDECREF(self->may_share_memory);
+  Py_XDECREF(self->output_containers);
+  Py_XDECREF(self->gc_cells);
+  Py_XDECREF(self->update_containers);
+  Py_TYPE(self)->tp_free((PyObject*)self);
+}
+
+static PyObject *
+FastCall_new(PyTypeObject *type, PyObject *args, PyObject *kwds)
+{
+  FastCall *self = (FastCall *)type->tp_alloc(type, 0);
+  if (self != NULL)
+    {
+      self->fn = NULL;
+      self->mode = NULL;
+      self->n_inputs = 0;
+      self->n_cells = 0;
+      self->input_cells = NULL;
+      self->filters = NULL;
+      self->exact_types = NULL;
+      self->dtypes = NULL;
+      self->broadcastable = NULL;
+      self->ndims = NULL;
+      self->alignments = NULL;
+      self->alias_groups = NULL;
+      self->may_share_memory = NULL;
+      self->output_containers = NULL;
+      self->gc_cells = NULL;
+      self->update_containers = NULL;
+      self->n_returned = 0;
+      self->need_update_inputs = 1;
+      self->unpack_single = 0;
+      self->return_none = 0;
+      self->vm_failed = 0;
+      self->extent_lo = NULL;
+      self->extent_hi = NULL;
+    }
+  return (PyObject *)self;
+}
+
+static int
+FastCall_init(FastCall *self, PyObject *args, PyObject *kwds)
+{
+  static char *kwlist[] = {
+    (char*)"fn",
+    (char*)"mode",
+    (char*)"input_cells",
+    (char*)"filters",
+    (char*)"exact_types",
+    (char*)"dtypes",
+    (char*)"ndims",
+    (char*)"broadcastable",
+    (char*)"alignments",
+    (char*)"alias_groups",
+    (char*)"may_share_memory",
+    (char*)"output_containers",
+    (char*)"gc_cells",
+    (char*)"update_containers",
+    (char*)"n_returned",
+    (char*)"need_update_inputs",
+    (char*)"unpack_single",
+    (char*)"return_none",
+    NULL};
+  PyObject *fn = NULL, *mode = NULL, *input_cells = NULL, *filters = NULL,
+    *exact_types = NULL, *dtypes = NULL, *ndims = NULL,
+    *broadcastable = NULL, *alignments = NULL, *alias_groups = NULL,
+    *may_share_memory = NULL, *output_containers = NULL, *gc_cells = NULL,
+    *update_containers = NULL;
+  Py_ssize_t len;
+  if (! PyArg_ParseTupleAndKeywords(args, kwds, "OOO!O!O!O!O!O!O!O!O!O!O!O!niii",
+                                    kwlist,
+                                    &fn, &mode,
+                                    &PyList_Type, &input_cells,
+                                    &PyList_Type, &filters,
+                                    &PyList_Type, &exact_types,
+                                    &PyList_Type, &dtypes,
+                                    &PyList_Type, &ndims,
+                                    &PyList_Type, &broadcastable,
+                                    &PyList_Type, &alignments,
+                                    &PyList_Type, &alias_groups,
+                                    &PyList_Type, &may_share_memory,
+                                    &PyList_Type, &output_containers,
+                                    &PyList_Type, &gc_cells,
+                                    &PyList_Type, &update_containers,
+                                    &self->n_returned,
+                                    &self->need_update_inputs,
+                                    &self->unpack_single,
+                                    &self->return_none))
+    return -1;
+
+  self->n_inputs = PyList_Size(filters);
+  self->n_cells = PyList_Size(input_cells);
+  if (self->n_cells < self->n_inputs ||
+      PyList_Size(exact_types) != self->n_inputs ||
+      PyList_Size(dtypes) != self->n_inputs ||
+      PyList_Size(broadcastable) != self->n_inputs ||
+      PyList_Size(may_share_memory) != self->n_cells)
+    {
+      PyErr_SetString(PyExc_ValueError, "inconsistent number of inputs");
+      return -1;
+    }
+  if (unpack_list_of_ssize_t(ndims, &self->ndims, &len, "ndims"))
+    return -1;
+  if (len != self->n_inputs)
+    {
+      PyErr_SetString(PyExc_ValueError, "ndims has the wrong length");
+      return -1;
+    }
+  if (unpack_list_of_ssize_t(alignments, &self->alignments, &len,
+                             "alignments"))
+    return -1;
+  if (len != self->n_inputs)
+    {
+      PyErr_SetString(PyExc_ValueError, "alignments has the wrong length");
+      return -1;
+    }
+  if (unpack_list_of_ssize_t(alias_groups, &self->alias_groups, &len,
+                             "alias_groups"))
+    return -1;
+  if (len != self->n_cells)
+    {
+      PyErr_SetString(PyExc_ValueError, "alias_groups has the wrong length");
+      return -1;
+    }
+  self->extent_lo = (char**)calloc(self->n_cells + 1, sizeof(char*));
+  self->extent_hi = (char**)calloc(self->n_cells + 1, sizeof(char*));
+
+#define FASTCALL_SET(field) Py_INCREF(field); self->field = field;
+  FASTCALL_SET(fn);
+  FASTCALL_SET(mode);
+  FASTCALL_SET(input_cells);
+  FASTCALL_SET(filters);
+  FASTCALL_SET(exact_types);
+  FASTCALL_SET(dtypes);
+  FASTCALL_SET(broadcastable);
+  FASTCALL_SET(may_share_memory);
+  FASTCALL_SET(output_containers);
+  FASTCALL_SET(gc_cells);
+  FASTCALL_SET(update_containers);
+#undef FASTCALL_SET
+  return 0;
+}
+
+/**
+  Store in *lo and *hi the bounds of the memory used by the buffer of obj.
+  Return 0 on success, -1 if obj does not export a buffer (no exception is
+  left set).
+  If view_out is not NULL, the buffer is kept in it and must be released by
+  the caller.
+  */
+static int
+get_extent(PyObject * obj, char ** lo, char ** hi, Py_buffer * view_out)
+{
+  Py_buffer view;
+  if (PyObject_GetBuffer(obj, &view, PyBUF_STRIDES) < 0)
+    {
+      PyErr_Clear();
+      return -1;
+    }
+  char * low = (char *) view.buf;
+  char * high = (char *) view.buf;
+  int empty = 0;
+  for (int d = 0; d < view.ndim; ++d)
+    {
+      if (view.shape[d] == 0)
+        empty = 1;
+      else if (view.strides[d] > 0)
+        high += view.strides[d] * (view.shape[d] - 1);
+      else
+        low += view.strides[d] * (view.shape[d] - 1);
+    }
+  if (!empty)
+    high += view.itemsize;
+  *lo = low;
+  *hi = high;
+  if (view_out)
+    *view_out = view;
+  else
+    PyBuffer_Release(&view);
+  return 0;
+}
+
+/**
+  Return 1 if arg can be bound to positional input i without calling its
+  filter, that is if the filter would return it unchanged.
+  */
+static int
+FastCall_accept(FastCall * self, Py_ssize_t i, PyObject * arg)
+{
+  if ((PyObject *)Py_TYPE(arg) != PyList_GET_ITEM(self->exact_types, i))
+    return 0;
+  PyObject * dtype = PyObject_GetAttrString(arg, "dtype");
+  if (dtype == NULL)
+    {
+      PyErr_Clear();
+      return 0;
+    }
+  Py_DECREF(dtype);
+  if (dtype != PyList_GET_ITEM(self->dtypes, i))
+    return 0;
+  Py_buffer view;
+  if (get_extent(arg, &self->extent_lo[i], &self->extent_hi[i], &view))
+    return 0;
+  int ok = (view.ndim == self->ndims[i]);
+  Py_ssize_t align = self->alignments[i];
+  if (ok && align > 1)
+    {
+      ok = ((size_t)view.buf % align) == 0;
+      for (int d = 0; ok && d < view.ndim; ++d)
+        ok = (view.strides[d] % align) == 0;
+    }
+  PyObject * bcast = PyList_GET_ITEM(self->broadcastable, i);
+  for (Py_ssize_t j = 0; ok && j < PyList_Size(bcast); ++j)
+    {
+      Py_ssize_t d = PyNumber_AsSsize_t(PyList_GET_ITEM(bcast, j), NULL);
+      ok = (view.shape[d] == 1);
+    }
+  PyBuffer_Release(&view);
+  return ok;
+}
+
+/**
+  Copy the inputs that share memory with another input, as
+  Function.__call__ does.
+  Return 0 on success, -1 on error.
+  */
+static int
+FastCall_copy_aliased(FastCall * self, const char * known)
+{
+  for (Py_ssize_t j = 1; j < self->n_cells; ++j)
+    {
+      Py_ssize_t group = self->alias_groups[j];
+      if (group < 0)
+        continue;
+      PyObject * val_j = PyList_GET_ITEM(
+          PyList_GET_ITEM(self->input_cells, j), 0);
+      if (val_j == Py_None)
+        continue;
+      for (Py_ssize_t i = 0; i < j; ++i)
+        {
+          if (self->alias_groups[i] != group)
+            continue;
+          PyObject * val_i = PyList_GET_ITEM(
+              PyList_GET_ITEM(self->input_cells, i), 0);
+          if (val_i == Py_None)
+            continue;
+          int aliased;
+          if (known[i] && known[j])
+            {
+              aliased = (self->extent_lo[i] < self->extent_hi[j] &&
+                         self->extent_lo[j] < self->extent_hi[i]);
+            }
+          else
+            {
+              PyObject * r = PyObject_CallFunctionObjArgs(
+                  PyList_GET_ITEM(self->may_share_memory, j),
+                  val_i, val_j, NULL);
+              if (r == NULL)
+                return -1;
+              aliased = PyObject_IsTrue(r);
+              Py_DECREF(r);
+              if (aliased < 0)
+                return -1;
+            }
+          if (!aliased)
+            continue;
+          // Copy the argument, never the value of an implicit input.
+          Py_ssize_t dst = (j < self->n_inputs) ? j : i;
+          PyObject * cell = PyList_GET_ITEM(self->input_cells, dst);
+          PyObject * copy = PyObject_CallMethod(PyList_GET_ITEM(cell, 0),
+                                                (char*)"copy", NULL);
+          if (copy == NULL)
+            return -1;
+          PyList_SetItem(cell, 0, copy);
+          if (dst == j)
+            break;
+        }
+    }
+  return 0;
+}
+
+static int
+FastCall_add_time(PyObject * mode, const char * attr, double dt)
+{
+  PyObject * t = PyObject_GetAttrString(mode, attr);
+  if (t == NULL)
+    return -1;
+  PyObject * t_new = PyFloat_FromDouble(PyFloat_AsDouble(t) + dt);
+  Py_DECREF(t);
+  if (t_new == NULL)
+    return -1;
+  int err = PyObject_SetAttrString(mode, attr, t_new);
+  Py_DECREF(t_new);
+  return err;
+}
+
+/**
+  Run the function on the arguments in the tuple fn_args.
+  */
+static PyObject *
+FastCall_run(FastCall * self, PyObject * fn_args, int trust_input)
+{
+  self->vm_failed = 0;
+  if (PyTuple_GET_SIZE(fn_args) != self->n_inputs)
+    Py_RETURN_NOTIMPLEMENTED;
+  double t0 = pytime(NULL);
+
+  // Bind the arguments
+  char known_buf[64];
+  char * known = (self->n_cells < 64) ? known_buf :
+    (char*)malloc(self->n_cells);
+  int check_aliased = 0;
+  for (Py_ssize_t i = 0; i < self->n_inputs; ++i)
+    {
+      PyObject * arg = PyTuple_GET_ITEM(fn_args, i);
+      PyObject * cell = PyList_GET_ITEM(self->input_cells, i);
+      known[i] = 0;
+      if (trust_input || arg == Py_None)
+        {
+          Py_INCREF(arg);
+        }
+      else if (FastCall_accept(self, i, arg))
+        {
+          known[i] = 1;
+          Py_INCREF(arg);
+        }
+      else
+        {
+          arg = PyObject_CallFunctionObjArgs(
+              PyList_GET_ITEM(self->filters, i), arg, NULL);
+          if (arg == NULL)
+            {
+              // Let Function.__call__ raise the error with its message.
+              PyErr_Clear();
+              for (Py_ssize_t j = 0; j < i; ++j)
+                {
+                  Py_INCREF(Py_None);
+                  PyList_SetItem(PyList_GET_ITEM(self->input_cells, j), 0,
+                                 Py_None);
+                }
+              if (known != known_buf)
+                free(known);
+              Py_RETURN_NOTIMPLEMENTED;
+            }
+        }
+      PyList_SetItem(cell, 0, arg);
+      if (self->alias_groups[i] >= 0)
+        ++check_aliased;
+    }
+  for (Py_ssize_t i = self->n_inputs; i < self->n_cells; ++i)
+    {
+      known[i] = 0;
+      if (self->alias_groups[i] < 0)
+        continue;
+      ++check_aliased;
+    }
+  if (!trust_input && check_aliased > 1)
+    {
+      for (Py_ssize_t i = 0; i < self->n_cells; ++i)
+        {
+          if (known[i] || self->alias_groups[i] < 0)
+            continue;
+          PyObject * val = PyList_GET_ITEM(
+              PyList_GET_ITEM(self->input_cells, i), 0);
+          if (val != Py_None)
+            known[i] = !get_extent(val, &self->extent_lo[i],
+                                   &self->extent_hi[i], NULL);
+        }
+      if (FastCall_copy_aliased(self, known))
+        {
+          if (known != known_buf)
+            free(known);
+          return NULL;
+        }
+    }
+  if (known != known_buf)
+    free(known);
+
+  // Run the VM
+  double t0_fn = pytime(NULL);
+  PyObject * outputs = PyObject_CallObject(self->fn, NULL);
+  if (outputs == NULL)
+    {
+      self->vm_failed = 1;
+      return NULL;
+    }
+  double dt_fn = pytime(NULL) - t0_fn;
+  if (FastCall_add_time(self->mode, "fn_time", dt_fn))
+    {
+      Py_DECREF(outputs);
+      return NULL;
+    }
+
+  // Retrieve the values that were computed
+  Py_ssize_t n_outputs = PyList_Size(self->output_containers);
+  if (outputs == Py_None)
+    {
+      Py_DECREF(outputs);
+      outputs = PyList_New(n_outputs);
+      for (Py_ssize_t i = 0; outputs && i < n_outputs; ++i)
+        {
+          PyObject * data = PyObject_GetAttrString(
+              PyList_GET_ITEM(self->output_containers, i), "data");
+          if (data == NULL)
+            {
+              Py_CLEAR(outputs);
+              break;
+            }
+          PyList_SET_ITEM(outputs, i, data);
+        }
+      if (outputs == NULL)
+        return NULL;
+    }
+  if (!PyList_Check(outputs) || PyList_GET_SIZE(outputs) != n_outputs)
+    {
+      Py_DECREF(outputs);
+      PyErr_SetString(PyExc_AssertionError,
+                      "The VM returned the wrong number of outputs.");
+      return NULL;
+    }
+
+  // Remove internal references to the inputs and the outputs
+  for (Py_ssize_t i = 0; i < self->n_inputs; ++i)
+    {
+      Py_INCREF(Py_None);
+      PyList_SetItem(PyList_GET_ITEM(self->input_cells, i), 0, Py_None);
+    }
+  for (Py_ssize_t i = 0; i < PyList_GET_SIZE(self->gc_cells); ++i)
+    {
+      Py_INCREF(Py_None);
+      PyList_SetItem(PyList_GET_ITEM(self->gc_cells, i), 0, Py_None);
+    }
+
+  // Update the inputs that have an update function
+  if (self->need_update_inputs)
+    {
+      Py_ssize_t n_updates = PyList_GET_SIZE(self->update_containers);
+      for (Py_ssize_t i = 0; i < n_updates; ++i)
+        {
+          if (PyObject_SetAttrString(
+                  PyList_GET_ITEM(self->update_containers, i), "data",
+                  PyList_GET_ITEM(outputs, n_outputs - n_updates + i)))
+            {
+              Py_DECREF(outputs);
+              return NULL;
+            }
+        }
+    }
+  if (self->n_returned < n_outputs &&
+      PyList_SetSlice(outputs, self->n_returned, n_outputs, NULL))
+    {
+      Py_DECREF(outputs);
+      return NULL;
+    }
+
+  if (FastCall_add_time(self->mode, "call_time", pytime(NULL) - t0))
+    {
+      Py_DECREF(outputs);
+      return NULL;
+    }
+
+  if (self->return_none)
+    {
+      Py_DECREF(outputs);
+      Py_RETURN_NONE;
+    }
+  if (self->unpack_single && PyList_GET_SIZE(outputs) == 1)
+    {
+      PyObject * rval = PyList_GET_ITEM(outputs, 0);
+      Py_INCREF(rval);
+      Py_DECREF(outputs);
+      return rval;
+    }
+  return outputs;
+}
+
+static PyObject *
+FastCall_call(PyObject *_self, PyObject *args, PyObject *kwds)
+{
+  PyObject * fn_args;
+  int trust_input = 0;
+  if (! PyArg_ParseTuple(args, "O!|i", &PyTuple_Type, &fn_args, &trust_input))
+    return NULL;
+  return FastCall_run((FastCall*)_self, fn_args, trust_input);
+}
+
+/**
+  Run the function on each tuple of arguments of args_list, from index
+  start, and return the list of the results. Stop before the first tuple
+  for which the call returns NotImplemented.
+  */
+static PyObject *
+FastCall_map(PyObject *_self, PyObject *args)
+{
+  FastCall * self = (FastCall*)_self;
+  PyObject * args_list;
+  Py_ssize_t start = 0;
+  int trust_input = 0;
+  if (! PyArg_ParseTuple(args, "O!|ni", &PyList_Type, &args_list, &start,
+                         &trust_input))
+    return NULL;
+  PyObject * rval = PyList_New(0);
+  if (rval == NULL)
+    return NULL;
+  for (Py_ssize_t i = start; i < PyList_GET_SIZE(args_list); ++i)
+    {
+      PyObject * fn_args = PySequence_Tuple(PyList_GET_ITEM(args_list, i));
+      if (fn_args == NULL)
+        {
+          Py_DECREF(rval);
+          return NULL;
+        }
+      PyObject * r = FastCall_run(self, fn_args, trust_input);
+      Py_DECREF(fn_args);
+      if (r == NULL)
+        {
+          Py_DECREF(rval);
+          return NULL;
+        }
+      if (r == Py_NotImplemented)
+        {
+          Py_DECREF(r);
+          break;
+        }
+      int err = PyList_Append(rval, r);
+      Py_DECREF(r);
+      if (err)
+        {
+          Py_DECREF(rval);
+          return NULL;
+        }
+    }
+  return rval;
+}
+
+static PyMethodDef FastCall_methods[] = {
+  {"map", FastCall_map, METH_VARARGS,
+   "map(args_list, start=0, trust_input=0): call on each tuple of "
+   "arguments of args_list from start, until one is not handled."},
+  {NULL, NULL, 0, NULL}  /* Sentinel */
+};
+
+static PyMemberDef FastCall_members[] = {
+    {(char*)"vm_failed", T_INT, offsetof(FastCall, vm_failed), READONLY,
+     (char*)"1 if the last error was raised by the VM, 0 otherwise."},
+    {NULL} /* Sentinel */
+};
+
+static PyTypeObject lazylinker_ext_FastCallType = {
+#if defined(NPY_PY3K)
+    PyVarObject_HEAD_INIT(NULL, 0)
+#else
+    PyObject_HEAD_INIT(NULL)
+    0,                         /*ob_size*/
+#endif
+    "lazylinker_ext.FastCall", /*tp_name*/
+    sizeof(FastCall),          /*tp_basicsize*/
+    0,                         /*tp_itemsize*/
+    FastCall_dealloc,          /*tp_dealloc*/
+    0,                         /*tp_print*/
+    0,                         /*tp_getattr*/
+    0,                         /*tp_setattr*/
+    0,                         /*tp_compare*/
+    0,                         /*tp_repr*/
+    0,                         /*tp_as_number*/
+    0,                         /*tp_as_sequence*/
+    0,                         /*tp_as_mapping*/
+    0,                         /*tp_hash */
+    FastCall_call,             /*tp_call*/
+    0,                         /*tp_str*/
+    0,                         /*tp_getattro*/
+    0,                         /*tp_setattro*/
+    0,                         /*tp_as_buffer*/
+    Py_TPFLAGS_DEFAULT,        /*tp_flags*/
+    "Native implementation of Function.__call__", /* tp_doc */
+    0,                         /* tp_traverse */
+    0,                         /* tp_clear */
+    0,                         /* tp_richcompare */
+    0,                         /* tp_weaklistoffset */
+    0,                         /* tp_iter */
+    0,                         /* tp_iternext */
+    FastCall_methods,          /* tp_methods */
+    FastCall_members,          /* tp_members */
+    0,                         /* tp_getset */
+    0,                         /* tp_base */
+    0,                         /* tp_dict */
+    0,                         /* tp_descr_get */
+    0,                         /* tp_descr_set */
+    0,                         /* tp_dictoffset */
+    (initproc)FastCall_init,   /* tp_init */
+    0,                         /* tp_alloc */
+    FastCall_new,              /* tp_new */
+};
+
 static PyObject * get_version(PyObject *dummy, PyObject *args)
 {
-  PyObject *result = PyFloat_FromDouble(0.21);
+  PyObject *result = PyFloat_FromDouble(0.25);
   return result;
 }
 
@@ -1060,5 +1734,10 @@ initlazylinker_ext(void)
     Py_INCREF(&lazylinker_ext_CLazyLinkerType);
     PyModule_AddObject(m, "CLazyLinker", (PyObject *)&lazylinker_ext_CLazyLinkerType);
 
+    if (PyType_Ready(&lazylinker_ext_FastCallType) < 0)
+        return RETVAL;
+    Py_INCREF(&lazylinker_ext_FastCallType);
+    PyModule_AddObject(m, "FastCall", (PyObject *)&lazylinker_ext_FastCallType);
+
     return RETVAL;
 }
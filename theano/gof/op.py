@@ -13,6 +13,7 @@ import re
 import sys
 import traceback
 import warnings
+import weakref
 
 import theano
 from theano import config
@@ -296,6 +297,27 @@ class CLinkerOp(CLinkerObject):
         """
         return self.c_code_cache_version()
 
+    def c_code_gil_free(self, node):
+        """
+        Optional: return True if c_code can run without holding the GIL.
+
+        This is a promise that the code returned by `c_code` for `node`
+        neither calls the Python C API nor jumps to %(fail)s, so that the
+        Ops that embed it (like `Elemwise` for scalar ops) can release the
+        GIL around it and let other threads run meanwhile.
+
+        Parameters
+        ----------
+        node : Apply instance
+            The node for which we are compiling the current c_code.
+
+        Notes
+        -----
+            The default implementation returns False.
+
+        """
+        return False
+
     def c_code_cleanup(self, node, name, inputs, outputs, sub):
         """
         Optional: return C code to run after c_code, whether it failed or not.
@@ -599,7 +621,13 @@ class PureOp(object):
         return_list = kwargs.pop('return_list', False)
         node = self.make_node(*inputs, **kwargs)
 
-        if config.compute_test_value != 'off':
+        interned = False
+        if config.intern_apply_nodes:
+            canonical = intern_apply(node)
+            interned = canonical is not node
+            node = canonical
+
+        if config.compute_test_value != 'off' and not interned:
             run_perform = True
 
             # build test input-values
@@ -803,16 +831,13 @@ class Op(utils.object2, PureOp, CLinkerOp):
         else:
             return NotImplemented
 
-    def make_c_thunk(self, node, storage_map, compute_map, no_recycling):
+    def make_c_linker(self, node, no_recycling):
         """
-        Like make_thunk, but will only try to make a C thunk.
+        Return the CLinker that `make_c_thunk` uses to compile `node`.
 
-        """
-        logger = logging.getLogger('theano.gof.op.Op')
-
-        node_input_storage = [storage_map[r] for r in node.inputs]
-        node_output_storage = [storage_map[r] for r in node.outputs]
+        Raises NotImplementedError if C code should not be used for `node`.
 
+        """
         # float16 gets special treatment since running
         # unprepared C code will get bad results.
         if not getattr(self, '_f16_ok', False):
@@ -828,8 +853,20 @@ class Op(utils.object2, PureOp, CLinkerOp):
         e_no_recycling = [new_o
                           for (new_o, old_o) in zip(e.outputs, node.outputs)
                           if old_o in no_recycling]
-        cl = theano.gof.cc.CLinker().accept(e,
-                                            no_recycling=e_no_recycling)
+        return theano.gof.cc.CLinker().accept(e,
+                                              no_recycling=e_no_recycling)
+
+    def make_c_thunk(self, node, storage_map, compute_map, no_recycling):
+        """
+        Like make_thunk, but will only try to make a C thunk.
+
+        """
+        logger = logging.getLogger('theano.gof.op.Op')
+
+        node_input_storage = [storage_map[r] for r in node.inputs]
+        node_output_storage = [storage_map[r] for r in node.outputs]
+
+        cl = self.make_c_linker(node, no_recycling)
 
         logger.debug('Trying CLinker.make_thunk')
         outputs = cl.make_thunk(input_storage=node_input_storage,
@@ -923,6 +960,86 @@ class Op(utils.object2, PureOp, CLinkerOp):
         return self.make_py_thunk(node, storage_map, compute_map, no_recycling)
 
 
+# Apply nodes built by `PureOp.__call__` when config.intern_apply_nodes
+# is True. Values are weak, so nodes no longer used by any graph are
+# dropped from the table.
+_interned_apply_nodes = weakref.WeakValueDictionary()
+
+
+def _intern_key(node):
+    """
+    Return the key of `node` in the interning table, or None.
+
+    Inputs are identified by `id`, except constants, which are
+    identified by their signature. An entry keeps its node alive, and
+    so its inputs, so an `id` in a key cannot be reused by another
+    variable while the entry exists.
+
+    """
+    key = [node.op]
+    for i in node.inputs:
+        if isinstance(i, graph.Constant):
+            sig = i.merge_signature()
+            try:
+                hash(sig)
+            except TypeError:
+                key.append(id(i))
+            else:
+                key.append(('constant', sig))
+        else:
+            key.append(id(i))
+    key = tuple(key)
+    try:
+        hash(key)
+    except TypeError:
+        return None
+    return key
+
+
+def intern_apply(node):
+    """
+    Return an existing Apply equivalent to `node`, or register `node`.
+
+    Two nodes are equivalent when their ops are equal and they have the
+    same inputs, constants being compared by value. This is what
+    `MergeOptimizer` merges, but done while the graph is built, so that
+    the duplicated nodes are never created in the user graph.
+
+    Nodes whose op has a `destroy_map`, and nodes whose inputs belong to
+    a FunctionGraph, as built by the optimizations, are neither shared
+    nor registered.
+
+    Parameters
+    ----------
+    node : Apply
+        The node just returned by `make_node`.
+
+    Returns
+    -------
+    Apply
+        The node to use in place of `node`, which is `node` itself if no
+        equivalent node was registered.
+
+    """
+    if getattr(node.op, 'destroy_map', None):
+        return node
+    for i in node.inputs:
+        if getattr(i, 'fgraph', None) is not None:
+            return node
+    key = _intern_key(node)
+    if key is None:
+        return node
+    existing = _interned_apply_nodes.get(key)
+    if (existing is not None and
+            getattr(existing, 'fgraph', None) is None and
+            len(existing.outputs) == len(node.outputs) and
+            all(a.type == b.type
+                for a, b in zip(existing.outputs, node.outputs))):
+        return existing
+    _interned_apply_nodes[key] = node
+    return node
+
+
 def get_test_value(v):
     """
     Extract test value from `v`. Raises AttributeError if there is none.
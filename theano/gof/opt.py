@@ -183,7 +183,14 @@ class SeqOptimizer(Optimizer, list):
     Takes a list of L{Optimizer} instances and applies them
     sequentially.
 
+    Once the time budget of the optimization (config.optdb.time_budget)
+    or of one of its optimizers (config.optdb.stage_time_budget) is spent,
+    the optimizers are stopped or skipped, except the ones whose name is
+    in `essential`.
+
     """
+    essential = ()
+
     @staticmethod
     def warn(exc, self, optimizer):
         """
@@ -224,23 +231,68 @@ class SeqOptimizer(Optimizer, list):
         callback_before = fgraph.execute_callbacks_time
         nb_node_before = len(fgraph.apply_nodes)
         sub_profs = []
-        for optimizer in self:
-            try:
+        # The optimizers skipped or stopped by the time budget, as
+        # (name, reason) pairs.
+        budget_skipped = []
+
+        # The outermost SeqOptimizer sets the deadline of the whole
+        # optimization, that the nested optimizers read from the fgraph.
+        outermost = not hasattr(fgraph, 'optimizer_deadline')
+        if outermost:
+            fgraph.optimizer_deadline = None
+            if config.optdb.time_budget > 0:
+                fgraph.optimizer_deadline = (time.time() +
+                                             config.optdb.time_budget)
+        deadline = fgraph.optimizer_deadline
+        stage_budget = config.optdb.stage_time_budget
+        try:
+            for optimizer in self:
+                name = (getattr(optimizer, 'name', None) or
+                        getattr(optimizer, '__name__', ''))
+                essential = name in self.essential
                 t0 = time.time()
-                sub_prof = optimizer.optimize(fgraph)
-                l.append(float(time.time() - t0))
-                sub_profs.append(sub_prof)
-                if fgraph.profile:
-                    sub_validate_time.append(fgraph.profile.validate_time)
-            except AssertionError:
-                # do not catch Assertion failures
-                raise
-            except Exception as e:
-                if self.failure_callback:
-                    self.failure_callback(e, self, optimizer)
-                    continue
-                else:
+                stage_deadline = None
+                if not essential:
+                    if deadline is not None and t0 > deadline:
+                        budget_skipped.append((name, 'skipped'))
+                        l.append(0.)
+                        sub_profs.append(None)
+                        if fgraph.profile:
+                            sub_validate_time.append(
+                                fgraph.profile.validate_time)
+                        continue
+                    stage_deadline = deadline
+                    if stage_budget > 0:
+                        stage_deadline = min(deadline or numpy.inf,
+                                             t0 + stage_budget)
+                fgraph.optimizer_deadline = stage_deadline
+                try:
+                    sub_prof = optimizer.optimize(fgraph)
+                    l.append(float(time.time() - t0))
+                    sub_profs.append(sub_prof)
+                    if fgraph.profile:
+                        sub_validate_time.append(fgraph.profile.validate_time)
+                except AssertionError:
+                    # do not catch Assertion failures
                     raise
+                except Exception as e:
+                    if self.failure_callback:
+                        self.failure_callback(e, self, optimizer)
+                        continue
+                    else:
+                        raise
+                finally:
+                    fgraph.optimizer_deadline = deadline
+                if (stage_deadline is not None and
+                        time.time() > stage_deadline):
+                    budget_skipped.append((name, 'stopped'))
+        finally:
+            if outermost:
+                del fgraph.optimizer_deadline
+        if budget_skipped:
+            _logger.info('%s: optimizers skipped or stopped by the time '
+                         'budget: %s', getattr(self, 'name', None),
+                         budget_skipped)
 
         if fgraph.profile:
             validate_time = fgraph.profile.validate_time - validate_before
@@ -248,7 +300,8 @@ class SeqOptimizer(Optimizer, list):
             validate_time = None
         callback_time = fgraph.execute_callbacks_time - callback_before
         return (self, l, validate_time, callback_time, nb_node_before,
-                len(fgraph.apply_nodes), sub_profs, sub_validate_time)
+                len(fgraph.apply_nodes), sub_profs, sub_validate_time,
+                budget_skipped)
 
     def __str__(self):
         return "SeqOpt(%s)" % list.__str__(self)
@@ -266,10 +319,25 @@ class SeqOptimizer(Optimizer, list):
             for opt in self:
                 opt.print_summary(stream, level=(level + 2), depth=depth)
 
+    @staticmethod
+    def cut_by_time_budget(prof):
+        """
+        Return True if the time budget skipped or stopped an optimizer
+        in the optimization that returned `prof`, or in a nested
+        SeqOptimizer.
+
+        """
+        if (not isinstance(prof, tuple) or len(prof) != 9 or
+                not isinstance(prof[0], SeqOptimizer)):
+            return False
+        if prof[8]:
+            return True
+        return any(SeqOptimizer.cut_by_time_budget(p) for p in prof[6])
+
     @staticmethod
     def print_profile(stream, prof, level=0):
         (opts, prof, validate_time, callback_time, nb_node_before,
-         nb_node_after, sub_profs, sub_validate_time) = prof
+         nb_node_after, sub_profs, sub_validate_time, budget_skipped) = prof
         blanc = ('    ' * level)
 
         print(blanc, "SeqOptimizer", end=' ', file=stream)
@@ -282,6 +350,11 @@ class SeqOptimizer(Optimizer, list):
                    sum(prof), nb_node_before, nb_node_after)), file=stream)
         print(blanc, "  %.3fs for callback" % (callback_time), file=stream)
         print(blanc, "      %.3fs for fgraph.validate()" % (validate_time), file=stream)
+        if budget_skipped:
+            print(blanc, "  %d optimizers skipped or stopped by the time"
+                  " budget:" % len(budget_skipped), file=stream)
+            for name, reason in budget_skipped:
+                print(blanc, "    %s (%s)" % (name, reason), file=stream)
         if level == 0:
             print(blanc, "  time      - (name, class, index) - validate time", file=stream)
         ll = []
@@ -387,7 +460,7 @@ class SeqOptimizer(Optimizer, list):
         assert len(new_t) == len(new_opt) == len(new_sub_profile)
         return (new_opt, new_t, prof1[2] + prof2[2],
                 prof1[3] + prof2[3],
-                -1, -1, new_sub_profile, [])
+                -1, -1, new_sub_profile, [], prof1[8] + prof2[8])
 
 
 class _metadict:
@@ -2032,6 +2105,14 @@ class EquilibriumOptimizer(NavigatorOptimizer):
         The MergeOptimizer is one example of optimization that respect this.
         They are applied after all global optimizer, then when one local optimizer is applied, then after all final optimizer.
 
+    Notes
+    -----
+    The local optimizers are applied from a worklist. The whole graph is
+    only traversed in the first iteration. The next iterations only visit
+    the nodes that were imported, whose inputs changed or that are next to
+    a node that changed, and the local optimizers that failed on a node
+    are not tried again until the node is visited for such a change.
+
     """
 
     def __init__(self,
@@ -2102,6 +2183,9 @@ class EquilibriumOptimizer(NavigatorOptimizer):
         changed = True
         max_use_abort = False
         opt_name = None
+        # Set by SeqOptimizer when there is an optimizer time budget.
+        deadline = getattr(fgraph, 'optimizer_deadline', None)
+        out_of_time = False
         global_process_count = {}
         start_nb_nodes = len(fgraph.apply_nodes)
         max_nb_nodes = len(fgraph.apply_nodes)
@@ -2125,6 +2209,69 @@ class EquilibriumOptimizer(NavigatorOptimizer):
             time_opts.setdefault(opt, 0)
             node_created.setdefault(opt, 0)
 
+        # The worklist of the nodes to visit with the local optimizers.
+        # A node is queued when it is imported, when its inputs change, or
+        # when the nodes it reads from or feeds into change, and the local
+        # optimizers that failed on a node are not tried again until it
+        # is queued again.
+        worklist = deque()
+        queued = set()
+        failed = {}  # node -> set of local optimizers that failed on it
+        deferred = []
+        in_local_pass = [False]
+        current_node = [None]
+        seeded = False
+
+        def push(node):
+            failed.pop(node, None)
+            if node not in queued:
+                queued.add(node)
+                worklist.append(node)
+
+        def touch(node):
+            if node is current_node[0] or (in_local_pass[0] and
+                                           node not in queued):
+                deferred.append(node)
+            else:
+                push(node)
+
+        def importer(node):
+            if in_local_pass[0] and self.ignore_newtrees:
+                deferred.append(node)
+            elif node is not current_node[0]:
+                push(node)
+            for r in node.inputs:
+                if r.owner is not None:
+                    touch(r.owner)
+
+        def pruner(node):
+            queued.discard(node)
+            failed.pop(node, None)
+            # The inputs of `node` lose a client, which can enable the
+            # local optimizers that need a variable to have a single
+            # client, on its owner and on its remaining clients.
+            for r in node.inputs:
+                if r.owner is not None and r.owner is not node:
+                    touch(r.owner)
+                for client, _ in fgraph.clients(r):
+                    if client != 'output' and client is not node:
+                        touch(client)
+
+        def chin(node, i, r, new_r, reason):
+            for v in (r, new_r):
+                if v.owner is not None and v.owner in fgraph.apply_nodes:
+                    touch(v.owner)
+            if node == 'output':
+                return
+            touch(node)
+            for out in node.outputs:
+                for client, _ in fgraph.clients(out):
+                    if client != 'output':
+                        touch(client)
+
+        updater = Updater(importer, pruner, chin)
+        fgraph.attach_feature(updater)
+
         def apply_cleanup(profs_dict):
             changed = False
             for copt in self.cleanup_optimizers:
@@ -2142,7 +2289,7 @@ class EquilibriumOptimizer(NavigatorOptimizer):
                     node_created[copt] += change_tracker.nb_imported - nb
             return changed
 
-        while changed and not max_use_abort:
+        while changed and not max_use_abort and not out_of_time:
             process_count = {}
             t0 = time.time()
             changed = False
@@ -2179,38 +2326,41 @@ class EquilibriumOptimizer(NavigatorOptimizer):
 
             # apply local optimizer
             topo_t0 = time.time()
-            q = deque(graph.io_toposort(fgraph.inputs, start_from))
+            if not seeded:
+                for node in graph.io_toposort(fgraph.inputs, start_from):
+                    push(node)
+                seeded = True
             io_toposort_timing.append(time.time() - topo_t0)
 
-            nb_nodes.append(len(q))
-            max_nb_nodes = max(max_nb_nodes, len(q))
+            nb_nodes.append(len(worklist))
+            max_nb_nodes = max(max_nb_nodes, len(fgraph.apply_nodes))
             max_use = max_nb_nodes * self.max_use_ratio
 
-            def importer(node):
-                if node is not current_node:
-                    q.append(node)
-
-            def pruner(node):
-                if node is not current_node:
-                    try:
-                        q.remove(node)
-                    except ValueError:
-                        pass
-
-            u = self.attach_updater(fgraph, importer, pruner)
+            in_local_pass[0] = True
             try:
-                while q:
-                    node = q.pop()
-                    current_node = node
+                while worklist:
+                    if deadline is not None and time.time() > deadline:
+                        out_of_time = True
+                        break
+                    node = worklist.pop()
+                    if node not in queued:
+                        # pruned since it was queued
+                        continue
+                    queued.remove(node)
+                    current_node[0] = node
+                    node_failed = failed.setdefault(node, set())
 
                     for lopt in (self.local_optimizers_all +
                                  self.local_optimizers_map.get(type(node.op), []) +
                                  self.local_optimizers_map.get(node.op, [])):
+                        if lopt in node_failed:
+                            continue
                         nb = change_tracker.nb_imported
                         t_opt = time.time()
                         lopt_change = self.process_node(fgraph, node, lopt)
                         time_opts[lopt] += time.time() - t_opt
                         if not lopt_change:
+                            node_failed.add(lopt)
                             continue
                         process_count.setdefault(lopt, 0)
                         process_count[lopt] += 1
@@ -2226,12 +2376,20 @@ class EquilibriumOptimizer(NavigatorOptimizer):
                             # go to next node
                             break
             finally:
-                self.detach_updater(fgraph, u)
+                in_local_pass[0] = False
+                current_node[0] = None
+            # The nodes changed during the pass are visited by the next one.
+            for node in deferred:
+                if node in fgraph.apply_nodes:
+                    push(node)
+            del deferred[:]
 
             # Apply final optimizers
             sub_profs = []
             t_before_final_opt = time.time()
             for gopt in self.final_optimizers:
+                if out_of_time:
+                    break
                 change_tracker.reset()
                 nb = change_tracker.nb_imported
                 t_opt = time.time()
@@ -2273,6 +2431,7 @@ class EquilibriumOptimizer(NavigatorOptimizer):
                           ". You can safely raise the current threshold of " +
                           "%f with the theano flag 'optdb.max_use_ratio'." %
                           config.optdb.max_use_ratio)
+        fgraph.remove_feature(updater)
         fgraph.remove_feature(change_tracker)
         return (self, loop_timing, loop_process_count,
                 (start_nb_nodes, end_nb_nodes, max_nb_nodes),
@@ -20,6 +20,17 @@ AddConfigVar('optdb.max_use_ratio',
              'A ratio that prevent infinite loop in EquilibriumOptimizer.',
              FloatParam(5),
              in_c_key=False)
+AddConfigVar('optdb.time_budget',
+             'If positive, the time in seconds after which the optimization'
+             ' of a graph only runs the essential optimizations (numerical'
+             ' stabilization, merge and inplace).',
+             FloatParam(0, lambda x: x >= 0),
+             in_c_key=False)
+AddConfigVar('optdb.stage_time_budget',
+             'If positive, the time in seconds after which each stage of'
+             ' the optimization that is not essential is stopped.',
+             FloatParam(0, lambda x: x >= 0),
+             in_c_key=False)
 
 
 class DB(object):
@@ -316,6 +327,10 @@ class SequenceDB(DB):
 
     seq_opt = opt.SeqOptimizer
 
+    # Names and tags of the optimizations that still run once the
+    # optimizer time budget is spent.
+    essential_tags = ('stabilize', 'merge', 'inplace')
+
     def __init__(self, failure_callback=opt.SeqOptimizer.warn):
         super(SequenceDB, self).__init__()
         self.__position__ = {}
@@ -370,6 +385,10 @@ class SequenceDB(DB):
         if self.failure_callback:
             kwargs["failure_callback"] = self.failure_callback
         ret = self.seq_opt(opts, **kwargs)
+        essential = set()
+        for tag in self.essential_tags:
+            essential.update(o.name for o in self.__db__.get(tag, ()))
+        ret.essential = set(o.name for o in opts if o.name in essential)
         if hasattr(tags[0], 'name'):
             ret.name = tags[0].name
         return ret
@@ -6,7 +6,7 @@ import numpy
 
 import theano
 from theano.gof.link import PerformLinker
-from theano.gof.cc import CLinker, DualLinker, OpWiseCLinker
+from theano.gof.cc import BatchCLinker, CLinker, DualLinker, OpWiseCLinker
 from theano.gof.type import Type
 from theano.gof.graph import Variable, Apply, Constant
 from theano.gof.op import Op
@@ -245,6 +245,16 @@ def test_clinker_dups_inner():
     assert fn(1.0, 2.0, 3.0) == 8.0
 
 
+def test_batchclinker_accept():
+    # A BatchCLinker is built from CLinkers that accepted their graph.
+    x, y, z = inputs()
+    try:
+        BatchCLinker([], []).accept(Env([x, y], [add(x, y)]))
+        assert False
+    except TypeError:
+        pass
+
+
 ######################
 # Test OpWiseCLinker #
 ######################
@@ -4,10 +4,22 @@ But this one tests a current behavior that isn't good: the c_code isn't
 deterministic based on the input type and the op.
 
 """
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
 import numpy
+from nose.plugins.skip import SkipTest
 
 import theano
-from theano.gof.cmodule import GCC_compiler
+from six.moves import cPickle as pickle
+from theano.compat import decode
+from theano.gof import compilelock
+from theano.gof import cmodule
+from theano.gof.cmodule import (BaseCacheDir, GCC_compiler, KeyData,
+                                ModuleIndex)
 
 
 class MyOp(theano.compile.ops.DeepCopyOp):
@@ -67,3 +79,197 @@ def test_flag_detection():
     # but was not detected because that path is not usually taken,
     # so we test it here directly.
     GCC_compiler.try_flags(["-lblas"])
+
+
+def test_module_lock_ctx():
+    # The module lock is reentrant, and only released by the outermost
+    # context.
+    module_hash = 'm0123456789abcdef0123456789abcdef'
+    lock_dir = compilelock.module_lock_dir(module_hash)
+    with compilelock.module_lock_ctx(module_hash):
+        assert os.path.isdir(lock_dir)
+        with compilelock.module_lock_ctx(module_hash):
+            assert os.path.isdir(lock_dir)
+        assert os.path.isdir(lock_dir)
+    assert not os.path.isdir(lock_dir)
+
+
+def test_module_index():
+    dirname = tempfile.mkdtemp()
+    try:
+        filename = os.path.join(dirname, 'module_index')
+        index = ModuleIndex(filename)
+        index.update()
+        assert index.dirs == {}
+        index.add('m1', 'tmp1')
+        index.add('m2', 'tmp2')
+        index.remove('m1')
+        # The lines appended by this process are not read again.
+        index.update()
+        assert index.n_lines == 3
+
+        # Another process only reads the new lines.
+        other = ModuleIndex(filename)
+        other.update()
+        assert other.dirs == {'m2': 'tmp2'}
+        index.add('m3', 'tmp3')
+        with open(filename, 'a') as f:
+            f.write('+ m4 tm')
+        other.update()
+        assert other.dirs == {'m2': 'tmp2', 'm3': 'tmp3'}
+        with open(filename, 'a') as f:
+            f.write('p4\n')
+        other.update()
+        assert other.get('m4') == 'tmp4'
+
+        # Compaction keeps the entries whose directory exists.
+        os.mkdir(os.path.join(dirname, 'tmp3'))
+        index.compact()
+        assert index.dirs == {'m3': 'tmp3'}
+        assert index.n_lines == 1
+        other.update()
+        assert other.dirs == {'m3': 'tmp3'}
+        # The index lock is only held during the writes.
+        assert not os.path.exists(index.lock_dir)
+    finally:
+        shutil.rmtree(dirname)
+
+
+def test_base_cache_dir():
+    dirname = tempfile.mkdtemp()
+    try:
+        for subdir, module_hash in [('tmp1', 'm1'), ('tmp2', 'm2')]:
+            os.mkdir(os.path.join(dirname, subdir))
+            key_pkl = os.path.join(dirname, subdir, 'key.pkl')
+            KeyData(keys=set(), module_hash=module_hash, key_pkl=key_pkl,
+                    entry=os.path.join(dirname, subdir, 'm.so')).save_pkl()
+            # The file is written under a temporary name and renamed.
+            assert os.listdir(os.path.join(dirname, subdir)) == ['key.pkl']
+        base = BaseCacheDir(dirname)
+        assert base.get('m2') == 'tmp2'
+        assert base.get('m1') == 'tmp1'
+        assert base.get('m3') is None
+
+        # The index of the directory is used when there is one.
+        ModuleIndex(os.path.join(dirname, 'module_index')).add('m3', 'tmp3')
+        base = BaseCacheDir(dirname)
+        assert base.get('m3') == 'tmp3'
+        assert base.get('m1') is None
+    finally:
+        shutil.rmtree(dirname)
+
+
+@theano.configparser.change_flags(**{'cmodule.lazy_load': True})
+def test_on_atexit_lazy():
+    # In lazy mode, exiting only deletes the unversioned modules of this
+    # process, without listing the cache nor taking the compile lock.
+    dirname = tempfile.mkdtemp()
+    lock_ctx = compilelock.lock_ctx
+    try:
+        cache = cmodule.ModuleCache(dirname)
+        own = os.path.join(dirname, 'tmpown')
+        other = os.path.join(dirname, 'tmpother')
+        os.mkdir(own)
+        os.mkdir(other)
+        entry = os.path.join(own, 'm.so')
+        key = ((), 'rest')
+        cache.module_hash_to_key_data['h'] = KeyData(
+            keys=set([key]), module_hash='h',
+            key_pkl=os.path.join(own, 'key.pkl'), entry=entry)
+        cache.entry_from_key[key] = entry
+        cache.module_from_name[entry] = None
+
+        def no_lock(*args, **kwargs):
+            assert False
+        compilelock.lock_ctx = no_lock
+        cache._on_atexit()
+        assert not os.path.exists(own)
+        assert os.path.exists(other)
+        assert not cache.module_hash_to_key_data
+    finally:
+        compilelock.lock_ctx = lock_ctx
+        shutil.rmtree(dirname)
+
+
+def test_precompiled_keys_not_recorded_as_hits():
+    # The first lookup of a module compiled by module_from_keys, which
+    # recorded it as a miss, is not recorded as a hit.
+    class Recorder(object):
+        def __init__(self):
+            self.records = []
+
+        def record_module(self, op_name, hit, src_size, compile_time):
+            self.records.append(hit)
+
+    dirname = tempfile.mkdtemp()
+    recorder = Recorder()
+    cmodule.compile_profilers.append(recorder)
+    try:
+        cache = cmodule.ModuleCache(dirname, do_refresh=False)
+        key = ((1,), 'rest')
+        entry = os.path.join(dirname, 'tmp1', 'm.so')
+        module = object()
+        cache.entry_from_key[key] = entry
+        cache.module_from_name[entry] = module
+        cache._precompiled_keys.add(key)
+        lnk = object()
+        assert cache.module_from_key(key, lnk) is module
+        assert recorder.records == []
+        assert cache.module_from_key(key, lnk) is module
+        assert recorder.records == [True]
+    finally:
+        cmodule.compile_profilers.remove(recorder)
+        shutil.rmtree(dirname)
+
+
+def test_warm_cache():
+    # theano-warm-cache compiles the modules of a pickled function in the
+    # compiledir, and finds them in the cache the second time.
+    if not theano.config.cxx:
+        raise SkipTest("G++ not available, so we need to skip this test.")
+    script = os.path.join(os.path.dirname(theano.__file__), os.pardir,
+                          'bin', 'theano-warm-cache')
+    if not os.path.exists(script):
+        raise SkipTest("theano-warm-cache is not available.")
+    dirname = tempfile.mkdtemp()
+    try:
+        x = theano.tensor.dvector('x')
+        s = theano.shared(numpy.ones(3), 's')
+        y = theano.tensor.tanh(x * s) + 2
+        pkl = os.path.join(dirname, 'f.pkl')
+        with open(pkl, 'wb') as f:
+            pickle.dump([theano.function([x], y), y], f, -1)
+        env = dict(os.environ)
+        env['THEANO_FLAGS'] = ','.join(
+            [flags for flags in [env.get('THEANO_FLAGS')] if flags] +
+            ['base_compiledir=%s' % os.path.join(dirname, 'compiledir')])
+
+        def warm():
+            p = subprocess.Popen([sys.executable, script, '-j', '2', pkl],
+                                 stdout=subprocess.PIPE,
+                                 stderr=subprocess.PIPE, env=env)
+            out, err = p.communicate()
+            assert p.returncode == 0, err
+            return dict(line.split(': ', 1)
+                        for line in decode(out).splitlines()
+                        if ': ' in line)
+
+        report = warm()
+        assert report['Functions'] == '2'
+        assert int(report['Modules built']) > 0
+        report = warm()
+        assert report['Modules built'] == '0'
+        assert int(report['Modules found in the cache']) > 0
+    finally:
+        shutil.rmtree(dirname)
+
+
+def test_precompiled_header():
+    if 'g++' not in theano.config.cxx:
+        raise SkipTest("G++ not available, so we need to skip this test.")
+    flags = GCC_compiler.compile_args() + [
+        '-I%s' % idir for idir in cmodule.std_include_dirs()]
+    header = cmodule.get_precompiled_header(flags)
+    assert header is not None
+    assert os.path.exists(header + '.gch')
+    assert cmodule.get_precompiled_header(flags) == header
@@ -1,7 +1,7 @@
 from __future__ import print_function
 
 from six.moves import xrange
-from theano.gof.type import Type
+from theano.gof.type import Type, Generic
 from theano.gof import graph
 from theano.gof.graph import Variable, Apply
 from theano.gof.op import Op
@@ -234,6 +234,58 @@ def test_destroyers_loop():
     consistent(g)
 
 
+def test_replace_all_validate_batch():
+    x, y, z = inputs()
+    e1 = add(x, y)
+    e2 = add(y, x)
+    e3 = add(z, y)
+    g = Env([x, y, z], [e1, e2, e3])
+    candidates = [[(e1, add_in_place(x, y))],
+                  [(e2, add_in_place(y, x))],
+                  [(e3, add_in_place(z, y))]]
+    kept = g.replace_all_validate_batch(candidates)
+    # The second candidate can't coexist with the first one.
+    assert kept == [candidates[0], candidates[2]]
+    assert [o.owner.op for o in g.outputs] == [add_in_place, add,
+                                               add_in_place]
+    consistent(g)
+
+    # The errors that are not an invalid candidate are raised, and the
+    # graph is left unchanged.
+    x, y, z = inputs()
+    e1 = add(x, y)
+    e2 = add(z, y)
+    g = Env([x, y, z], [e1, e2])
+    candidates = [[(e1, add_in_place(x, y))],
+                  [(e2, Variable(Generic(), None, None))]]
+    try:
+        g.replace_all_validate_batch(candidates)
+        assert False
+    except TypeError:
+        pass
+    assert [o.owner.op for o in g.outputs] == [add, add]
+
+
+def test_incremental_cycle_check():
+    # After a validate, only the nodes after the new dependencies are
+    # checked for cycles.
+    x, y, z = inputs()
+    e = x
+    for i in range(10):
+        e = sigmoid(e)
+    aip = add_in_place(x, y)
+    g = Env([x, y, z], [dot(aip, e)])
+    assert g.destroy_handler.validated_orderings is not None
+    consistent(g)
+    # dot now reads a view of x, which it must do before it is
+    # destroyed by its other input.
+    g.replace(e, transpose_view(x))
+    inconsistent(g)
+    g.replace(aip, add(x, y))
+    consistent(g)
+    assert not g.destroy_handler.new_edges
+
+
 ########
 # Misc #
 ########
@@ -1,15 +1,12 @@
-import os
 import numpy
 import theano
 import theano.tensor as T
+from theano.compile.function_module import optimized_graph_cache
 
 floatX = 'float32'
 
 
 def test_graph_opt_caching():
-    opt_db_file = theano.config.compiledir + '/optimized_graphs.pkl'
-    os.system('rm %s' % opt_db_file)
-
     mode = theano.config.mode
     if mode in ["DEBUG_MODE", "DebugMode"]:
         mode = "FAST_RUN"
@@ -23,18 +20,106 @@ def test_graph_opt_caching():
         e = T.sum(T.sum(T.sum(a ** 2 + b) + c) + d)
         f1 = theano.function([a, b], e, mode=mode)
 
+        hits = optimized_graph_cache.hits
         m = T.fmatrix('x1')
         n = T.fmatrix('x2')
-        p = theano.shared(numpy.ones((10, 10), dtype=floatX))
+        p = theano.shared(2 * numpy.ones((10, 10), dtype=floatX))
         q = theano.shared(numpy.ones((10, 10), dtype=floatX))
         j = T.sum(T.sum(T.sum(m ** 2 + n) + p) + q)
         f2 = theano.function([m, n], j, mode=mode)
+        assert optimized_graph_cache.hits == hits + 1
 
         in1 = numpy.ones((10, 10), dtype=floatX)
         in2 = numpy.ones((10, 10), dtype=floatX)
-        assert f1(in1, in2) == f2(in1, in2)
+        assert f1(in1, in2) == 2010100
+        # f2 uses its own shared variables.
+        assert f2(in1, in2) == 2020100
+        p.set_value(numpy.zeros((10, 10), dtype=floatX))
+        assert f2(in1, in2) == 2000100
+        assert f1(in1, in2) == 2010100
+
+        # A different graph is not taken from the cache.
+        f3 = theano.function([m, n], T.sum(m * n), mode=mode)
+        assert optimized_graph_cache.hits == hits + 1
+        assert f3(in1, 2 * in2) == 200
     finally:
         theano.config.cache_optimizations = default
 
+
+def test_graph_opt_caching_time_budget():
+    # A graph cut short by the optimizer time budget is not reused by a
+    # compilation without a budget.
+    mode = theano.config.mode
+    if mode in ["DEBUG_MODE", "DebugMode"]:
+        mode = "FAST_RUN"
+
+    def compile_graph():
+        a = T.fvector('a')
+        b = T.fvector('b')
+        return theano.function([a, b], T.exp(a * 3 + b) * 7, mode=mode)
+
+    @theano.configparser.change_flags(**{'cache_optimizations': True,
+                                         'optdb.time_budget': 1e-9})
+    def compile_with_budget():
+        return compile_graph()
+
+    @theano.configparser.change_flags(cache_optimizations=True)
+    def compile_without_budget():
+        return compile_graph()
+
+    hits = optimized_graph_cache.hits
+    f1 = compile_with_budget()
+    f2 = compile_without_budget()
+    assert optimized_graph_cache.hits == hits
+    # The fully optimized graph is cached.
+    f3 = compile_without_budget()
+    assert optimized_graph_cache.hits == hits + 1
+    assert (len(f3.maker.fgraph.apply_nodes) ==
+            len(f2.maker.fgraph.apply_nodes))
+
+    in1 = numpy.ones(3, dtype=floatX)
+    for f in (f1, f2, f3):
+        assert numpy.allclose(f(in1, in1), numpy.exp(4) * 7)
+
+
+def test_graph_opt_caching_config():
+    # The options that change the optimized graph, even those not in the
+    # key of the C code, are in the key of the cache.
+    mode = theano.config.mode
+    if mode in ["DEBUG_MODE", "DebugMode"]:
+        mode = "FAST_RUN"
+
+    def compile_graph():
+        a = T.fvector('a')
+        b = T.fvector('b')
+        return theano.function([a, b], T.exp(a * 2 - b) * 5, mode=mode)
+
+    @theano.configparser.change_flags(**{
+        'cache_optimizations': True,
+        'tensor.local_elemwise_fusion': False})
+    def compile_without_fusion():
+        return compile_graph()
+
+    @theano.configparser.change_flags(**{
+        'cache_optimizations': True,
+        'tensor.local_elemwise_fusion': True})
+    def compile_with_fusion():
+        return compile_graph()
+
+    f1 = compile_without_fusion()
+    hits = optimized_graph_cache.hits
+    f2 = compile_with_fusion()
+    assert optimized_graph_cache.hits == hits
+    f3 = compile_without_fusion()
+    assert optimized_graph_cache.hits == hits + 1
+    assert (len(f3.maker.fgraph.apply_nodes) ==
+            len(f1.maker.fgraph.apply_nodes))
+
+    in1 = numpy.ones(3, dtype=floatX)
+    for f in (f1, f2, f3):
+        assert numpy.allclose(f(in1, in1), numpy.exp(1) * 5)
+
 if __name__ == '__main__':
     test_graph_opt_caching()
+    test_graph_opt_caching_time_budget()
+    test_graph_opt_caching_config()
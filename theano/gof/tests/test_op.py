@@ -9,6 +9,7 @@ from six import string_types
 from theano.gof.type import Type, Generic
 from theano.gof.graph import Apply, Variable
 import theano.tensor as T
+import theano.tensor.inplace
 from theano import scalar
 from theano import shared
 
@@ -381,5 +382,33 @@ def test_debug_error_message():
         finally:
             config.compute_test_value = prev_value
 
+
+def test_intern_apply_nodes():
+    x = T.dvector('x')
+    y = T.dvector('y')
+    prev_value = config.intern_apply_nodes
+    try:
+        config.intern_apply_nodes = False
+        assert T.exp(x) + y is not T.exp(x) + y
+
+        config.intern_apply_nodes = True
+        a = T.exp(x) + y
+        b = T.exp(x) + y
+        assert a is b
+        # Constants are compared by value.
+        assert x + 1 is x + 1
+        assert x + 1 is not x + 2
+        assert x * y is not y * x
+        # Ops that destroy their inputs are never shared.
+        add_inplace = theano.tensor.inplace.add_inplace
+        assert add_inplace(x, y) is not add_inplace(x, y)
+
+        f = theano.function([x, y], [a, x + 1])
+        va, vb = f(numpy.ones(3), numpy.ones(3))
+        assert numpy.allclose(va, numpy.e + 1)
+        assert numpy.allclose(vb, 2)
+    finally:
+        config.intern_apply_nodes = prev_value
+
 if __name__ == '__main__':
     unittest.main()
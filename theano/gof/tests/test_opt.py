@@ -1,3 +1,4 @@
+import time
 
 from theano.gof.type import Type
 from theano.gof.graph import Variable, Apply, Constant
@@ -6,6 +7,7 @@ from theano.gof.opt import *  # noqa
 from theano.gof.fg import FunctionGraph
 from theano.gof.toolbox import *  # noqa
 
+import theano
 from theano import tensor as T
 
 
@@ -567,6 +569,105 @@ class TestEquilibrium(object):
         # print 'after', g
         assert str(g) == '[Op1(x, y)]'
 
+    def test_incremental(self):
+        # The nodes that did not change are not visited again by the
+        # local optimizers that failed on them.
+        x, y = map(MyVariable, 'xy')
+        e = x
+        for i in range(20):
+            e = op1(e, y)
+        g = FunctionGraph([x, y], [op4(e, y)])
+        visited = []
+
+        @local_optimizer([op1])
+        def local_visit(node):
+            visited.append(node)
+            return False
+
+        opt = EquilibriumOptimizer(
+            [local_visit,
+             PatternSub((op4, 'x', 'y'), (op2, 'x', 'y'))],
+            max_use_ratio=10)
+        opt.optimize(g)
+        assert g.outputs[0].owner.op is op2
+        assert len(visited) == 20
+        assert len(set(visited)) == 20
+
+    def test_pruned_client(self):
+        # When a node is pruned, the local optimizers that need a variable
+        # to have a single client are tried again on its inputs.
+        x, y = map(MyVariable, 'xy')
+        a = op3(x)
+        g = FunctionGraph([x, y], [op1(a), op4(a, op2(y))])
+
+        @local_optimizer([op3])
+        def local_single_client(node):
+            if len(node.outputs[0].clients) == 1:
+                return [op5(*node.inputs)]
+            return False
+
+        opt = EquilibriumOptimizer(
+            [local_single_client,
+             PatternSub((op2, 'y'), (op1, 'y')),
+             PatternSub((op4, 'a', (op1, 'y')), (op6, 'y'))],
+            max_use_ratio=10)
+        opt.optimize(g)
+        assert str(g) == '[Op1(Op5(x)), Op6(y)]'
+
+    def test_deadline(self):
+        # Once the deadline set by SeqOptimizer is passed, no local
+        # optimizer is applied.
+        x, y, z = map(MyVariable, 'xyz')
+        e = op3(op4(x, y))
+        g = FunctionGraph([x, y, z], [e])
+        g.optimizer_deadline = 0
+        opt = EquilibriumOptimizer(
+            [PatternSub((op4, 'x', 'y'), (op1, 'x', 'y'))],
+            max_use_ratio=10)
+        opt.optimize(g)
+        assert str(g) == '[Op3(Op4(x, y))]'
+
+
+class RecordOptimizer(Optimizer):
+
+    def __init__(self, name, record, sleep=0):
+        self.name = name
+        self.record = record
+        self.sleep = sleep
+
+    def apply(self, fgraph):
+        self.record.append(self.name)
+        time.sleep(self.sleep)
+
+
+class TestTimeBudget(object):
+
+    @theano.configparser.change_flags(**{'optdb.time_budget': 0.01})
+    def test_seq_optimizer(self):
+        x, y, z = inputs()
+        g = FunctionGraph([x, y], [op1(x, y)])
+        ran = []
+        seq = SeqOptimizer([RecordOptimizer('a', ran, sleep=0.05),
+                            RecordOptimizer('b', ran),
+                            RecordOptimizer('c', ran)])
+        seq.essential = set(['c'])
+        prof = seq.optimize(g)
+        assert ran == ['a', 'c']
+        assert prof[-1] == [('a', 'stopped'), ('b', 'skipped')]
+        assert not hasattr(g, 'optimizer_deadline')
+
+    @theano.configparser.change_flags(**{'optdb.stage_time_budget': 0.01})
+    def test_stage_budget(self):
+        x, y, z = inputs()
+        g = FunctionGraph([x, y], [op1(x, y)])
+        ran = []
+        seq = SeqOptimizer([RecordOptimizer('a', ran, sleep=0.05),
+                            RecordOptimizer('b', ran)])
+        prof = seq.optimize(g)
+        # Only the stage that took too long is stopped.
+        assert ran == ['a', 'b']
+        assert prof[-1] == [('a', 'stopped')]
+
 
 def test_pre_constant_merge_slice():
     ms = theano.tensor.type_other.MakeSlice()(1)
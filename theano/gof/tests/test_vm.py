@@ -73,6 +73,145 @@ def test_c_thunks():
         assert any([hasattr(t, 'cthunk') for t in f.fn.thunks]) == c_thunks
 
 
+@theano.configparser.change_flags(**{'cmodule.compile_jobs': 2})
+def test_precompile_c_thunks():
+    if not theano.config.cxx:
+        raise SkipTest("G++ not available, so we need to skip this test.")
+    x = tensor.dvector('x')
+    y = tensor.exp(x) + tensor.sin(x) * tensor.cos(x)
+    f = function([x], y,
+                 mode=Mode(optimizer=None,
+                           linker=vm.VM_Linker(use_cloop=False)))
+    xv = numpy.arange(5.)
+    assert numpy.allclose(f(xv),
+                          numpy.exp(xv) + numpy.sin(xv) * numpy.cos(xv))
+    assert all(hasattr(t, 'cthunk') for t in f.fn.thunks)
+
+
+@theano.configparser.change_flags(**{'cmodule.batch_modules': True})
+def test_batch_modules():
+    if not theano.config.cxx:
+        raise SkipTest("G++ not available, so we need to skip this test.")
+    from theano.gof import cc
+    x = tensor.fmatrix('x')
+    # The constants are in the keys of the modules of the nodes broadcasting
+    # them, so that these modules are not in the cache yet.
+    c1, c2 = numpy.random.RandomState().rand(2).astype('float32')
+    y = tensor.tanh(x) * c1 - tensor.arctan(x) * c2
+
+    def compile_graph():
+        return function([x], y,
+                        mode=Mode(optimizer=None,
+                                  linker=vm.VM_Linker(use_cloop=False)))
+
+    f = compile_graph()
+    xv = numpy.arange(6, dtype='float32').reshape(2, 3)
+    assert numpy.allclose(f(xv), numpy.tanh(xv) * c1 - numpy.arctan(xv) * c2)
+    assert all(hasattr(t, 'cthunk') for t in f.fn.thunks)
+    linker = f.maker.linker
+    keys = [key for node, key, lnk in linker.c_thunk_linkers(
+        linker.schedule(f.maker.fgraph), linker.no_recycling)]
+    batched = [key for key in keys if key in cc._batched_instantiate]
+    assert len(batched) >= 2
+
+    # Without their instantiate functions, the same keys are batched again,
+    # and the batch module is found in the cache.
+    for key in batched:
+        del cc._batched_instantiate[key]
+    cache = cc.get_module_cache()
+    compiles = cache.stats[2]
+    f = compile_graph()
+    assert numpy.allclose(f(xv), numpy.tanh(xv) * c1 - numpy.arctan(xv) * c2)
+    assert all(key in cc._batched_instantiate for key in batched)
+    assert cache.stats[2] == compiles
+
+
+@theano.configparser.change_flags(**{'vm.memory_planner': True})
+def test_memory_planner():
+    x = tensor.dvector('x')
+    z = tensor.exp(tensor.tanh(tensor.sin(x) + 1) * 2) - x
+    for l in [vm.VM_Linker(allow_gc=False, use_cloop=False),
+              vm.VM_Linker(allow_gc=True, use_cloop=False),
+              vm.VM_Linker(allow_gc=True, use_cloop=True)]:
+        if l.use_cloop and not theano.config.cxx:
+            continue
+        m = theano.compile.get_mode(theano.Mode(linker=l))
+        m = m.excluding('fusion', 'inplace')
+        f = theano.function([x], z, mode=m)
+        plan = f.fn.memory_plan
+        assert plan is not None
+        # At most two intermediate results are alive at the same time.
+        assert plan.peak_live <= 2
+        assert len(plan.cells) < len(plan.cell_of)
+
+        xv = numpy.arange(5.)
+        expected = numpy.exp(numpy.tanh(numpy.sin(xv) + 1) * 2) - xv
+        assert numpy.allclose(f(xv), expected)
+        buffers = [id(c[0]) for c in plan.storage]
+        assert None not in [c[0] for c in plan.storage]
+        assert numpy.allclose(f(xv), expected)
+        if theano.config.cxx:
+            # The C code reused the buffers of the first call.
+            assert buffers == [id(c[0]) for c in plan.storage]
+
+
+@theano.configparser.change_flags(**{'vm.memory_planner': True})
+def test_memory_planner_lazy():
+    # A graph with lazy thunks other than IfElse is run without a plan.
+    from theano.gof.tests.test_lazy import IfElseIfElseIf
+    c = tensor.dscalar('c')
+    x = tensor.dvector('x')
+    a = tensor.exp(x) * 2
+    b = tensor.sin(x) + 1
+    z = IfElseIfElseIf()(c, a, c, b, c, a, b) * 3
+    for use_cloop in (False, True):
+        if use_cloop and not theano.config.cxx:
+            continue
+        l = vm.VM_Linker(use_cloop=use_cloop)
+        f = function([c, x], z, mode=Mode(linker=l, optimizer=None))
+        assert f.fn.memory_plan is None
+        xv = numpy.arange(3.)
+        assert numpy.allclose(f(1, xv), numpy.exp(xv) * 6)
+        assert numpy.allclose(f(0, xv), (numpy.sin(xv) + 1) * 3)
+
+
+@theano.configparser.change_flags(**{'vm.static_plan': True})
+def test_static_plan():
+    a = tensor.dscalar('a')
+    x = tensor.dvector('x')
+    z = ifelse(tensor.lt(a, 0), tensor.exp(x) * 2, tensor.sin(x).sum() + x)
+    for allow_gc in (True, False):
+        l = vm.VM_Linker(lazy=True, use_cloop=False, allow_gc=allow_gc)
+        f = function([a, x], z, mode=Mode(linker=l, optimizer='fast_run'))
+        assert isinstance(f.fn, vm.Stack)
+        for av, xv in [(-1, numpy.arange(3.)), (-1, numpy.arange(3.) + 1),
+                       (1, numpy.arange(3.)), (1, numpy.arange(3.)),
+                       (-1, numpy.arange(3.)), (1, numpy.arange(4.)),
+                       (-1, numpy.arange(4.))]:
+            if av < 0:
+                expected = numpy.exp(xv) * 2
+            else:
+                expected = numpy.sin(xv).sum() + xv
+            assert numpy.allclose(f(av, xv), expected)
+        # A plan is dropped when a lazy node takes another branch.
+        assert not f.fn.plans
+        f(1, numpy.arange(5.))
+        assert list(f.fn.plans) == [((), (5,))]
+        assert numpy.allclose(f(1, numpy.arange(5.)),
+                              numpy.sin(numpy.arange(5.)).sum() +
+                              numpy.arange(5.))
+
+    # The calls of a profiled function are not replayed, to time the thunks.
+    profile = theano.compile.profiling.ProfileStats(False)
+    f = function([a, x], z, mode=Mode(linker=l, optimizer='fast_run'),
+                 profile=profile)
+    for i in range(3):
+        f(1, numpy.arange(3.))
+    assert not f.fn.plans
+    assert sum(profile.apply_callcount.values()) > 0
+    assert sum(profile.apply_time.values()) > 0
+
+
 def test_speed():
     if not theano.config.cxx:
         raise SkipTest("G++ not available, so we need to skip this test.")
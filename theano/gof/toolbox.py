@@ -253,12 +253,14 @@ class Validator(Feature):
 
 class ReplaceValidate(History, Validator):
     pickle_rm_attr = (["replace_validate", "replace_all_validate",
-                       "replace_all_validate_remove"] +
+                       "replace_all_validate_remove",
+                       "replace_all_validate_batch"] +
                       History.pickle_rm_attr + Validator.pickle_rm_attr)
 
     def on_attach(self, fgraph):
         for attr in ('replace_validate', 'replace_all_validate',
-                     'replace_all_validate_remove'):
+                     'replace_all_validate_remove',
+                     'replace_all_validate_batch'):
             if hasattr(fgraph, attr):
                 raise AlreadyThere("ReplaceValidate feature is already present"
                                    " or in conflict with another plugin.")
@@ -274,6 +276,8 @@ class ReplaceValidate(History, Validator):
                                               fgraph)
         fgraph.replace_all_validate_remove = partial(
             self.replace_all_validate_remove, fgraph)
+        fgraph.replace_all_validate_batch = partial(
+            self.replace_all_validate_batch, fgraph)
 
     def on_detach(self, fgraph):
         History.on_detach(self, fgraph)
@@ -281,6 +285,7 @@ class ReplaceValidate(History, Validator):
         del fgraph.replace_validate
         del fgraph.replace_all_validate
         del fgraph.replace_all_validate_remove
+        del fgraph.replace_all_validate_batch
 
     def replace_validate(self, fgraph, r, new_r, reason=None):
         self.replace_all_validate(fgraph, [(r, new_r)], reason=reason)
@@ -316,6 +321,45 @@ class ReplaceValidate(History, Validator):
             print(reason, r, new_r)
         return chk
 
+    def replace_all_validate_batch(self, fgraph, candidates, reason=None):
+        """
+        Apply many independent lists of replacements, validating once.
+
+        All the lists of `candidates` are applied and the graph is
+        validated. If it is not valid, they are reverted and the two
+        halves of `candidates` are tried in turn the same way, so that a
+        few invalid candidates only cost a few more validations. A
+        candidate is invalid when `replace` or `validate` raise an
+        InconsistencyError or a ValueError, as for the callers of
+        `replace_all_validate`; the other errors are raised.
+
+        Returns
+        -------
+        list
+            The candidates that were applied.
+
+        """
+        chk = fgraph.checkpoint()
+        try:
+            for replacements in candidates:
+                for r, new_r in replacements:
+                    fgraph.replace(r, new_r, reason=reason, verbose=False)
+            fgraph.validate()
+        except (theano.gof.InconsistencyError, ValueError):
+            fgraph.revert(chk)
+            if len(candidates) <= 1:
+                return []
+            half = len(candidates) // 2
+            kept = self.replace_all_validate_batch(
+                fgraph, candidates[:half], reason)
+            return kept + self.replace_all_validate_batch(
+                fgraph, candidates[half:], reason)
+        except Exception:
+            # Not an invalid candidate, but a bug.
+            fgraph.revert(chk)
+            raise
+        return list(candidates)
+
     def replace_all_validate_remove(self, fgraph, replacements,
                                     remove, reason=None, warn=True):
         """
@@ -5,12 +5,14 @@ A VM is not actually different from a Linker, we just decided
 VM was a better name at some point.
 
 """
+from __future__ import print_function
 from . import link
+from . import utils
 from collections import defaultdict
 import logging
 import os
 import sys
-import time
+from timeit import default_timer
 import warnings
 
 from theano.configparser import (config, AddConfigVar,
@@ -18,7 +20,7 @@ from theano.configparser import (config, AddConfigVar,
 
 import theano.gof.cmodule
 
-from six import iteritems, itervalues
+from six import get_unbound_function, iteritems, itervalues
 from six.moves import xrange
 
 logger = logging.getLogger(__name__)
@@ -56,6 +58,31 @@ AddConfigVar('vm.lazy',
              ConfigParam('None', filter_vm_lazy),
              in_c_key=False)
 
+AddConfigVar('vm.fast_call',
+             "If True, theano functions whose inputs are all given"
+             " positionally bind their arguments, run the VM and collect"
+             " their outputs in one call to a C implementation. It needs"
+             " the C VM extension to be compiled.",
+             BoolParam(False),
+             in_c_key=False)
+
+AddConfigVar('vm.memory_planner',
+             "Useful only for the vm linkers on graphs without lazy nodes."
+             " If True, plan before linking which intermediate results can"
+             " share the same storage, from their lifetime in the schedule,"
+             " and keep those buffers between calls so they are reused.",
+             BoolParam(False),
+             in_c_key=False)
+
+AddConfigVar('vm.static_plan',
+             "Useful only for the Python Stack VM (lazy graphs without the"
+             " C VM). If True, record the order in which the thunks ran and"
+             " the storage they freed on the first call for a given"
+             " signature of the input shapes, and replay it on the next"
+             " calls with that signature, without walking the graph.",
+             BoolParam(False),
+             in_c_key=False)
+
 
 def calculate_reallocate_info(order, fgraph, storage_map, compute_map_re,
                               dependencies):
@@ -143,6 +170,117 @@ def calculate_reallocate_info(order, fgraph, storage_map, compute_map_re,
     return reallocated_info
 
 
+class MemoryPlan(object):
+    """
+    Assignment of the intermediate results of a schedule to shared storage.
+
+    Two variables of the same type can share a storage cell when the last
+    use of the first one is strictly before the node computing the second
+    one. The Ops then find the buffer of a dead variable in their output
+    storage and reuse it when the shape matches. The planned cells are not
+    cleared by the garbage collector, so the buffers are also reused from
+    one call to the next.
+
+    Only the results that are neither outputs of the graph, nor views or
+    destroyed versions of another variable, nor viewed or destroyed by a
+    later node, are planned.
+
+    Parameters
+    ----------
+    order
+        A list of nodes in toposort order.
+    fgraph
+        The FunctionGraph of `order`.
+    no_recycling
+        Variables whose storage is cleared before each call.
+
+    Attributes
+    ----------
+    cell_of : dict
+        Maps each planned variable to the index of its cell.
+    cells
+        List of the variables sharing each cell.
+    storage
+        List of the container of each cell, once `apply` was called.
+    peak_live : int
+        Maximum number of planned variables alive at the same time.
+
+    """
+
+    def __init__(self, order, fgraph, no_recycling=()):
+        self.cell_of = {}
+        self.cells = []
+        self.storage = []
+        self.peak_live = 0
+
+        excluded = set(fgraph.outputs)
+        excluded.update(no_recycling)
+        last_use = {}
+        for idx, node in enumerate(order):
+            for i in node.inputs:
+                last_use[i] = idx
+            aliased = {}
+            aliased.update(getattr(node.op, 'view_map', {}))
+            aliased.update(getattr(node.op, 'destroy_map', {}))
+            for o_idx, i_idxs in iteritems(aliased):
+                excluded.add(node.outputs[o_idx])
+                excluded.update(node.inputs[i] for i in i_idxs)
+
+        # Cells whose variables are dead, by type, and variables to release
+        # after each node.
+        free = defaultdict(list)
+        expire = defaultdict(list)
+        live = 0
+        for idx, node in enumerate(order):
+            for out in node.outputs:
+                if (out in excluded or
+                        getattr(out, 'ndim', None) is None):
+                    continue
+                if free[out.type]:
+                    cell = free[out.type].pop()
+                    self.cells[cell].append(out)
+                else:
+                    cell = len(self.cells)
+                    self.cells.append([out])
+                self.cell_of[out] = cell
+                expire[last_use.get(out, idx)].append(out)
+                live += 1
+            self.peak_live = max(self.peak_live, live)
+            for var in expire.pop(idx, []):
+                free[var.type].append(self.cell_of[var])
+                live -= 1
+
+    def apply(self, storage_map):
+        """
+        Make the variables of each cell share one container of `storage_map`.
+
+        This must be done before the thunks are made.
+
+        """
+        self.storage = []
+        for variables in self.cells:
+            container = storage_map[variables[0]]
+            for var in variables[1:]:
+                storage_map[var] = container
+            self.storage.append(container)
+
+    def allocated_bytes(self):
+        """Return the memory held by the planned cells, in bytes."""
+        return sum(getattr(container[0], 'nbytes', 0)
+                   for container in self.storage)
+
+    def summary(self, file=sys.stderr):
+        print("Memory plan", file=file)
+        print("-----------", file=file)
+        print("  Planned variables: %i" % len(self.cell_of), file=file)
+        print("  Buffers: %i" % len(self.cells), file=file)
+        print("  Planned peak of live buffers: %i" % self.peak_live,
+              file=file)
+        print("  Memory held by the buffers: %iKB" %
+              int(round(self.allocated_bytes() / 1024.)), file=file)
+        print("", file=file)
+
+
 class VM(object):
     """
     A VM object's __call__ method evaluates a Theano program.
@@ -220,17 +358,16 @@ class VM(object):
         """
         raise NotImplementedError('override me')
 
-    def update_profile(self, profile):
+    def update_profile(self, profile, scale=1):
         # accumulate into the profile object
-        for node, thunk, t, c in zip(self.nodes, self.thunks,
-                                     self.call_times, self.call_counts):
+        # `scale` is the number of calls that the last timed one stands for.
+        for node, thunk in zip(self.nodes, self.thunks):
             profile.apply_time.setdefault(node, 0.0)
-            profile.apply_time[node] += t
-
             profile.apply_callcount.setdefault(node, 0)
-            profile.apply_callcount[node] += c
-
             profile.apply_cimpl[node] = hasattr(thunk, 'cthunk')
+        if self.time_thunks:
+            profile.add_thunk_times(self.nodes, self.call_times,
+                                    self.call_counts, scale)
 
         if hasattr(self, 'variable_shape'):
             profile.variable_shape = self.variable_shape.copy()
@@ -245,6 +382,9 @@ class VM(object):
         if hasattr(self, 'dependencies'):
             profile.dependencies = self.dependencies
 
+        if getattr(self, 'memory_plan', None) is not None:
+            profile.memory_plan = self.memory_plan
+
         # clear the timer info out of the buffers
         for i in xrange(len(self.call_times)):
             self.call_times[i] = 0.0
@@ -267,9 +407,9 @@ class Loop(VM):
             try:
                 for i, (thunk, node) in enumerate(zip(self.thunks,
                                                       self.nodes)):
-                    t0 = time.time()
+                    t0 = default_timer()
                     thunk()
-                    t1 = time.time()
+                    t1 = default_timer()
                     self.call_counts[i] += 1
                     self.call_times[i] += t1 - t0
             except:
@@ -308,9 +448,9 @@ class LoopGC(VM):
                 for thunk, node, old_storage in zip(self.thunks,
                                                     self.nodes,
                                                     self.post_thunk_clear):
-                    t0 = time.time()
+                    t0 = default_timer()
                     thunk()
-                    t1 = time.time()
+                    t1 = default_timer()
                     self.call_counts[i] += 1
                     self.call_times[i] += t1 - t0
                     for old_s in old_storage:
@@ -402,6 +542,20 @@ class Stack(VM):
         if self.allow_gc and self.dependencies is None:
             raise ValueError("Must set dependencies when using GC")
 
+        # Input shape signature -> list of steps, see record_step.
+        self.plans = None
+        if config.vm.static_plan and callback is None:
+            self.plans = {}
+            self.input_storage = [storage_map[v] for v in fgraph.inputs]
+            self.compute_reset = [(compute_map[v], v.owner is None)
+                                  for v in storage_map]
+
+    max_plans = 16
+    """
+    The number of input shape signatures whose plan is kept.
+
+    """
+
     def run_thunk_of_node(self, node):
         """
         Run the thunk corresponding to Apply instance `node`.
@@ -410,15 +564,15 @@ class Stack(VM):
 
         """
         idx = self.node_idx[node]
-        t0 = time.time()
+        t0 = default_timer()
         rval = self.thunks[idx]()
         self.node_executed_order.append(node)
 
         # Some thunks on some computers run faster than the granularity
-        # of the time.time clock.
+        # of the clock.
         # Profile output looks buggy if a node has run but takes 0 time.
         # (and profile code might hide real bugs if it rounds up 0)
-        dt = max(time.time() - t0, 1e-10)
+        dt = max(default_timer() - t0, 1e-10)
         if self.callback is not None:
             self.callback(
                 node=node,
@@ -429,6 +583,90 @@ class Stack(VM):
         return rval, dt
 
     def __call__(self):
+        # The thunks are only timed by run_stack.
+        if self.plans is None or config.profile or self.time_thunks:
+            return self.run_stack()
+        key = tuple(getattr(cell[0], 'shape', None)
+                    for cell in self.input_storage)
+        plan = self.plans.get(key)
+        if plan is None:
+            if len(self.plans) >= self.max_plans:
+                self.plans.clear()
+            plan = []
+            self.run_stack(plan)
+            self.plans[key] = plan
+        elif not self.replay(plan):
+            # A lazy node took another branch. Walk the graph from there.
+            del self.plans[key]
+            self.run_stack(reset=False)
+
+    def replay(self, plan):
+        """
+        Run the steps recorded by `run_stack` for the same input shapes.
+
+        The thunks are called in the recorded order, and the storage freed
+        after each one, without looking at the graph. Only the compute_map
+        is kept up to date, for the lazy thunks.
+
+        Returns
+        -------
+        bool
+            False if a lazy thunk asked for other inputs than when the plan
+            was recorded. The storage and compute_map are then consistent,
+            so that `run_stack` can finish the call.
+
+        """
+        for cell, value in self.compute_reset:
+            cell[0] = value
+        thunks = self.thunks
+        for idx, requires, computed, cleared in plan:
+            if idx is not None:
+                try:
+                    rval = thunks[idx]()
+                except Exception:
+                    link.raise_with_op(self.nodes[idx], thunks[idx],
+                                       storage_map=self.storage_map)
+                if requires is not None and list(rval or ()) != requires:
+                    return False
+                for cell in computed:
+                    cell[0] = 1
+            for cell, compute_cell in cleared:
+                cell[0] = None
+                compute_cell[0] = 2
+        return True
+
+    def record_step(self, plan, node, requires, cleared):
+        # A step is the index of the thunk run (or None), the inputs a lazy
+        # thunk asked for (None for other thunks), the compute_map cells of
+        # the outputs it computed, and the storage and compute_map cells
+        # freed after it.
+        storage_map = self.storage_map
+        compute_map = self.compute_map
+        computed = ()
+        idx = None
+        if node is not None:
+            idx = self.node_idx[node]
+            if not requires:
+                computed = [compute_map[o] for o in node.outputs]
+            if self.thunks[idx].lazy:
+                requires = list(requires or ())
+            else:
+                requires = None
+        plan.append((idx, requires, computed,
+                     [(storage_map[v], compute_map[v]) for v in cleared]))
+
+    def run_stack(self, plan=None, reset=True):
+        """
+        Walk the graph from the outputs and run the thunks needed.
+
+        Parameters
+        ----------
+        plan : list or None
+            If a list, the steps done are appended to it, for `replay`.
+        reset : bool
+            If False, the compute_map is not reset, to finish a call.
+
+        """
         storage_map = self.storage_map
         compute_map = self.compute_map
         thunks = self.thunks
@@ -436,8 +674,9 @@ class Stack(VM):
         self.node_executed_order = []
         self.node_cleared_order = []
 
-        for k in self.storage_map:
-            compute_map[k][0] = (k.owner is None)
+        if reset:
+            for k in self.storage_map:
+                compute_map[k][0] = (k.owner is None)
 
         # apply_stack contains nodes
         apply_stack = list(self.base_apply_stack)
@@ -570,6 +809,10 @@ class Stack(VM):
                                             stacklevel=3
                                         )
                     self.node_cleared_order.append(input_index)
+                    if plan is not None:
+                        self.record_step(
+                            plan, current_apply, None,
+                            [current_apply.inputs[j] for j in input_index])
 
                 elif not computed_ins:
                     # -- Non-lazy case, need inputs
@@ -601,6 +844,8 @@ class Stack(VM):
                         storage_map=storage_map)
 
                 if requires:
+                    if plan is not None:
+                        self.record_step(plan, current_apply, requires, [])
                     for r in requires:
                         # We are not done with this op ..  so we added
                         # back and see to get the inputs we are
@@ -649,6 +894,10 @@ class Stack(VM):
                                     compute_map[i][0] = 2
 
                     self.node_cleared_order.append(input_index)
+                    if plan is not None:
+                        self.record_step(
+                            plan, current_apply, requires,
+                            [current_apply.inputs[j] for j in input_index])
 
         # Hacky coarse gc final pass
         # This is required until we have a proper gc algorithm for graphs with
@@ -666,6 +915,8 @@ class Stack(VM):
                         compute_map[v][0] = 2
 
         self.node_cleared_order.append(final_index)
+        if plan is not None:
+            self.record_step(plan, None, None, final_index)
 
 
 try:
@@ -676,6 +927,9 @@ try:
         def __init__(self, *args, **kwargs):
             lazylinker_c.CLazyLinker.__init__(self, *args, **kwargs)
             # skip VM.__init__
+
+    # Used by Function.__call__ when config.vm.fast_call is True.
+    FastCall = lazylinker_c.FastCall
 except ImportError:
     pass
 except (OSError, theano.gof.cmodule.MissingGXX) as e:
@@ -832,12 +1086,68 @@ class VM_Linker(link.LocalLinker):
                 dependencies[k] += ls
         return dependencies
 
+    def precompile_c_thunks(self, order, no_recycling, n_jobs=None):
+        """
+        Compile concurrently the C modules that the thunks of `order` need.
+
+        The keys of all the nodes that will get the default C thunk are
+        collected first, then the modules missing from the cache are compiled
+        with up to `n_jobs` (by default ``config.cmodule.compile_jobs``)
+        concurrent compilations. The thunks built afterwards find their
+        module in the cache.
+
+        Returns
+        -------
+        dict
+            Maps the nodes whose module was compiled here to the compilation
+            time, in seconds. Nodes sharing a module only count it once.
+
+        """
+        keys_and_linkers = []
+        node_from_key = {}
+        for node, key, lnk in self.c_thunk_linkers(order, no_recycling):
+            keys_and_linkers.append((key, lnk))
+            node_from_key.setdefault(key, node)
+        compile_time = theano.gof.cc.get_module_cache().module_from_keys(
+            keys_and_linkers, n_jobs=n_jobs)
+        return dict((node_from_key[key], t)
+                    for key, t in iteritems(compile_time))
+
+    def c_thunk_linkers(self, order, no_recycling):
+        """
+        Return a (node, key, CLinker) triple for each node of `order` that
+        will get the default C thunk.
+
+        """
+        default_make_thunk = [get_unbound_function(cls.make_thunk)
+                              for cls in (theano.gof.op.Op,
+                                          theano.gof.op.OpenMPOp)]
+        rval = []
+        for node in order:
+            op = node.op
+            # Ops with their own make_thunk may not compile any CLinker.
+            if (not getattr(op, '_op_use_c_code', False) or
+                    get_unbound_function(type(op).make_thunk) not in
+                    default_make_thunk):
+                continue
+            try:
+                lnk = op.make_c_linker(node, no_recycling)
+                key = lnk.cmodule_key()
+                # Generate the code now to skip the nodes without C code.
+                lnk.get_src_code()
+            except (NotImplementedError, utils.MethodNotDefined, KeyError):
+                continue
+            if key is not None:
+                rval.append((node, key, lnk))
+        return rval
+
     def make_vm(self, nodes, thunks,
                 input_storage, output_storage, storage_map,
                 post_thunk_clear,
                 computed,
                 compute_map,
                 updated_vars,
+                memory_plan=None,
                 ):
 
         pre_call_clear = [storage_map[v] for v in self.no_recycling]
@@ -879,6 +1189,12 @@ class VM_Linker(link.LocalLinker):
             # put storage_map and compute_map into a int-based scheme
             storage_map_list = [storage_map[vars_idx_inv[i]]
                                 for i in xrange(len(vars_idx_inv))]
+            if memory_plan is not None:
+                # The CVM clears the storage of the intermediate results
+                # when allow_gc is True. Give it a private container for the
+                # planned variables so their buffers are kept between calls.
+                for var in memory_plan.cell_of:
+                    storage_map_list[vars_idx[var]] = [None]
             compute_map_list = [compute_map[vars_idx_inv[i]]
                                 for i in xrange(len(vars_idx_inv))]
             if nodes:
@@ -967,6 +1283,8 @@ class VM_Linker(link.LocalLinker):
                 dependencies=dependency_map_list,
             )
             assert c0 == sys.getrefcount(node_n_inputs)
+            # The C code reads this list at each call, like the Python VMs.
+            vm.pre_call_clear = pre_call_clear
         else:
             lazy = self.lazy
             if lazy is None:
@@ -999,6 +1317,50 @@ class VM_Linker(link.LocalLinker):
                 )
         return vm
 
+    def static_schedule(self, order):
+        """
+        Return True if the nodes of `order` always run in that order.
+
+        This is the case when the graph is run by Loop, LoopGC or the CVM
+        without lazy nodes.
+
+        """
+        if (self.callback is not None or
+                (config.profile and config.profile_memory)):
+            return False
+        lazy = self.lazy
+        if lazy is None:
+            lazy = config.vm.lazy
+        if lazy is None:
+            from theano.ifelse import IfElse
+            lazy = any(isinstance(node.op, IfElse) for node in order)
+        return not lazy
+
+    def make_thunks(self, order, storage_map, compute_map, no_recycling):
+        """Make the thunks of the nodes of `order` on `storage_map`."""
+        thunks = []
+        for node in order:
+            try:
+                if self.c_thunks is False:
+                    node.op._op_use_c_code = False
+                thunks.append(node.op.make_thunk(node,
+                                                 storage_map,
+                                                 compute_map,
+                                                 no_recycling))
+                if not hasattr(thunks[-1], 'lazy'):
+                    # We don't want all ops maker to think about lazy Ops.
+                    # So if they didn't specify that its lazy or not, it isn't.
+                    # If this member isn't present, it will crash later.
+                    thunks[-1].lazy = False
+            except Exception as e:
+                e.args = ("The following error happened while"
+                          " compiling the node", node, "\n") + e.args
+                raise
+        for node, thunk in zip(order, thunks):
+            thunk.inputs = [storage_map[v] for v in node.inputs]
+            thunk.outputs = [storage_map[v] for v in node.outputs]
+        return thunks
+
     def make_all(self, profiler=None, input_storage=None,
                  output_storage=None, storage_map=None,
                  ):
@@ -1012,8 +1374,6 @@ class VM_Linker(link.LocalLinker):
         for k in storage_map:
             compute_map[k] = [k.owner is None]
 
-        thunks = []
-
         # Collect Reallocation Info
         compute_map_re = defaultdict(lambda: [0])
         for var in fgraph.inputs:
@@ -1027,32 +1387,44 @@ class VM_Linker(link.LocalLinker):
         reallocated_info = calculate_reallocate_info(
             order, fgraph, storage_map, compute_map_re, dependencies)
 
-        for node in order:
-            try:
-                if self.c_thunks is False:
-                    node.op._op_use_c_code = False
-                thunks.append(node.op.make_thunk(node,
-                                                 storage_map,
-                                                 compute_map,
-                                                 no_recycling))
-                if not hasattr(thunks[-1], 'lazy'):
-                    # We don't want all ops maker to think about lazy Ops.
-                    # So if they didn't specify that its lazy or not, it isn't.
-                    # If this member isn't present, it will crash later.
-                    thunks[-1].lazy = False
-            except Exception as e:
-                e.args = ("The following error happened while"
-                          " compiling the node", node, "\n") + e.args
-                raise
-        for node, thunk in zip(order, thunks):
-            thunk.inputs = [storage_map[v] for v in node.inputs]
-            thunk.outputs = [storage_map[v] for v in node.outputs]
+        # The memory plan must be applied to the storage before the thunks
+        # bind it.
+        memory_plan = None
+        if config.vm.memory_planner and self.static_schedule(order):
+            memory_plan = MemoryPlan(order, fgraph, no_recycling)
+            unplanned_storage = dict((var, storage_map[var])
+                                     for var in memory_plan.cell_of)
+            memory_plan.apply(storage_map)
+
+        if self.c_thunks is not False:
+            if config.cmodule.batch_modules:
+                theano.gof.cc.batch_compile(
+                    [(key, lnk) for node, key, lnk in
+                     self.c_thunk_linkers(order, no_recycling)])
+            elif config.cmodule.compile_jobs > 1:
+                self.precompile_c_thunks(order, no_recycling)
+
+        thunks = self.make_thunks(order, storage_map, compute_map,
+                                  no_recycling)
 
         lazy = self.lazy
         if lazy is None:
             lazy = config.vm.lazy
         if lazy is None:
             lazy = not all([(not th.lazy) for th in thunks])
+        if memory_plan is not None:
+            if lazy:
+                # Only IfElse is known to be lazy before the thunks are
+                # made. The nodes may not run in the planned order, so the
+                # thunks are made again on the storage without the plan.
+                logger.debug("The memory plan is not used, since the graph"
+                             " has lazy thunks.")
+                storage_map.update(unplanned_storage)
+                memory_plan = None
+                thunks = self.make_thunks(order, storage_map, compute_map,
+                                          no_recycling)
+            else:
+                reallocated_info = {}
         if not (lazy or (config.profile and config.profile_memory) or
                 self.use_cloop or self.callback):
             for pair in itervalues(reallocated_info):
@@ -1067,7 +1439,9 @@ class VM_Linker(link.LocalLinker):
                     if (input in computed and
                             input not in fgraph.outputs and
                             node == last_user[input] and
-                            input not in reallocated_info):
+                            input not in reallocated_info and
+                            (memory_plan is None or
+                             input not in memory_plan.cell_of)):
                         clear_after_this_thunk.append(storage_map[input])
                 post_thunk_clear.append(clear_after_this_thunk)
         else:
@@ -1079,9 +1453,11 @@ class VM_Linker(link.LocalLinker):
                           computed,
                           compute_map,
                           self.updated_vars,
+                          memory_plan=memory_plan,
                           )
 
         vm.storage_map = storage_map
+        vm.memory_plan = memory_plan
 
         return (vm,
                 [link.Container(input, storage)
@@ -929,6 +929,12 @@ class ScalarOp(Op):
     def c_code_cache_version(self):
         return (4,)
 
+    def c_code_gil_free(self, node):
+        # The c_code of the ops of this module only computes on C scalars,
+        # so it is GIL-free. Ops that bring their own c_code elsewhere have
+        # to declare it themselves.
+        return getattr(type(self).c_code, '__module__', None) == __name__
+
     def c_code_contiguous(self, node, name, inp, out, sub):
         """
         This function is called by Elemwise when all inputs and outputs are
@@ -3581,6 +3587,10 @@ class Composite(ScalarOp):
 
         return self._c_code % d
 
+    def c_code_gil_free(self, node):
+        return all(subnode.op.c_code_gil_free(subnode)
+                   for subnode in self.fgraph.toposort())
+
     def c_code_cache_version(self):
         rval = [3]
         for x in self.fgraph.toposort():
@@ -836,6 +836,9 @@ class GemmRelated(Op):
                 int Nz0 = Nz[0], Nz1 = Nz[1], Nx1 = Nx[1];
                 //std::cerr << (unit/256) MOD 16 << (unit / 16) MOD 16 << unit MOD 16<< '\\n';
                 //double t0 = time_time();
+                // BLAS does not need the GIL, let other threads run.
+                int unit_ok = 1;
+                Py_BEGIN_ALLOW_THREADS
                 switch(unit)
                 {
                     case 0x000: sgemm_(&N, &N, &Nz1, &Nz0, &Nx1, &a, y, &sy_0, x, &sx_0, &b, z, &sz_0); break;
@@ -846,8 +849,15 @@ class GemmRelated(Op):
                     case 0x101: sgemm_(&N, &T, &Nz0, &Nz1, &Nx1, &a, x, &sx_1, y, &sy_0, &b, z, &sz_1); break;
                     case 0x011: sgemm_(&T, &N, &Nz0, &Nz1, &Nx1, &a, x, &sx_0, y, &sy_1, &b, z, &sz_1); break;
                     case 0x111: sgemm_(&N, &N, &Nz0, &Nz1, &Nx1, &a, x, &sx_1, y, &sy_1, &b, z, &sz_1); break;
-                    default: PyErr_SetString(PyExc_ValueError, "some matrix has no unit stride"); %(fail)s;
+                    default: unit_ok = 0;
                 };
+                Py_END_ALLOW_THREADS
+                if (!unit_ok)
+                {
+                    PyErr_SetString(PyExc_ValueError,
+                                    "some matrix has no unit stride");
+                    %(fail)s;
+                }
                 //fprintf(stderr, "Calling sgemm %%i %%i %%i %%i took %%f\\n", unit, Nz1, Nz0, Nx1, time_time() - t0);
         """
 
@@ -875,6 +885,9 @@ class GemmRelated(Op):
                 //sx_0, sx_1,
                 //sz_0, sz_1
                 //);
+                // BLAS does not need the GIL, let other threads run.
+                int unit_ok = 1;
+                Py_BEGIN_ALLOW_THREADS
                 switch(unit)
                 {
                     case 0x000: dgemm_(&N, &N, &Nz1, &Nz0, &Nx1, &a, y,
@@ -893,10 +906,15 @@ class GemmRelated(Op):
                                        &sx_0, y, &sy_1, &b, z, &sz_1); break;
                     case 0x111: dgemm_(&N, &N, &Nz0, &Nz1, &Nx1, &a, x,
                                        &sx_1, y, &sy_1, &b, z, &sz_1); break;
-                    default: PyErr_SetString(PyExc_ValueError,
-                                             "some matrix has no unit stride");
-                             %(fail)s;
+                    default: unit_ok = 0;
                 };
+                Py_END_ALLOW_THREADS
+                if (!unit_ok)
+                {
+                    PyErr_SetString(PyExc_ValueError,
+                                    "some matrix has no unit stride");
+                    %(fail)s;
+                }
                 //fprintf(stderr, "Calling dgemm %%i %%i %%i %%i took %%f\\n",
                 //        unit, Nz1, Nz0, Nx1, time_time()- t0);
         """
@@ -929,7 +947,7 @@ class GemmRelated(Op):
             self.end_switch_typenum), '')
 
     def build_gemm_version(self):
-        return (13, blas_header_version())
+        return (14, blas_header_version())
 
 
 class Gemm(GemmRelated):
@@ -1052,12 +1052,14 @@ class Elemwise(OpenMPOp):
         # the index of the last of these aliased outputs.
 
         # We generate the C code of the inner loop using the scalar op
+        scalar_node = Apply(
+            self.scalar_op,
+            [get_scalar_type(dtype=input.type.dtype).make_variable()
+             for input in node.inputs],
+            [get_scalar_type(dtype=output.type.dtype).make_variable()
+             for output in node.outputs])
         task_code = self.scalar_op.c_code(
-            Apply(self.scalar_op,
-                  [get_scalar_type(dtype=input.type.dtype).make_variable()
-                   for input in node.inputs],
-                  [get_scalar_type(dtype=output.type.dtype).make_variable()
-                   for output in node.outputs]),
+            scalar_node,
             nodename + '_scalar_',
             ["%s_i" % s for s in _inames],
             ["%s_i" % s for s in onames],
@@ -1185,6 +1187,24 @@ class Elemwise(OpenMPOp):
                 %(loop)s
             }
             """ % locals()
+
+        # The loop only reads and writes the data of arrays that are
+        # already allocated. If the scalar code doesn't need the GIL
+        # either, release it so that other threads can run meanwhile.
+        if (node.outputs[0].ndim > 0 and
+                self.scalar_op.c_code_gil_free(scalar_node)):
+            z = onames[0]
+            minsize = config.elemwise_release_gil_minsize
+            loop = """
+            {
+                PyThreadState* _save = NULL;
+                if (PyArray_SIZE(%(z)s) >= %(minsize)d)
+                    _save = PyEval_SaveThread();
+                %(loop)s
+                if (_save)
+                    PyEval_RestoreThread(_save);
+            }
+            """ % locals()
         return decl, checks, alloc, loop
 
     def c_code(self, node, nodename, inames, onames, sub):
@@ -1209,7 +1229,7 @@ class Elemwise(OpenMPOp):
         return support_code
 
     def c_code_cache_version_apply(self, node):
-        version = [12]  # the version corresponding to the c code in this Op
+        version = [13]  # the version corresponding to the c code in this Op
 
         # now we insert versions for the ops on which we depend...
         scalar_node = Apply(
@@ -19,7 +19,7 @@ from six.moves import xrange
 
 import theano
 from theano import gof
-from theano.compat import izip
+from theano.compat import izip, OrderedDict
 from six import integer_types, iteritems
 from six.moves import reduce
 from theano.gof import opt, InconsistencyError, TopoOptimizer, graph
@@ -287,7 +287,12 @@ def inplace_elemwise_optimizer_op(OP):
             else:
                 check_each_change = 1
 
-        nb_change_no_validate = 0
+        # The replacements done since the last validate, by node of the
+        # graph at the last validate: the replacements of a node changed
+        # many times go from its first to its last version. When the graph
+        # is not valid, the nodes whose replacements can be kept are found
+        # by bisection.
+        pending = OrderedDict()
         chk = fgraph.checkpoint()
 
         if fgraph.update_mapping:
@@ -325,6 +330,9 @@ def inplace_elemwise_optimizer_op(OP):
                                 not fgraph.destroyers(node.inputs[i]) and
                                 node.inputs[i] not in protected_inputs]
 
+            # The node in the graph at the last validate.
+            orig_node = node
+
             verbose = False
 
             raised_warning = not verbose
@@ -405,14 +413,39 @@ def inplace_elemwise_optimizer_op(OP):
                             *node.inputs, **dict(return_list=True))
                         new_node = new_outputs[0].owner
 
-                        for r, new_r in zip(node.outputs, new_outputs):
-                            fgraph.replace(r, new_r,
-                                           reason="inplace_elemwise_optimizer")
-                        nb_change_no_validate += 1
-                        if nb_change_no_validate >= check_each_change:
-                            fgraph.validate()
+                        node_chk = fgraph.checkpoint()
+                        try:
+                            for r, new_r in zip(node.outputs, new_outputs):
+                                fgraph.replace(
+                                    r, new_r,
+                                    reason="inplace_elemwise_optimizer")
+                        except Exception:
+                            fgraph.revert(node_chk)
+                            raise
+                        replacements = list(zip(orig_node.outputs,
+                                                new_outputs))
+                        pending[orig_node] = replacements
+                        if len(pending) >= check_each_change:
+                            candidates = list(pending.values())
+                            pending = OrderedDict()
+                            try:
+                                fgraph.validate()
+                                kept = candidates
+                            except (ValueError, InconsistencyError):
+                                fgraph.revert(chk)
+                                kept = []
+                                if len(candidates) > 1:
+                                    kept = fgraph.replace_all_validate_batch(
+                                        candidates,
+                                        reason="inplace_elemwise_optimizer")
                             chk = fgraph.checkpoint()
-                            nb_change_no_validate = 0
+                            if not any(k is replacements for k in kept):
+                                # The node is back to its version at the
+                                # last validate.
+                                node = orig_node
+                                baseline = node.op.inplace_pattern
+                                continue
+                            orig_node = new_node
                     except (ValueError, InconsistencyError) as e:
                         if check_each_change != 1 and not raised_warning:
                             print(("Some inplace optimization was not "
@@ -420,22 +453,25 @@ def inplace_elemwise_optimizer_op(OP):
                                   file=sys.stderr)
                             print(e, file=sys.stderr)
                             raised_warning = True
-                        fgraph.revert(chk)
                         continue
                     candidate_inputs.remove(candidate_input)
                     node = new_node
                     baseline = inplace_pattern
                     break
 
-        if nb_change_no_validate > 0:
+        if pending:
             try:
                 fgraph.validate()
-            except Exception:
+            except (ValueError, InconsistencyError):
                 if not raised_warning:
                     print(("Some inplace optimization was not "
                            "performed due to unexpected error"),
                           file=sys.stderr)
                 fgraph.revert(chk)
+                if len(pending) > 1:
+                    fgraph.replace_all_validate_batch(
+                        list(pending.values()),
+                        reason="inplace_elemwise_optimizer")
     return inplace_elemwise_optimizer
 
 inplace_elemwise_optimizer = inplace_elemwise_optimizer_op(T.Elemwise)
@@ -1172,6 +1172,46 @@ class TestElemwise(unittest_tools.InferShapeTester):
                              mode=theano.compile.Mode(linker='py'))
         g(*[numpy.zeros(2 ** 11, config.floatX) for i in xrange(6)])
 
+    def test_release_gil(self):
+        x = tensor.vector('x')
+        node = tensor.exp(x).owner
+        scalar_node = scalar.exp.make_node(scalar.float64())
+        assert scalar.exp.c_code_gil_free(scalar_node)
+        comp = scalar.Composite([scalar.float64()],
+                                [scalar.exp(scalar.float64())])
+        assert comp.c_code_gil_free(comp.make_node(scalar.float64()))
+        code = node.op.c_code(node, 'node', ['x'], ['z'],
+                              dict(fail='FAIL;', id=0))
+        assert 'PyEval_SaveThread' in code
+
+        # Scalar ops with their own c_code have to opt in.
+        class NoGILDeclOp(scalar.UnaryScalarOp):
+            def c_code(self, node, name, inputs, outputs, sub):
+                return '%s = %s;' % (outputs[0], inputs[0])
+        assert not NoGILDeclOp(scalar.upgrade_to_float).c_code_gil_free(
+            scalar_node)
+
+        if not theano.config.cxx:
+            raise SkipTest("G++ not available, so we need to skip this test.")
+        import threading
+        f = theano.function([x], tensor.exp(x) * 2)
+        f.set_reentrant()
+        xv = numpy.random.rand(config.elemwise_release_gil_minsize * 2)
+        xv = xv.astype(config.floatX)
+        results = []
+
+        def run():
+            for i in xrange(5):
+                results.append(f(xv))
+        threads = [threading.Thread(target=run) for i in xrange(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert len(results) == 20
+        for r in results:
+            unittest_tools.assert_allclose(r, numpy.exp(xv) * 2)
+
 
 def test_gt_grad():
     """A user test that failed.